@@ -95,5 +95,7 @@ add_python_test(openicpsr
 add_python_test(export
   PLUGIN wholetale
 )
+add_python_test(http_client PLUGIN wholetale)
+add_python_test(batch_register PLUGIN wholetale)
 add_python_style_test(python_static_analysis_wholetale
                       "${PROJECT_SOURCE_DIR}/plugins/wholetale/server")
@@ -0,0 +1,194 @@
+import mock
+from tests import base
+from girder import events
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+
+
+def setUpModule():
+    base.enabledPlugins.append("wholetale")
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class BatchRegisterTestCase(base.TestCase):
+    def setUp(self):
+        super(BatchRegisterTestCase, self).setUp()
+        self.user = self.model("user").createUser(
+            login="joeregular",
+            email="joe@dev.null",
+            firstName="Joe",
+            lastName="Regular",
+            password="secret",
+        )
+        self.parent = Folder().findOne({"parentId": self.user["_id"], "name": "Private"})
+
+        from server.lib.data_map import DataMap
+        from server.lib.import_item import ImportItem
+        from server.lib.import_providers import ImportProvider
+
+        class DummyProvider(ImportProvider):
+            listed = 0
+            version = None
+
+            def getVersion(self, dataMap, user):
+                return self.version
+
+            def _listRecursive(self, user, pid, name, base_url=None, progress=None):
+                self.listed += 1
+                yield ImportItem(ImportItem.FOLDER, name=name, identifier=pid)
+                yield ImportItem(
+                    ImportItem.FILE, "a.txt", identifier="doi:a",
+                    url="https://example.com/a.txt", size=10, mimeType="text/plain"
+                )
+                yield ImportItem(ImportItem.FOLDER, name="sub", identifier=pid)
+                for i in range(5):
+                    yield ImportItem(
+                        ImportItem.FILE, f"b{i}.txt", url=f"https://example.com/b{i}.txt",
+                        size=5, meta={"directIdentifier": f"b{i}"}
+                    )
+                yield ImportItem(ImportItem.END_FOLDER)
+                yield ImportItem(ImportItem.END_FOLDER)
+
+        self.provider = DummyProvider("Dummy")
+        self.dataMap = DataMap(
+            "doi:dataset", 35, doi="doi:dataset", name="dataset", repository="Dummy"
+        )
+
+    def _tree(self, folder):
+        tree = {}
+        for item in Folder().childItems(folder):
+            files = list(Item().childFiles(item))
+            self.assertEqual(len(files), 1)
+            tree[item["name"]] = (
+                item["size"], item["meta"], files[0]["linkUrl"], files[0]["size"]
+            )
+        for subfolder in Folder().childFolders(folder, "folder", user=self.user):
+            tree[subfolder["name"]] = (subfolder["size"], subfolder["meta"], self._tree(subfolder))
+        return tree
+
+    def testBatchRegistration(self):
+        from server.lib.batch_register import BatchRegistration
+
+        saved, created = [], []
+        with events.bound("model.item.save.after", "test", lambda e: saved.append(e.info)), \
+                events.bound("model.file.save.created", "test", lambda e: created.append(e.info)):
+            objType, root = BatchRegistration(self.provider, self.user, chunkSize=3).register(
+                self.parent, "folder", self.provider._listRecursive(self.user, "doi:dataset",
+                                                                    "dataset")
+            )
+        self.assertEqual(objType, "folder")
+        self.assertEqual(len(saved), 6)
+        # Other handlers than the core one propagating sizes are called
+        self.assertEqual(len(created), 6)
+        batched = self._tree(Folder().load(root["_id"], force=True))
+
+        self.assertEqual(batched["a.txt"], (
+            10, {"provider": "Dummy", "identifier": "doi:a"}, "https://example.com/a.txt", 10
+        ))
+        self.assertEqual(batched["sub"][0], 25)
+        self.assertEqual(Folder().load(root["_id"], force=True)["size"], 10)
+        self.assertEqual(batched["sub"][2]["b3.txt"][1], {
+            "provider": "Dummy", "directIdentifier": "b3"
+        })
+
+        # Registering again reuses everything
+        with mock.patch.object(Item().collection, "insert_many") as insert_many:
+            self.provider.register(self.parent, "folder", None, self.user, self.dataMap)
+        insert_many.assert_not_called()
+        self.assertEqual(self._tree(Folder().load(root["_id"], force=True)), batched)
+
+        # Same result as the per item registration
+        other = Folder().createFolder(self.parent, "other", creator=self.user)
+        with mock.patch("server.lib.import_providers.REGISTER_CHUNK_SIZE", 0):
+            objType, root = self.provider.register(
+                other, "folder", None, self.user, self.dataMap
+            )
+        self.assertEqual(self._tree(Folder().load(root["_id"], force=True)), batched)
+        self.assertEqual(len(list(File().find({"linkUrl": "https://example.com/a.txt"}))), 2)
+
+    def testRegistrationShortCircuit(self):
+        from server.lib import IMPORT_PROVIDERS, register_dataMap
+
+        with mock.patch.dict(IMPORT_PROVIDERS.providerMap, {"Dummy": self.provider}):
+            self.provider.version = "v1"
+            rootId = register_dataMap([self.dataMap], self.parent, "folder", user=self.user)
+            self.assertEqual(self.provider.listed, 1)
+            root = Folder().load(rootId[0], force=True)
+            self.assertEqual(root["registration"]["identifier"], "doi:dataset")
+            self.assertEqual(root["registration"]["version"], "v1")
+
+            # Same dataset in the same place, nothing is listed
+            self.assertEqual(
+                register_dataMap([self.dataMap], self.parent, "folder", user=self.user), rootId
+            )
+            self.assertEqual(self.provider.listed, 1)
+
+            # Stale or elsewhere, registered again
+            self.provider.version = "v2"
+            self.assertEqual(
+                register_dataMap([self.dataMap], self.parent, "folder", user=self.user), rootId
+            )
+            self.assertEqual(self.provider.listed, 2)
+            other = Folder().createFolder(self.parent, "other", creator=self.user)
+            self.assertNotEqual(
+                register_dataMap([self.dataMap], other, "folder", user=self.user), rootId
+            )
+            self.assertEqual(self.provider.listed, 3)
+
+            # A change made while the dataset is listed is noticed next time
+            listRecursive = self.provider._listRecursive
+
+            def changing(*args, **kwargs):
+                self.provider.version = "v3"
+                return listRecursive(*args, **kwargs)
+
+            self.provider.version = "v2.1"
+            with mock.patch.object(self.provider, "_listRecursive", changing):
+                register_dataMap([self.dataMap], self.parent, "folder", user=self.user)
+            root = Folder().load(rootId[0], force=True)
+            self.assertEqual(root["registration"]["version"], "v2.1")
+            register_dataMap([self.dataMap], self.parent, "folder", user=self.user)
+            self.assertEqual(self.provider.listed, 5)
+
+    def testCheckpoint(self):
+        from server.lib import IMPORT_PROVIDERS, register_dataMap
+        from server.lib.batch_register import BatchRegistration, RegistrationCheckpoint
+
+        def interrupted(importItems):
+            for i, item in enumerate(importItems):
+                if i == 6:
+                    raise RuntimeError("Worker lost")
+                yield item
+
+        checkpoint = RegistrationCheckpoint()
+        listing = self.provider._listRecursive(self.user, "doi:dataset", "dataset")
+        with self.assertRaises(RuntimeError):
+            BatchRegistration(
+                self.provider, self.user, chunkSize=2, checkpoint=checkpoint
+            ).register(self.parent, "folder", interrupted(listing))
+        self.assertEqual(checkpoint.path, ["dataset", "sub", "b2.txt"])
+        self.assertEqual((checkpoint.files, checkpoint.bytes), (4, 25))
+
+        listing = self.provider._listRecursive(self.user, "doi:dataset", "dataset")
+        objType, root = BatchRegistration(
+            self.provider, self.user, chunkSize=2, checkpoint=checkpoint
+        ).register(self.parent, "folder", listing)
+        self.assertEqual((checkpoint.files, checkpoint.bytes), (6, 35))
+        tree = self._tree(Folder().load(root["_id"], force=True))
+        self.assertEqual(sorted(tree["sub"][2]), [f"b{i}.txt" for i in range(5)])
+
+        # Data maps completed before the interruption are skipped
+        checkpoint = RegistrationCheckpoint(dataMap=1, imported=[root["_id"]])
+        with mock.patch.dict(IMPORT_PROVIDERS.providerMap, {"Dummy": self.provider}):
+            self.assertEqual(
+                register_dataMap(
+                    [self.dataMap], self.parent, "folder", user=self.user, checkpoint=checkpoint
+                ),
+                [root["_id"]],
+            )
+        self.assertEqual(self.provider.listed, 2)
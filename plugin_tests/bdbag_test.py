@@ -1,3 +1,4 @@
+import hashlib
 import json
 import mock
 import os
@@ -220,6 +221,12 @@ class BDBagFullTestCase(base.TestCase):
             bdbag.validate_bag(bag_path, fast=True)
             bdbag.validate_bag(bag_path, fast=False)
 
+            # Payload manifests list workspace files for every algorithm
+            for alg in ("md5", "sha1", "sha256"):
+                chksum = hashlib.new(alg, b"vim\n").hexdigest()
+                with open(os.path.join(bag_path, f"manifest-{alg}.txt"), "r") as fp:
+                    self.assertIn(f"{chksum} data/workspace/apt.txt", fp.read())
+
             # Confirm image digest.
             manifest_fs_path = os.path.join(bag_path, "metadata/manifest.json")
             with open(manifest_fs_path, 'r') as fp:
@@ -1,3 +1,4 @@
+import mock
 import vcr
 import pytest
 import json
@@ -167,6 +168,110 @@ class TestDataONERegister(base.TestCase):
             metadata = set()
             check_multiple_maps(metadata)
 
+    def test_query_docs(self):
+        from server.lib.dataone import register
+
+        docs = [{"identifier": str(i)} for i in range(5)]
+
+        def fake_query(q, base_url=None, fields=None, rows=1000, start=0):
+            return {
+                "responseHeader": {"status": 0},
+                "response": {"numFound": len(docs), "docs": docs[start:start + rows]},
+            }
+
+        for prefetch in (False, True):
+            with mock.patch.object(register, "query", side_effect=fake_query) as mock_query:
+                result = register.query_docs("q", fields=["identifier"], rows=2,
+                                             prefetch=prefetch)
+                self.assertEqual(next(result), docs[0])
+                self.assertEqual(list(result), docs[1:])
+            self.assertEqual(
+                [call[1]["start"] for call in mock_query.call_args_list], [0, 2, 4]
+            )
+
+    def test_provider_memo(self):
+        from server.lib.dataone import DataONELocations
+        from server.lib.dataone.provider import DataOneImportProvider
+        from server.lib.dataone.register import may_be_dataone_pid
+        from server.lib.entity import Entity
+
+        self.assertTrue(may_be_dataone_pid("urn:uuid:6f5533ab-6508-4ac7-82a3-1df88ed4580e"))
+        self.assertTrue(may_be_dataone_pid("https://search.dataone.org/view/doi:10.5065/D6862DM8"))
+        self.assertFalse(may_be_dataone_pid("https://example.org/data.csv"))
+
+        provider = DataOneImportProvider()
+        docs = [
+            {"identifier": "meta", "formatType": "METADATA", "title": "Title", "size": 1},
+            {"identifier": "data", "formatType": "DATA", "size": 2},
+        ]
+        with mock.patch(
+            "server.lib.dataone.provider.get_package_pid", return_value="resource_map"
+        ) as mock_pid, mock.patch(
+            "server.lib.dataone.provider.get_documents", return_value=docs
+        ) as mock_docs:
+            entity = Entity("https://example.org/data.csv", self.user)
+            entity["base_url"] = DataONELocations.prod_cn
+            self.assertFalse(provider.matches(entity))
+            mock_pid.assert_not_called()
+
+            entity = Entity("https://search.dataone.org/view/resource_map", self.user)
+            entity["base_url"] = DataONELocations.prod_cn
+            self.assertTrue(provider.matches(entity))
+            data_map = provider.lookup(entity)
+            self.assertEqual(data_map.size, 3)
+            provider.lookup(entity)
+            self.assertEqual(mock_pid.call_count, 1)
+            self.assertEqual(mock_docs.call_count, 1)
+
+    def test_list_recursive_order(self):
+        import random
+        import time
+        from server.lib.dataone import DataONELocations
+        from server.lib.dataone.provider import DataOneImportProvider
+        from server.lib.import_item import ImportItem
+
+        # root -> child0 (-> grandchild0, grandchild1), child1, child2
+        tree = {
+            "root": ["child0", "child1", "child2"],
+            "child0": ["grandchild0", "grandchild1"],
+        }
+
+        def fake_get_documents(pid, base_url):
+            time.sleep(random.uniform(0, 0.05))
+            docs = [
+                {"identifier": f"{pid}_meta", "formatType": "METADATA", "title": pid,
+                 "documents": [], "size": 1, "formatId": "eml",
+                 "checksum": "abc", "checksumAlgorithm": "MD5"},
+                {"identifier": f"{pid}_data", "formatType": "DATA", "fileName": f"{pid}.csv",
+                 "size": 1, "formatId": "text/csv",
+                 "checksum": "abc", "checksumAlgorithm": "MD5"},
+            ]
+            docs += [{"identifier": child, "formatType": "RESOURCE"}
+                     for child in tree.get(pid, [])]
+            return docs
+
+        with mock.patch(
+            "server.lib.dataone.provider.get_documents", side_effect=fake_get_documents
+        ), mock.patch(
+            "server.lib.dataone.register.get_documents", side_effect=fake_get_documents
+        ):
+            items = list(DataOneImportProvider()._listRecursive(
+                self.user, "root", None, base_url=DataONELocations.prod_cn))
+
+        names = [
+            item.name if item.type != ImportItem.END_FOLDER else "/" for item in items
+        ]
+        self.assertEqual(names, [
+            "root", "root.csv",
+            "child0", "child0.csv",
+            "grandchild0", "grandchild0.csv", "/",
+            "grandchild1", "grandchild1.csv", "/",
+            "/",
+            "child1", "child1.csv", "/",
+            "child2", "child2.csv", "/",
+            "/",
+        ])
+
     @vcr.use_cassette(os.path.join(DATA_PATH, 'test_get_package_list_nested.txt'))
     def test_get_package_list_nested(self):
         # Test that we're getting all of the files in a nested package
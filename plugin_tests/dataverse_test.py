@@ -442,6 +442,78 @@ class DataverseHarversterTestCase(base.TestCase):
         # tale = provider.proto_tale_from_datamap(DataMap.fromDict(datamap), self.user, True)
         # self.assertEqual(tale["authors"][0]["firstName"], "Pooran")
 
+    @responses.activate
+    def testSanitizeFiles(self):
+        from urllib.parse import urlparse
+        from server.lib.dataverse.provider import DataverseImportProvider
+
+        access_url = "https://dataverse.example.org/api/access/datafile/"
+        responses.add(
+            responses.HEAD,
+            access_url + "2?format=original",
+            status=200,
+            headers={
+                "Content-Length": "300",
+                "Content-Disposition": 'attachment; filename="b.csv"',
+            },
+        )
+        for fileId, size in (("1", 1234), ("2", 567)):
+            responses.add(
+                responses.GET,
+                access_url + fileId,
+                status=206,
+                headers={"Content-Range": f"bytes 0-0/{size}"},
+                body="x",
+            )
+
+        tab = "text/tab-separated-values"
+        files = [
+            {
+                "id": 1, "filename": "a.tab", "filesize": 1000, "mimeType": tab,
+                "checksum": "md5:aaa", "originalFileName": "a.xlsx",
+                "originalFileSize": 2000, "unf": "UNF:6:abc==",
+            },
+            # As returned by the search API
+            {"id": 2, "filename": "b.tab", "filesize": 500, "mimeType": tab, "checksum": "md5:bbb"},
+            {"id": 3, "filename": "c.txt", "filesize": 10, "mimeType": "text/plain",
+             "checksum": "md5:ccc"},
+        ]
+        url = urlparse(
+            "https://dataverse.example.org/dataset.xhtml?persistentId=doi:10.5072/FK2/ABC"
+        )
+
+        def sanitize(headers=None):
+            return [
+                (obj["filename"], obj["filesize"], obj.get("checksum"), obj.get("unf"),
+                 obj["url"])
+                for obj in DataverseImportProvider._sanitize_files(
+                    url, [obj.copy() for obj in files], headers=headers
+                )
+            ]
+
+        expected = [
+            ("a.xlsx", 2000, "md5:aaa", None, access_url + "1?format=original"),
+            ("a.tab", 1234, None, "UNF:6:abc==", access_url + "1"),
+            ("b.csv", 300, "md5:bbb", None, access_url + "2?format=original"),
+            ("b.tab", 567, None, None, access_url + "2"),
+            ("c.txt", 10, "md5:ccc", None, access_url + "3"),
+        ]
+        self.assertEqual(sanitize(), expected)
+        self.assertEqual(len(responses.calls), 3)
+        for call in responses.calls:
+            if call.request.method == "GET":
+                self.assertEqual(call.request.headers["Range"], "bytes=0-0")
+
+        # Probed attributes are cached
+        self.assertEqual(sanitize(), expected)
+        self.assertEqual(len(responses.calls), 3)
+
+        # ...separately for every API key
+        headers = {"X-Dataverse-key": "secret"}
+        for _ in range(2):
+            self.assertEqual(sanitize(headers=headers), expected)
+            self.assertEqual(len(responses.calls), 6)
+
     def tearDown(self):
         self.model('user').remove(self.user)
         self.model('user').remove(self.admin)
@@ -1,7 +1,11 @@
+import hashlib
+import io
 import json
+import zipfile
 
 import httmock
 import mock
+import requests
 
 from tests import base
 
@@ -89,8 +93,10 @@ class ExportTestCase(base.TestCase):
             manifest = resp.json
 
         from server.lib.exporters.bag import BagTaleExporter
+        from server.lib.exporters.registry import registry_tags
 
         exporter = BagTaleExporter(self.user, manifest, {})
+        registry_tags.clear()
 
         @httmock.urlmatch(
             scheme="https",
@@ -114,6 +120,8 @@ class ExportTestCase(base.TestCase):
             )
             self.assertTrue("jupyter-repo2docker" not in tmpl)
 
+        registry_tags.clear()
+
         @httmock.urlmatch(
             scheme="https",
             netloc="images.local.wholetale.org",
@@ -143,3 +151,182 @@ class ExportTestCase(base.TestCase):
                 "token",
             )
             self.assertTrue("jupyter-repo2docker" in tmpl)
+
+    def test_registry_tag_cache(self):
+        from server.lib.exporters.registry import RegistryTagCache
+
+        class LocalRegistry:
+            def __init__(self):
+                self.repositories = {"tale/hash": ["tag"]}
+                self.calls = 0
+
+            def list_tags(self, registry, repository):
+                self.calls += 1
+                return self.repositories.get(repository)
+
+        client = LocalRegistry()
+        cache = RegistryTagCache(client=client, ttl=300, negative_ttl=30)
+        with mock.patch("time.monotonic", return_value=1000):
+            self.assertTrue(cache.has_tag("images.local", "tale/hash", "tag"))
+            self.assertTrue(cache.has_tag("images.local", "tale/hash", "tag"))
+            self.assertFalse(cache.has_tag("images.local", "tale/hash", "other"))
+            self.assertFalse(cache.has_tag("images.local", "tale/missing", "tag"))
+            self.assertFalse(cache.has_tag("images.local", "tale/missing", "tag"))
+        self.assertEqual(client.calls, 2)
+
+        # Negative entries expire first
+        client.repositories["tale/missing"] = ["tag"]
+        with mock.patch("time.monotonic", return_value=1060):
+            self.assertTrue(cache.has_tag("images.local", "tale/hash", "tag"))
+            self.assertTrue(cache.has_tag("images.local", "tale/missing", "tag"))
+        self.assertEqual(client.calls, 3)
+
+        with mock.patch("time.monotonic", return_value=1400):
+            self.assertTrue(cache.has_tag("images.local", "tale/hash", "tag"))
+        self.assertEqual(client.calls, 4)
+
+    def test_remote_checksum_verifier(self):
+        from server.lib.exporters.remote_checksums import RemoteChecksumVerifier
+        from server.models.remote_checksum_cache import RemoteChecksumCache
+
+        url = "https://example.org/data.csv"
+        content = {"body": b"a,b\n1,2\n"}
+        methods = []
+
+        @httmock.urlmatch(scheme="https", netloc="example.org", path="^/data.csv$")
+        def mockFile(url, request):
+            methods.append(request.method)
+            return httmock.response(
+                status_code=200, content=content["body"], headers={"ETag": '"v1"'}
+            )
+
+        @httmock.urlmatch(scheme="https", netloc="example.org", path="^/missing.csv$")
+        def mockMissing(url, request):
+            return httmock.response(status_code=404, content=b"Not Found")
+
+        @httmock.urlmatch(scheme="https", netloc="down.example.org")
+        def mockDown(url, request):
+            raise requests.exceptions.ConnectionError("Connection refused")
+
+        with httmock.HTTMock(mockFile, mockMissing, mockDown, mockOtherRequest):
+            verifier = RemoteChecksumVerifier(max_workers=2)
+            verifier.submit(url)
+            self.assertEqual(verifier.md5(url), hashlib.md5(content["body"]).hexdigest())
+            verifier.close()
+            self.assertEqual(
+                RemoteChecksumCache().get(url, ('"v1"', None)),
+                {"md5": hashlib.md5(content["body"]).hexdigest()},
+            )
+
+            self.assertEqual(methods, ["HEAD", "GET"])
+
+            # Unchanged ETag means the cached checksum is used, without a download
+            content["body"] = b"changed"
+            verifier = RemoteChecksumVerifier(max_workers=2)
+            self.assertEqual(verifier.md5(url), hashlib.md5(b"a,b\n1,2\n").hexdigest())
+            verifier.close()
+            self.assertEqual(methods, ["HEAD", "GET", "HEAD"])
+
+            # Files that cannot be downloaded have no checksum
+            verifier = RemoteChecksumVerifier(max_workers=2)
+            self.assertIsNone(verifier.md5("https://example.org/missing.csv"))
+            self.assertIsNone(verifier.md5("https://down.example.org/data.csv"))
+            verifier.close()
+
+    def test_zip_compression_policy(self):
+        from server.lib.exporters.zipstream import CompressionPolicy, ZipGenerator
+
+        policy = CompressionPolicy(level=6, workers=2, parallel_threshold=1024)
+        self.assertEqual(policy.compress_type("data/table.parquet"), zipfile.ZIP_STORED)
+        self.assertEqual(policy.compress_type("img", "image/png"), zipfile.ZIP_STORED)
+        self.assertEqual(policy.compress_type("img", "image/svg+xml"), zipfile.ZIP_DEFLATED)
+        self.assertEqual(policy.compress_type("notes.txt", "text/plain"), zipfile.ZIP_DEFLATED)
+        self.assertEqual(
+            CompressionPolicy(level=0).compress_type("notes.txt"), zipfile.ZIP_STORED
+        )
+
+        files = {
+            "notes.txt": b"lorem ipsum " * 1000,
+            "archive.gz": bytes(range(256)) * 10,
+            "large.csv": b"1,2,3\n" * 100000,  # compressed in parallel
+            "empty.txt": b"",
+        }
+        zip_generator = ZipGenerator("root", policy=policy)
+        archive = io.BytesIO()
+        for path, content in files.items():
+            chunks = [content[i:i + 4096] for i in range(0, len(content), 4096)]
+            for data in zip_generator.addFile(lambda c=chunks: c, path, size=len(content)):
+                archive.write(data)
+        archive.write(zip_generator.footer())
+
+        with zipfile.ZipFile(archive) as zf:
+            self.assertIsNone(zf.testzip())
+            for path, content in files.items():
+                self.assertEqual(zf.read(f"root/{path}"), content)
+            # Stored members are deflated with level 0, see ZipGenerator.addFile
+            stored = zf.getinfo("root/archive.gz")
+            self.assertEqual(stored.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertGreaterEqual(stored.compress_size, stored.file_size)
+            self.assertEqual(zf.getinfo("root/large.csv").compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_tar_stream(self):
+        import tarfile
+        import tempfile
+        from server.lib.exporters.tarstream import (
+            IterStream,
+            TarGenerator,
+            extract_tar_stream,
+        )
+
+        files = {
+            "workspace/notes.txt": b"lorem ipsum " * 200000,
+            "metadata/manifest.json": b"{}",
+        }
+        for codec in ("zst", "gz"):
+            for workers in (1, 2):
+                tar_generator = TarGenerator("root", codec=codec, workers=workers)
+                archive = io.BytesIO()
+                for path, content in files.items():
+                    chunks = [content[i:i + 65536] for i in range(0, len(content), 65536)]
+                    size = len(content) if path.startswith("workspace") else None
+                    for data in tar_generator.addFile(lambda c=chunks: c, path, size=size):
+                        archive.write(data)
+                archive.write(tar_generator.footer())
+
+                archive.seek(0)
+                tmpdir = tempfile.mkdtemp()
+                names = extract_tar_stream(IterStream(archive), tmpdir, codec)
+                self.assertEqual(names, [f"root/{path}" for path in files])
+                for path, content in files.items():
+                    with open(f"{tmpdir}/root/{path}", "rb") as fp:
+                        self.assertEqual(fp.read(), content)
+
+        # Members may not escape the destination
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            info = tarfile.TarInfo("../evil.txt")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+        archive.seek(0)
+        with self.assertRaises(ValueError):
+            extract_tar_stream(IterStream(archive), tempfile.mkdtemp(), "gz")
+
+        # Size of a file changed while it was being archived
+        tar_generator = TarGenerator("root", codec="gz", workers=1)
+        with self.assertRaises(RuntimeError):
+            for _ in tar_generator.addFile(lambda: [b"abc"], "file.txt", size=4):
+                pass
+
+    def test_bytes_from_file(self):
+        import tempfile
+        from server.lib.exporters import TaleExporter
+
+        content = bytes(range(256)) * 1000
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(content)
+            fp.flush()
+            chunks = []
+            for chunk in TaleExporter.bytes_from_file(fp.name, chunksize=4096):
+                self.assertLessEqual(len(chunk), 4096)
+                chunks.append(bytes(chunk))
+        self.assertEqual(b"".join(chunks), content)
@@ -0,0 +1,60 @@
+import mock
+import responses
+from tests import base
+
+
+def setUpModule():
+    base.enabledPlugins.append("wholetale")
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class HttpClientTestCase(base.TestCase):
+    def test_sessions(self):
+        from server.lib import http_client
+
+        session = http_client.get_session("https://example.org/foo")
+        self.assertIs(session, http_client.get_session("https://EXAMPLE.org/bar"))
+        self.assertIsNot(session, http_client.get_session("https://example.com/foo"))
+
+    @responses.activate
+    def test_request(self):
+        from server.lib import http_client
+
+        responses.get(
+            "https://example.org/login",
+            body="ok",
+            headers={"Set-Cookie": "session=secret; Path=/"},
+        )
+        resp = http_client.get("https://example.org/login")
+        self.assertEqual(resp.text, "ok")
+        # Sessions are shared between users, so they must not keep cookies
+        self.assertEqual(len(http_client.get_session("https://example.org").cookies), 0)
+
+        with mock.patch.object(
+            http_client.get_session("https://example.org"), "request"
+        ) as mock_request:
+            http_client.head("https://example.org/file")
+            http_client.get("https://example.org/file", timeout=1)
+        self.assertEqual(
+            mock_request.call_args_list[0][1],
+            {
+                "timeout": (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT),
+                "allow_redirects": False,
+            },
+        )
+        self.assertEqual(mock_request.call_args_list[1][1]["timeout"], 1)
+
+    def test_retry_backoff(self):
+        from server.lib.http_client import JitteredRetry
+
+        retry = JitteredRetry(total=5, backoff_factor=1, status_forcelist=(503,))
+        for _ in range(3):
+            retry = retry.increment(method="GET", url="/")
+        for _ in range(20):
+            self.assertTrue(0 <= retry.get_backoff_time() <= 4)
+        self.assertTrue(retry.is_retry("GET", 503))
+        self.assertFalse(retry.is_retry("POST", 503))
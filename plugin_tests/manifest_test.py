@@ -173,6 +173,8 @@ class ManifestTestCase(base.TestCase):
             authors=self.tale_info["authors"],
         )
 
+        from server.lib.image_tag import environment_fingerprint
+
         self.tale["imageInfo"] = {
             "digest": (
                 "registry.local.wholetale.org/5c8fe826da39aa00013e9609/1552934951@"
@@ -181,7 +183,8 @@ class ManifestTestCase(base.TestCase):
             "jobId": ObjectId("5c9009deda39aa0001d702b7"),
             "last_build": 1552943449,
             "repo2docker_version": "craigwillis/repo2docker:latest",
-            "status": 3
+            "status": 3,
+            "fingerprint": environment_fingerprint(self.tale),
         }
         self.model('tale', 'wholetale').save(self.tale)
 
@@ -437,9 +440,13 @@ class ManifestTestCase(base.TestCase):
             Manifest(tale_blank_orcid, self.user)
 
     def _test_create_image_info(self):
+        from girder.models.token import Token
         from server.lib.manifest import Manifest
 
+        # Tale was built, so there's no need to call back to Girder
+        ntokens = Token().collection.count_documents({})
         manifest = Manifest(self.tale, self.user).manifest
+        self.assertEqual(Token().collection.count_documents({}), ntokens)
         self.assertTrue(len(manifest['schema:hasPart']))
 
         r2d_block = manifest['schema:hasPart'][0]
@@ -453,6 +460,99 @@ class ManifestTestCase(base.TestCase):
         self.assertEqual(digest_block['schema:applicationCategory'], 'DockerImage')
         self.assertEqual(digest_block['@type'], 'schema:SoftwareApplication')
 
+        # The environment changed since the build, imageInfo is stale
+        from server.lib.image_tag import IMAGE_TAGS, environment_fingerprint
+
+        tale = dict(self.tale, config={"environment": ["FOO=bar"]})
+        self.assertEqual(IMAGE_TAGS.get(tale, environment_fingerprint(tale)), (None, None))
+
+        # So is the one of a Tale without a workspace
+        tale = dict(self.tale, workspaceId=ObjectId())
+        self.assertEqual(IMAGE_TAGS.get(tale, environment_fingerprint(tale)), (None, None))
+
+    @mock.patch("gwvolman.build_utils.ImageBuilder")
+    def test_manifest_cache(self, mock_builder):
+        from server.lib.manifest import Manifest
+        from server.models.manifest_cache import ManifestCache
+
+        mock_builder.return_value.container_config.repo2docker_version = \
+            self.tale["imageInfo"]["repo2docker_version"]
+        mock_builder.return_value.get_tag.return_value = \
+            self.tale['imageInfo']['digest'].replace('registry', 'images', 1)
+
+        # Mongo truncates timestamps, use the stored version of the Tale
+        tale = self.model("tale", "wholetale").load(self.tale["_id"], force=True)
+        manifest = Manifest(tale, self.user, cache=True)
+        self.assertIsNotNone(ManifestCache().get(manifest.etag))
+        cached = Manifest(tale, self.user, cache=True)
+        self.assertEqual(manifest.etag, cached.etag)
+        self.assertEqual(manifest.dump_manifest(), cached.dump_manifest())
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/manifest",
+            method="GET",
+            user=self.user,
+            additionalHeaders=[("If-None-Match", f'"{manifest.etag}"')],
+            isJson=False,
+        )
+        self.assertStatus(resp, 304)
+
+        # Manifests depend on the access of the requesting user
+        self.assertNotEqual(Manifest(tale, self.admin, cache=True).etag, manifest.etag)
+
+        workspace = self.model("folder").load(tale["workspaceId"], force=True)
+        with open(os.path.join(workspace["fsPath"], "new_file.txt"), "w") as f:
+            f.write("new content\n")
+        changed = Manifest(tale, self.user, cache=True)
+        self.assertNotEqual(manifest.etag, changed.etag)
+        self.assertTrue(
+            any(
+                agg["uri"] == "./workspace/new_file.txt"
+                for agg in changed.manifest["aggregates"]
+            )
+        )
+        os.remove(os.path.join(workspace["fsPath"], "new_file.txt"))
+
+        self.model("tale", "wholetale").save(tale)
+        self.assertIsNone(ManifestCache().get(manifest.etag))
+
+    @mock.patch("gwvolman.build_utils.ImageBuilder")
+    def test_model_cache(self, mock_builder):
+        from girder.models.folder import Folder
+        from server.lib.manifest import Manifest
+        from server.lib.model_cache import ModelCache
+
+        mock_builder.return_value.container_config.repo2docker_version = \
+            self.tale["imageInfo"]["repo2docker_version"]
+        mock_builder.return_value.get_tag.return_value = \
+            self.tale['imageInfo']['digest'].replace('registry', 'images', 1)
+
+        models = ModelCache()
+        Manifest(self.tale, self.user, models=models)
+        # Tale creator and version creator are the same user
+        self.assertGreater(models.hits, 0)
+        misses = models.misses
+
+        private = next(
+            Folder().childFolders(
+                self.user, "user", user=self.user, filters={"name": "Private"}
+            )
+        )
+        self.assertEqual(
+            models.load(Folder(), private["_id"], user=self.user)["_id"], private["_id"]
+        )
+        self.assertEqual(models.misses, misses + 1)
+        with self.assertRaises(AccessException):
+            models.load(Folder(), private["_id"], user=self.userHenry)
+        with self.assertRaises(AccessException):
+            models.load(Folder(), private["_id"], user=self.userHenry, exc=True)
+        self.assertEqual(models.misses, misses + 1)
+        self.assertIsNone(models.load(Folder(), ObjectId(), user=self.user))
+        with self.assertRaises(ValidationException):
+            models.load(Folder(), ObjectId(), user=self.user, exc=True)
+        with self.assertRaises(ValidationException):
+            models.load(Folder(), "not an id")
+
     def test_dataset_roundtrip(self):
         from server.lib.manifest_parser import ManifestParser
         from server.lib.manifest import Manifest
@@ -476,6 +576,28 @@ class ManifestTestCase(base.TestCase):
             [str(_["itemId"]) for _ in self.tale["dataSet"]]
         )
 
+    def test_dataset_item_without_file(self):
+        from server.lib.manifest import Manifest
+
+        root = "/collection/WholeTale Catalog/WholeTale Catalog"
+        folder = lookUpPath(os.path.join(root, "gwosc.org"))["document"]
+        item = self.model("item").createItem("no_file.txt", self.admin, folder)
+        tale = copy.deepcopy(self.tale)
+        tale["dataSet"].append(
+            {"itemId": item["_id"], "mountPath": item["name"], "_modelType": "item"}
+        )
+        aggregates = Manifest(tale, self.user).manifest["aggregates"]
+        self.assertEqual(
+            len(aggregates), len(Manifest(self.tale, self.user).manifest["aggregates"])
+        )
+        self.assertFalse(
+            any(
+                agg.get("bundledAs", {}).get("filename") == item["name"]
+                for agg in aggregates
+            )
+        )
+        self.model("item").remove(item)
+
     def tearDown(self):
         self.model("user").remove(self.user)
         self.model("user").remove(self.admin)
@@ -1,4 +1,6 @@
 import json
+import requests
+import responses
 from tests import base
 from girder.models.user import User
 
@@ -72,6 +74,108 @@ class RepositoryTestCase(base.TestCase):
                     )
                 )
 
+    @responses.activate
+    def testPartialLookup(self):
+        for name in ("a.csv", "b.csv"):
+            responses.add(
+                responses.HEAD,
+                "https://example.com/" + name,
+                status=200,
+                headers={"Content-Length": "10"},
+            )
+        dataIds = [
+            "https://example.com/b.csv",
+            "https://wrong.url",
+            "https://example.com/a.csv",
+        ]
+        resp = self.request(
+            path="/repository/lookup",
+            method="GET",
+            params={"dataId": json.dumps(dataIds), "partial": True},
+        )
+        self.assertStatusOk(resp)
+        self.assertEqual(
+            [x.get("name") for x in resp.json], ["a.csv", "b.csv", None]
+        )
+        self.assertEqual(resp.json[2]["dataId"], "https://wrong.url")
+        self.assertTrue(
+            resp.json[2]["error"].startswith('Lookup for "https://wrong.url" failed with:')
+        )
+
+        from server.lib import PidError, pids_to_entities
+
+        for workers in (1, 4):
+            results = pids_to_entities(dataIds, partial=True, workers=workers)
+            self.assertEqual(results[0].dataId, "https://example.com/b.csv")
+            self.assertIsInstance(results[1], PidError)
+            self.assertEqual(results[2].dataId, "https://example.com/a.csv")
+
+        with self.assertRaises(RuntimeError):
+            pids_to_entities(dataIds)
+
+    @responses.activate
+    def testResolutionCache(self):
+        from server.lib import RESOLVERS
+        from server.lib.entity import Entity
+        from server.lib.resolvers import ResolutionException
+
+        doi = "10.5281/zenodo.123"
+        responses.add(
+            responses.HEAD,
+            "https://doi.org/" + doi,
+            status=302,
+            headers={"Location": "https://zenodo.org/record/123"},
+        )
+        responses.add(responses.HEAD, "https://zenodo.org/record/123", status=200)
+        responses.add(responses.HEAD, "https://doi.org/10.5281/blah", status=404)
+
+        for _ in range(2):
+            entity = RESOLVERS.resolve(Entity("doi:" + doi, self.user))
+            self.assertEqual(entity.getValue(), "https://zenodo.org/record/123")
+            self.assertEqual(entity["DOI"], doi)
+        self.assertEqual(len(responses.calls), 2)
+
+        # Failures are cached too
+        for _ in range(2):
+            with self.assertRaises(ResolutionException):
+                RESOLVERS.resolve(Entity("https://doi.org/10.5281/blah", self.user))
+        self.assertEqual(len(responses.calls), 3)
+
+        # ...but not when doi.org is unavailable
+        responses.add(responses.HEAD, "https://doi.org/10.5281/busy", status=429)
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                RESOLVERS.resolve(Entity("doi:10.5281/busy", self.user))
+        self.assertEqual(len(responses.calls), 5)
+
+        resp = self.request(
+            path="/wholetale/resolution_cache", method="DELETE", user=self.user
+        )
+        self.assertStatus(resp, 403)
+
+        resp = self.request(
+            path="/wholetale/resolution_cache",
+            method="DELETE",
+            user=self.admin,
+            params={"identifier": "https://doi.org/" + doi},
+        )
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {"removed": 1})
+        RESOLVERS.resolve(Entity(doi, self.user))
+        self.assertEqual(len(responses.calls), 7)
+
+        resp = self.request(
+            path="/wholetale/resolution_cache",
+            method="DELETE",
+            user=self.admin,
+            params={"failuresOnly": True},
+        )
+        self.assertEqual(resp.json, {"removed": 1})
+        resp = self.request(
+            path="/wholetale/resolution_cache", method="DELETE", user=self.admin
+        )
+        self.assertEqual(resp.json, {"removed": 1})
+
     def testPublishers(self):
         # This assumes some defaults that probably should be set here instead...
         resp = self.request(path="/repository", method="GET")
@@ -2,6 +2,8 @@ import bagit
 from bdbag import bdbag_api as bdb
 from bson import ObjectId
 from datetime import datetime
+import hashlib
+import io
 import httmock
 import json
 import mock
@@ -635,6 +637,14 @@ class TaleTestCase(base.TestCase):
         # Check that we have proper license
         self.assertIn(b"Commons Universal 1.0 Public Domain", license_text)
 
+        # Check that workspace files were annotated while being streamed
+        agg = next(
+            _ for _ in first_manifest["aggregates"] if _["uri"] == "./workspace/test_file.txt"
+        )
+        self.assertEqual(agg["wt:size"], 12)
+        self.assertEqual(agg["wt:md5"], hashlib.md5(b"Hello World!").hexdigest())
+        self.assertEqual(agg["wt:mimeType"], "text/plain")
+
         # First export should have created a version.
         # Let's grab it and explicitly use the versionId for 2nd dump
         resp = self.request(
@@ -662,6 +672,142 @@ class TaleTestCase(base.TestCase):
         self.assertEqual(first_manifest, second_manifest)
         self.model('tale', 'wholetale').remove(tale)
 
+    @mock.patch("girder.plugins.wholetale.lib.manifest.ImageBuilder")
+    def test_prebuilt_export(self, mock_builder):
+        from girder.models.user import User
+        from girder.plugins.jobs.models.job import Job
+
+        mock_builder.return_value.container_config.repo2docker_version = \
+            "craigwillis/repo2docker:latest"
+        mock_builder.return_value.get_tag.return_value = \
+            "images.local.wholetale.org/tale/name:123"
+        tale = Tale().createTale(
+            self.image, [], creator=self.user, title="Prebuilt export", public=False,
+            authors=self.authors,
+        )
+        workspace = Folder().load(tale["workspaceId"], force=True)
+        with open(os.path.join(workspace["fsPath"], "test_file.txt"), "wb") as f:
+            f.write(b"Hello World!")
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="POST", user=self.user
+        )
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json["message"], "Tale has no versions.")
+
+        reader = User().createUser(
+            login="reader", email="reader@dev.null", firstName="Read", lastName="Only",
+            password="secret",
+        )
+        tale = Tale().setUserAccess(tale, reader, AccessType.READ, save=True)
+        resp = self.request(
+            path="/version", method="POST", user=self.user,
+            params={"taleId": tale["_id"], "name": "v1"},
+        )
+        self.assertStatusOk(resp)
+        params = {"versionId": resp.json["_id"]}
+
+        # Readers cannot store exports
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="POST", user=reader, params=params
+        )
+        self.assertStatus(resp, 403)
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="POST", user=self.user, params=params
+        )
+        self.assertStatusOk(resp)
+        job = Job().load(resp.json["jobId"], force=True)
+        for _ in range(100):
+            job = Job().load(job["_id"], force=True)
+            if job["status"] in {JobStatus.SUCCESS, JobStatus.ERROR}:
+                break
+            time.sleep(0.1)
+        self.assertEqual(job["status"], JobStatus.SUCCESS)
+
+        # Building again is a no-op
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="POST", user=self.user, params=params
+        )
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json["jobId"], str(job["_id"]))
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="GET", isJson=False, user=self.user,
+            params=params,
+        )
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.headers["Accept-Ranges"], "bytes")
+        etag = resp.headers["ETag"]
+        body = self.getBody(resp, text=False)
+        with zipfile.ZipFile(io.BytesIO(body), "r") as zip_archive:
+            self.assertTrue(
+                any(_.endswith("workspace/test_file.txt") for _ in zip_archive.namelist())
+            )
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="GET", isJson=False, user=self.user,
+            params=params, additionalHeaders=[("Range", "bytes=10-19")],
+        )
+        self.assertStatus(resp, 206)
+        self.assertEqual(self.getBody(resp, text=False), body[10:20])
+
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="GET", isJson=False, user=self.user,
+            params=params, additionalHeaders=[("If-None-Match", etag)],
+        )
+        self.assertStatus(resp, 304)
+
+        # ...but they are served the same export
+        resp = self.request(
+            path=f"/tale/{tale['_id']}/export", method="GET", isJson=False, user=reader,
+            params=params,
+        )
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(self.getBody(resp, text=False), body)
+        User().remove(reader)
+        Tale().remove(tale)
+
+    def test_checksum_cache(self):
+        from server.lib.exporters.native import NativeTaleExporter
+        from server.models.checksum_cache import ChecksumCache
+
+        content = b"Hello World!"
+        checksums = {
+            alg: hashlib.new(alg, content).hexdigest() for alg in ("md5", "sha1", "sha256")
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "test_file.txt")
+            with open(path, "wb") as f:
+                f.write(content)
+            os.utime(path, (time.time() - 60, time.time() - 60))
+            stat = os.stat(path)
+            self.assertIsNone(ChecksumCache().get(stat, ["md5"]))
+
+            # Stale entry is detected when the file is read
+            ChecksumCache().put(stat, dict(checksums, md5="bogus"), "text/bogus")
+            self.assertEqual(ChecksumCache().get(stat, ["md5"])["md5"], "bogus")
+            exporter = NativeTaleExporter(
+                self.user, {"dct:hasVersion": {"@id": "version"}, "aggregates": []}, {}
+            )
+            list(exporter.dump_file(path, "workspace/test_file.txt"))
+            self.assertEqual(
+                dict(exporter.state["sha256"])["workspace/test_file.txt"], checksums["sha256"]
+            )
+            info = exporter.payload_info["workspace/test_file.txt"]
+            self.assertEqual(info["wt:md5"], checksums["md5"])
+            self.assertEqual(info["wt:mimeType"], "text/plain")
+            self.assertEqual(
+                ChecksumCache().get(stat, checksums.keys()),
+                dict(checksums, mimeType="text/plain"),
+            )
+
+            # Modified file is a cache miss
+            with open(path, "ab") as f:
+                f.write(b"\n")
+            self.assertIsNone(ChecksumCache().get(os.stat(path), ["md5"]))
+
     @mock.patch('gwvolman.tasks.build_tale_image')
     def testImageBuild(self, it):
         resp = self.request(
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the throughput of TaleExporter.bytes_from_file with the former
+8 KiB read() loop, hashing and zipping a file the way exports do.
+
+Example:
+
+    $ ./benchmark_file_reader.py --size 1024 --chunk-size 1 --chunk-size 4
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from girder.plugins.wholetale.lib.exporters import HashFileStream, TaleExporter
+from girder.plugins.wholetale.lib.exporters.zipstream import CompressionPolicy, ZipGenerator
+
+
+def read_8k(filename):
+    with open(filename, mode="rb") as f:
+        while True:
+            chunk = f.read(8192)
+            if not chunk:
+                break
+            yield chunk
+
+
+def run(reader, filename, level):
+    zip_generator = ZipGenerator("bench", policy=CompressionPolicy(level=level))
+    stream = HashFileStream(reader(filename))
+    start = time.perf_counter()
+    for _ in zip_generator.addFile(stream, "data.bin", size=os.path.getsize(filename)):
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=512, help="Test file size in MiB")
+    parser.add_argument(
+        "--chunk-size", type=int, action="append",
+        help="Chunk size of bytes_from_file in MiB, may be repeated (default: 1, 4)",
+    )
+    parser.add_argument(
+        "--level", type=int, default=0,
+        help="Deflate level, 0 writes uncompressed deflate blocks (default)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    readers = {"read(8 KiB)": read_8k}
+    for chunk_size in args.chunk_size or [1, 4]:
+        readers[f"readinto({chunk_size} MiB)"] = (
+            lambda filename, size=chunk_size * 1024 ** 2:
+            TaleExporter.bytes_from_file(filename, chunksize=size)
+        )
+
+    with tempfile.NamedTemporaryFile() as fp:
+        block = os.urandom(1024 ** 2)
+        for _ in range(args.size):
+            fp.write(block)
+        fp.flush()
+
+        for name, reader in readers.items():
+            # Best of N, the first run also warms up the page cache
+            elapsed = min(run(reader, fp.name, args.level) for _ in range(args.repeat))
+            print(f"{name:>20}: {args.size / elapsed:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,8 @@ from .rest.instance import Instance
 from .rest.wholetale import wholeTale
 from .rest.license import License
 from .models.instance import finalizeInstance, cullIdleInstances
+from .models.export_artifact import ExportArtifact
+from .models.manifest_cache import ManifestCache
 from .schema.misc import (
     external_auth_providers_schema,
     external_apikey_groups_schema,
@@ -698,6 +700,13 @@ def load(info):
     events.bind('heartbeat', 'wholetale', cullIdleInstances)
     events.unbind("model.job.save.after", "worker")
     events.bind("model.job.save.after", "wholetale", attachJobInfoSpec)
+    events.bind("model.tale.save.after", "wholetale", ManifestCache().invalidateTale)
+    events.bind("model.tale.remove", "wholetale", ManifestCache().invalidateTale)
+    events.bind("model.folder.remove", "wholetale", ManifestCache().invalidateFolder)
+    events.bind("model.tale.remove", "wholetale", ExportArtifact().removeTaleArtifacts)
+    events.bind("model.folder.remove", "wholetale", ExportArtifact().removeVersionArtifacts)
+    # Roots of registered datasets, see ImportProvider.getRegistered
+    Folder().ensureIndex(('registration.identifier', {'sparse': True}))
 
     info['apiRoot'].account = Account()
     info['apiRoot'].repository = Repository()
@@ -238,3 +238,9 @@ class TaleStatus(object):
     PREPARING = 0
     READY = 1
     ERROR = 2
+
+
+class ExportArtifactStatus(object):
+    BUILDING = 0
+    READY = 1
+    ERROR = 2
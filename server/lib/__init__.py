@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+import os
 from urllib.request import urlopen
 
 import html2markdown
@@ -11,6 +13,7 @@ from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.utility.progress import ProgressContext
 
+from ..models.resolution_cache import ResolutionCache
 from ..models.tale import Tale
 from ..utils import notify_event
 from .bdbag.bdbag_provider import BDBagProvider
@@ -23,7 +26,7 @@ from .deriva.auth import DerivaVerificator
 from .entity import Entity
 from .globus.globus_provider import GlobusImportProvider
 from .http_provider import HTTPImportProvider
-from .import_providers import ImportProviders
+from .import_providers import ImportProviders, REGISTER_CHECK_FRESHNESS
 from .null_provider import NullImportProvider
 from .openicpsr.provider import OpenICPSRImportProvider
 from .openicpsr.auth import OpenICPSRVerificator
@@ -31,7 +34,7 @@ from .resolvers import DOIResolver, ResolutionException, Resolvers, MinidResolve
 from .zenodo.auth import ZenodoVerificator
 from .zenodo.provider import ZenodoImportProvider
 
-RESOLVERS = Resolvers()
+RESOLVERS = Resolvers(cache=ResolutionCache)
 RESOLVERS.add(DOIResolver())
 RESOLVERS.add(MinidResolver())
 
@@ -62,60 +65,118 @@ Verificators = {
 }
 
 
-def pids_to_entities(pids, user=None, base_url=None, lookup=True):
-    """
-    Resolve unique external identifiers into WholeTale Entities or file listings
+LOOKUP_WORKERS = int(os.environ.get("GIRDER_WT_LOOKUP_WORKERS", 8))
 
-    :param pids: list of external identifiers
-    :param user: User performing the resolution
-    :param base_url: DataONE's node endpoint url
-    :param lookup: If false, a list of remote files is returned instead of Entities
-    """
-    results = []
+
+class PidError:
+    """Failure to resolve or look up a single external identifier."""
+
+    def __init__(self, pid, message):
+        self.pid = pid
+        self.message = message
+
+    def toDict(self):
+        return {"dataId": self.pid, "error": self.message}
+
+    def __str__(self):
+        return self.message
+
+
+def _pid_to_entity(pid, user, base_url, lookup):
     try:
-        for pid in pids:
-            entity = Entity(pid.strip(), user)
-            entity["base_url"] = base_url
-            entity = RESOLVERS.resolve(entity)
-            provider = IMPORT_PROVIDERS.getProvider(entity)
-            if lookup:
-                results.append(provider.lookup(entity))  # list of dataMaps
-            else:
-                results.append(provider.listFiles(entity))  # list of FileMaps
+        entity = Entity(pid.strip(), user)
+        entity["base_url"] = base_url
+        entity = RESOLVERS.resolve(entity)
+        provider = IMPORT_PROVIDERS.getProvider(entity)
+        if lookup:
+            return provider.lookup(entity)  # dataMap
+        else:
+            return provider.listFiles(entity)  # FileMap
     except ResolutionException:
         msg = 'Id "{}" was categorized as DOI, but its resolution failed.'.format(pid)
-        raise RuntimeError(msg)
     except Exception as exc:
         if lookup:
             msg = 'Lookup for "{}" failed with: {}'
         else:
             msg = 'Listing files at "{}" failed with: {}'
-        raise RuntimeError(msg.format(pid, str(exc)))
+        msg = msg.format(pid, str(exc))
+    return PidError(pid, msg)
+
+
+def pids_to_entities(
+    pids, user=None, base_url=None, lookup=True, partial=False, workers=LOOKUP_WORKERS
+):
+    """
+    Resolve unique external identifiers into WholeTale Entities or file listings
+
+    Identifiers are processed concurrently, results are returned in the order
+    of `pids`.
+
+    :param pids: list of external identifiers
+    :param user: User performing the resolution
+    :param base_url: DataONE's node endpoint url
+    :param lookup: If false, a list of remote files is returned instead of Entities
+    :param partial: If true, failed identifiers are returned as PidError objects
+        instead of raising a RuntimeError with the messages of all of them
+    :param workers: Maximum number of identifiers processed at the same time
+    """
+    def resolve(pid):
+        return _pid_to_entity(pid, user, base_url, lookup)
+
+    if workers > 1 and len(pids) > 1:
+        with ThreadPoolExecutor(
+            max_workers=min(workers, len(pids)), thread_name_prefix="wt-lookup"
+        ) as executor:
+            results = list(executor.map(resolve, pids))
+    else:
+        results = [resolve(pid) for pid in pids]
+
+    errors = [result.message for result in results if isinstance(result, PidError)]
+    if errors and not partial:
+        raise RuntimeError("\n".join(errors))
     return results
 
 
-def register_dataMap(dataMaps, parent, parentType, user=None, base_url=None, progress=False):
+def register_dataMap(dataMaps, parent, parentType, user=None, base_url=None, progress=False,
+                     checkpoint=None):
     """
     Register a list of Data Maps into a given Girder object
 
+    Datasets that were already completely registered in the parent (and did not
+    change since) are not listed again, their existing root is returned.
+
     :param dataMaps: list of dataMaps
     :param parent: A Collection or a Folder where data should be registered
     :param parentType: Either a 'collection' or a 'folder'
     :param user: User performing the registration
     :param base_url: DataONE's node endpoint url
     :param progress: If True, emit 'progress' notification for each registered file.
+    :param checkpoint: Optional RegistrationCheckpoint to record the progress in,
+        or to resume from.
     :return: List of ids of registered objects
     """
-    importedData = []
+    importedData = list(checkpoint.imported) if checkpoint else []
     with ProgressContext(progress, user=user, title="Registering resources") as ctx:
-        for dataMap in dataMaps:
+        for index, dataMap in enumerate(dataMaps):
+            if checkpoint and index < checkpoint.dataMap:
+                continue  # registered before the registration was interrupted
             # probably would be nicer if Entity kept all details and the dataMap
             # would be merged into it
             provider = IMPORT_PROVIDERS.getFromDataMap(dataMap)
-            objType, obj = provider.register(
-                parent, parentType, ctx, user, dataMap, base_url=base_url
-            )
+            version = None
+            if REGISTER_CHECK_FRESHNESS and dataMap.doi:
+                version = provider.getVersion(dataMap, user)
+            obj = provider.getRegistered(parent, parentType, dataMap, version)
+            if obj is None:
+                objType, obj = provider.register(
+                    parent, parentType, ctx, user, dataMap, base_url=base_url,
+                    checkpoint=checkpoint
+                )
+                if objType == "folder" and dataMap.doi:
+                    provider.setRegistered(obj, dataMap, version)
             importedData.append(obj["_id"])
+            if checkpoint:
+                checkpoint.complete(obj["_id"])
     return importedData
 
 
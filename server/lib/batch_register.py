@@ -0,0 +1,356 @@
+import datetime
+import os
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+from girder import events, logger
+from girder.constants import AccessType, CoreEventHandler
+from girder.exceptions import ValidationException
+from girder.utility.model_importer import ModelImporter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .import_item import ImportItem
+
+REGISTER_CHUNK_SIZE = int(os.environ.get("GIRDER_WT_REGISTER_CHUNK_SIZE", 1000))
+
+
+class RegistrationCheckpoint:
+    """
+    Position of a registration of a list of data maps: the index of the
+    current data map, the path of the last object of its listing that is
+    in the database, the roots of the completed data maps and the number
+    of new files and bytes registered. Subclasses persist it in save().
+    """
+
+    def __init__(self, dataMap=0, path=None, imported=None, files=0, bytes=0):
+        self.dataMap = dataMap
+        self.path = path
+        self.imported = imported or []
+        self.files = files
+        self.bytes = bytes
+
+    def toDict(self):
+        return {
+            'dataMap': self.dataMap,
+            'path': self.path,
+            'imported': self.imported,
+            'files': self.files,
+            'bytes': self.bytes,
+        }
+
+    def update(self, path, files, bytes):
+        """Called after the objects up to `path` were written."""
+        self.path = path
+        self.files += files
+        self.bytes += bytes
+        self.save()
+
+    def complete(self, rootId):
+        """Called after the current data map was registered."""
+        self.dataMap += 1
+        self.path = None
+        self.imported.append(rootId)
+        self.save(force=True)
+
+    def save(self, force=False):
+        """Persist the checkpoint. Unless `force`d, it may be rate limited."""
+        pass
+
+
+class BatchRegistration:
+    """
+    Registers the stream of ImportItems of a provider with bulk writes.
+
+    The result is the same as with ImportProvider._registerFolder and
+    _registerFile, but:
+
+    * existing children of a folder are fetched with one query per collection
+      the first time the folder is seen, instead of looked up for every item,
+    * new folders, items and link files get their ids up front and are
+      inserted with insert_many in chunks, with metadata set inline,
+    * file sizes are set inline on new items and propagated to the folders
+      and the root of the hierarchy with one bulk write per chunk.
+
+    The validate, save, save.created and save.after model events are triggered
+    for every new document, as Model.save does, except for the core handler of
+    model.file.save.created that propagates sizes one file at a time.
+
+    With a checkpoint, the path of the last written object is recorded after
+    each chunk. Providers can only list a dataset from its beginning, so a
+    resumed registration walks the listing again, but everything up to the
+    recorded path is matched against the prefetched children without writes.
+    """
+
+    def __init__(self, provider, user, chunkSize=REGISTER_CHUNK_SIZE, checkpoint=None):
+        self.provider = provider
+        self.user = user
+        self.chunkSize = chunkSize
+        self.checkpoint = checkpoint
+        self._resumeAfter = checkpoint.path if checkpoint else None
+        self._lastPath = None
+        self._files = 0
+        self._bytes = 0
+        self.folderModel = ModelImporter.model('folder')
+        self.itemModel = ModelImporter.model('item')
+        self.fileModel = ModelImporter.model('file')
+        self._pending = {'folder': [], 'item': [], 'file': []}
+        self._children = {}
+        self._created = set()
+        self._sizes = defaultdict(int)
+
+    def register(self, parent, parentType, importItems):
+        """
+        Register `importItems` under `parent`.
+
+        :return: Tuple of the type and document of the first registered object
+        """
+        stack = [(parent, parentType)]
+        path = []
+        root = (None, None)
+        for item in importItems:
+            if item.type == ImportItem.FOLDER:
+                (obj, objType) = self._registerFolder(stack, item)
+                stack.append((obj, 'folder'))
+                path.append(item.name)
+                self._lastPath = list(path)
+            elif item.type == ImportItem.END_FOLDER:
+                stack.pop()
+                path.pop()
+                continue
+            elif item.type == ImportItem.FILE:
+                (obj, objType) = self._registerFile(stack, item)
+                self._lastPath = path + [item.name]
+            else:
+                raise Exception('Unknown import item type: %s' % item.type)
+            if self._lastPath == self._resumeAfter:
+                logger.info(f"Resumed registration of {self.provider.name} data after {path}")
+                self._resumeAfter = None
+            if root[1] is None:
+                root = (objType, obj)
+            if sum(len(docs) for docs in self._pending.values()) >= self.chunkSize:
+                self.flush()
+        self.flush()
+        return root
+
+    def _childrenOf(self, parent, parentType):
+        """Return the folders and items in `parent` by name, fetched only once."""
+        key = parent['_id']
+        if key not in self._children:
+            children = {'folder': {}, 'item': {}, 'hasFile': set()}
+            if key not in self._created:
+                for folder in self.folderModel.find(
+                    {'parentId': key, 'parentCollection': parentType}
+                ):
+                    children['folder'][folder['name']] = folder
+                if parentType == 'folder':
+                    for item in self.itemModel.find({'folderId': key}):
+                        children['item'][item['name']] = item
+                    if children['item']:
+                        itemIds = [item['_id'] for item in children['item'].values()]
+                        children['hasFile'] = {
+                            f['itemId'] for f in self.fileModel.find(
+                                {'itemId': {'$in': itemIds}}, fields=['itemId']
+                            )
+                        }
+            self._children[key] = children
+        return self._children[key]
+
+    def _baseParent(self, parent, parentType):
+        if parentType != 'folder':
+            return parent['_id'], parentType
+        if 'baseParentId' not in parent:
+            pathFromRoot = self.folderModel.parentsToRoot(parent, user=self.user, force=True)
+            parent['baseParentId'] = pathFromRoot[0]['object']['_id']
+            parent['baseParentType'] = pathFromRoot[0]['type']
+        return parent['baseParentId'], parent['baseParentType']
+
+    def _registerFolder(self, stack, item: ImportItem):
+        (parent, parentType) = stack[-1]
+        children = self._childrenOf(parent, parentType)
+        meta = {
+            "identifier": item.identifier,
+            "provider": self.provider.name,
+        }
+        if item.meta:
+            meta.update(item.meta)
+        self.folderModel.validateKeys(meta)
+
+        name = self.itemModel._validateString(item.name)
+        if name in children['folder']:
+            folder = children['folder'][name]
+            if any(folder.get('meta', {}).get(k) != v for k, v in meta.items()):
+                folder = self.folderModel.setMetadata(folder, meta)
+                children['folder'][name] = folder
+            return (folder, 'folder')
+        if name in children['item']:
+            raise ValidationException('An item with that name already exists here.', 'name')
+
+        baseParentId, baseParentType = self._baseParent(parent, parentType)
+        now = datetime.datetime.utcnow()
+        folder = {
+            '_id': ObjectId(),
+            'name': name,
+            'lowerName': name.lower(),
+            'description': '',
+            'parentCollection': parentType,
+            'baseParentId': baseParentId,
+            'baseParentType': baseParentType,
+            'parentId': ObjectId(parent['_id']),
+            'creatorId': self.user['_id'],
+            'created': now,
+            'updated': now,
+            'size': 0,
+            'meta': meta,
+        }
+        if parentType in ('folder', 'collection'):
+            self.folderModel.copyAccessPolicies(src=parent, dest=folder, save=False)
+        self.folderModel.setUserAccess(folder, user=self.user, level=AccessType.ADMIN,
+                                       save=False)
+        if self._add(self.folderModel, folder, validate=False):
+            children['folder'][name] = folder
+            self._created.add(folder['_id'])
+        return (folder, 'folder')
+
+    def _registerFile(self, stack, item: ImportItem):
+        (parent, parentType) = stack[-1]
+        children = self._childrenOf(parent, parentType)
+        name = self.itemModel._validateString(item.name)
+        existing = children['item'].get(name)
+        if existing is not None:
+            if existing['_id'] in children['hasFile']:
+                if self._resumeAfter is None:
+                    logger.info(
+                        f"Item ({existing['_id']=}, {existing['name']=}) already has a file."
+                    )
+                return (existing, 'item')
+            # An empty item left behind by an earlier registration
+            return self._registerSingleFile(stack, item)
+        if item.url and item.url.startswith('file://'):
+            # The file may only exist while the stream is being read, upload it right away
+            return self._registerSingleFile(stack, item)
+
+        meta = {'provider': self.provider.name}
+        if item.identifier:
+            meta['identifier'] = item.identifier
+        if item.meta:
+            meta.update(item.meta)
+        self.itemModel.validateKeys(meta)
+
+        # Girder renames items that clash with a folder
+        uniqueName, n = name, 0
+        while uniqueName in children['folder'] or uniqueName in children['item']:
+            n += 1
+            uniqueName = '%s (%d)' % (name, n)
+
+        baseParentId, baseParentType = self._baseParent(parent, parentType)
+        now = datetime.datetime.utcnow()
+        gitem = {
+            '_id': ObjectId(),
+            'name': uniqueName,
+            'lowerName': uniqueName.lower(),
+            'description': '',
+            'folderId': ObjectId(parent['_id']),
+            'creatorId': self.user['_id'],
+            'baseParentType': baseParentType,
+            'baseParentId': baseParentId,
+            'created': now,
+            'updated': now,
+            'size': 0,
+            'meta': meta,
+        }
+        gfile = {
+            'created': now,
+            'itemId': gitem['_id'],
+            'assetstoreId': None,
+            'name': item.name,
+            'creatorId': self.user['_id'],
+            'mimeType': item.mimeType,
+            'linkUrl': item.url,
+        }
+        if item.size is not None:
+            gfile['size'] = int(item.size)
+
+        if not self._add(self.itemModel, gitem, validate=False):
+            return (gitem, 'item')
+        children['item'][uniqueName] = gitem
+        if self._add(self.fileModel, gfile, validate=True):
+            children['hasFile'].add(gitem['_id'])
+            self._files += 1
+            if gfile.get('size'):
+                # As File._propagateSizeToItem does, the item is still queued
+                gitem['size'] = gfile['size']
+                self._bytes += max(gfile['size'], 0)
+                self._sizes[('folder', gitem['folderId'])] += gfile['size']
+                self._sizes[(baseParentType, baseParentId)] += gfile['size']
+        return (gitem, 'item')
+
+    def _registerSingleFile(self, stack, item: ImportItem):
+        """Register a file with ImportProvider._registerFile, after the queued documents."""
+        self.flush()
+        (gitem, objType) = self.provider._registerFile(stack, item, self.user)
+        self._files += 1
+        self._bytes += max(item.size or 0, 0)
+        children = self._childrenOf(*stack[-1])
+        children['item'][gitem['name']] = gitem
+        children['hasFile'].add(gitem['_id'])
+        return (gitem, objType)
+
+    def _add(self, model, doc, validate):
+        """
+        Queue a new document, triggering the events of Model.save before it is
+        inserted. Folders and items are validated against the prefetched
+        children of their parent, `validate` runs model.validate as well.
+
+        :return: False if a handler prevented the save
+        """
+        event = events.trigger('model.%s.validate' % model.name, doc)
+        if validate and not event.defaultPrevented:
+            doc = model.validate(doc)
+        event = events.trigger('model.%s.save' % model.name, doc)
+        if event.defaultPrevented:
+            return False
+        self._pending[model.name].append(doc)
+        return True
+
+    @staticmethod
+    def _triggerCreated(model, doc):
+        """
+        Trigger model.<name>.save.created like events.trigger does, skipping
+        the core handler that propagates the size of a file, see flush.
+        """
+        eventName = 'model.%s.save.created' % model.name
+        event = events.Event(eventName, doc)
+        for handler in events._mapping.get(eventName, ()):
+            if handler['name'] == CoreEventHandler.FILE_PROPAGATE_SIZE:
+                continue
+            event.currentHandlerName = handler['name']
+            handler['handler'](event)
+            if event.propagate is False:
+                break
+
+    def flush(self):
+        """Insert the queued documents, parents first, and propagate sizes."""
+        for model in (self.folderModel, self.itemModel, self.fileModel):
+            docs = self._pending[model.name]
+            if not docs:
+                continue
+            try:
+                model.collection.insert_many(docs)
+            except BulkWriteError as e:
+                raise ValidationException('Database save failed: %s' % e.details)
+            for doc in docs:
+                self._triggerCreated(model, doc)
+                events.trigger('model.%s.save.after' % model.name, doc)
+            self._pending[model.name] = []
+
+        updates = defaultdict(list)
+        for (modelName, id), size in self._sizes.items():
+            updates[modelName].append(UpdateOne({'_id': id}, {'$inc': {'size': size}}))
+        for modelName, ops in updates.items():
+            ModelImporter.model(modelName).collection.bulk_write(ops, ordered=False)
+        self._sizes.clear()
+
+        if self.checkpoint is not None and self._lastPath is not None:
+            self.checkpoint.update(self._lastPath, self._files, self._bytes)
+            self._files = self._bytes = 0
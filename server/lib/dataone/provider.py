@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from urllib.request import urlopen
 
 from girder import logger
@@ -17,7 +18,10 @@ from .register import \
     extract_metadata_docs, \
     get_documents, \
     get_package_pid, \
+    may_be_dataone_pid, \
     get_package_list, \
+    prefetch_documents, \
+    CHILD_PACKAGE_WORKERS, \
     extract_data_docs, \
     extract_resource_docs, \
     check_multiple_metadata
@@ -32,25 +36,51 @@ class DataOneImportProvider(ImportProvider):
 
     def matches(self, entity: Entity) -> bool:
         url = entity.getValue()
+        # Avoid a Solr query for every URL that no other provider claimed
+        if not may_be_dataone_pid(url):
+            return False
         try:
-            package_pid = get_package_pid(url, entity['base_url'])
+            package_pid = self._package_pid(entity)
         except RestException:
             return False
         return package_pid is not None
 
+    @staticmethod
+    def _package_pid(entity: Entity) -> str:
+        url, base_url = entity.getValue(), entity['base_url']
+        return entity.memoize(
+            ("dataone.package_pid", url, base_url), lambda: get_package_pid(url, base_url)
+        )
+
+    def _documents(self, entity: Entity) -> list:
+        package_pid, base_url = self._package_pid(entity), entity['base_url']
+        return entity.memoize(
+            ("dataone.documents", package_pid, base_url),
+            lambda: get_documents(package_pid, base_url),
+        )
+
     def lookup(self, entity: Entity) -> DataMap:
         # just wrap D1_lookup for now
         # this does not seem to properly resolve individual files. If passed something like
         # https://cn.dataone.org/cn/v2/resolve/urn:uuid:9266a118-78b3-48e3-a675-b3dfcc5d0fc4,
         # it returns the parent dataset, which, as a user, I'd be annoyed with
-        dataMap = D1_lookup(entity.getValue(), entity['base_url'])
+        dataMap = D1_lookup(
+            entity.getValue(), entity['base_url'],
+            package_pid=self._package_pid(entity), docs=self._documents(entity),
+        )
         dataMap.repository = self.name
         return dataMap
 
     def listFiles(self, entity: Entity) -> FileMap:
-        result = get_package_list(entity.getValue(), entity['base_url'])
+        result = get_package_list(
+            entity.getValue(), entity['base_url'],
+            package_pid=self._package_pid(entity), docs=self._documents(entity),
+        )
         return FileMap.fromDict(result)
 
+    def getDatasetUIDScope(self, doc: object):
+        return doc.get('folderId')
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         if 'folderId' in doc:
             # It's an item, grab the parent which should contain all the info
@@ -61,13 +91,27 @@ class DataOneImportProvider(ImportProvider):
     def _listRecursive(self, user, pid: str, name: str, base_url: str = DataONELocations.prod_cn,
                        progress=None):
         """Create a package description (Dict) suitable for dumping to JSON."""
+        with ThreadPoolExecutor(
+            max_workers=CHILD_PACKAGE_WORKERS, thread_name_prefix="wt-d1"
+        ) as executor:
+            yield from self._listPackage(user, pid, name, base_url, progress, executor)
+
+    def _listPackage(self, user, pid: str, name: str, base_url: str, progress, executor,
+                     docs=None):
+        """
+        Yield ImportItems of a package and, recursively, of its children.
+
+        Documents of sibling child packages are fetched concurrently in `executor`,
+        while the items are still yielded in depth-first order.
+        """
         if progress:
             progress.update(increment=1, message='Processing package {}.'.format(pid))
 
         # query for things in the resource map. At this point, it is assumed that the pid
         # has been correctly identified by the user in the UI.
 
-        docs = get_documents(pid, base_url)
+        if docs is None:
+            docs = get_documents(pid, base_url)
 
         # Filter the Solr result by TYPE so we can construct the package
         metadata = extract_metadata_docs(docs)
@@ -120,10 +164,16 @@ class DataOneImportProvider(ImportProvider):
 
         # Recurse and add child packages if any exist
         if children is not None and len(children) > 0:
-            for child in children:
-                logger.debug('Registering child package, {}'.format(child['identifier']))
-                yield from self._listRecursive(
-                    user, child['identifier'], None, base_url=base_url, progress=progress)
+            futures = prefetch_documents(children, base_url, executor)
+            try:
+                for child, child_docs in zip(children, futures):
+                    logger.debug('Registering child package, {}'.format(child['identifier']))
+                    yield from self._listPackage(
+                        user, child['identifier'], None, base_url, progress, executor,
+                        docs=child_docs.result())
+            finally:
+                for future in futures:
+                    future.cancel()
 
         yield ImportItem(ImportItem.END_FOLDER)
         logger.debug('Finished registering dataset')
@@ -3,8 +3,12 @@ Code for querying DataONE and verifying query results. Specifically used for
  finding datasets based on the url and for listing package contents. Some of
   these methods are used elsewhere in the WholeTale plugin, specifically in  the harvester.
 """
+import functools
+import os
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 from girder import logger
@@ -12,6 +16,15 @@ from girder.api.rest import RestException
 from . import DataONELocations
 from ...utils import esc
 from ..data_map import DataMap
+from .. import http_client
+
+# Number of sibling child packages whose documents are fetched concurrently
+CHILD_PACKAGE_WORKERS = int(os.environ.get("GIRDER_WT_DATAONE_CHILD_WORKERS", 4))
+# Fields of package members returned by get_documents
+DOCUMENT_FIELDS = [
+    "identifier", "formatType", "title", "size", "formatId", "fileName", "documents",
+    "checksum", "checksumAlgorithm", "keywords", "dataUrl", "dateUploaded",
+]
 
 
 def query(q,
@@ -41,7 +54,7 @@ def query(q,
         base_url, q, fl, rows, start)
 
     try:
-        req = requests.get(query_url)
+        req = http_client.get(query_url)
         req.raise_for_status()
     except requests.exceptions.HTTPError as e:
         raise RestException(e)
@@ -52,17 +65,48 @@ def query(q,
         raise RestException(
             "Solr query was not successful.\n{}\n{}".format(query_url, content))
 
-    # Stop if the number of results is equal to the number of rows requested
-    # Fix this in the future by supporting paginated queries.
-    if content['response']['numFound'] == rows:
-        raise RestException(
-            "Number of results returned equals number of rows requested. "
-            "This could mean the query result is truncated. "
-            "Implement paged queries.")
-
     return content
 
 
+def query_docs(q,
+               base_url=DataONELocations.prod_cn,
+               fields=None,
+               rows=1000,
+               prefetch=False):
+    """
+    Iterate over all documents matching a query, requesting them a page of
+    `rows` at a time.
+
+    :param q: The query
+    :param base_url: The URL to the coordinating node
+    :param fields: The fields to return
+    :param rows: Number of rows per page
+    :param prefetch: Request the next page while the current one is consumed
+    :return: A generator of documents
+    """
+    fetch = functools.partial(query, q, base_url=base_url, fields=fields, rows=rows)
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        start = 0
+        page = fetch(start=start)
+        while True:
+            if 'response' not in page or 'docs' not in page['response']:
+                raise RestException(
+                    "Failed to get a result for the query\n {}".format(page))
+            docs = page['response']['docs']
+            start += len(docs)
+            more = bool(docs) and start < int(page['response']['numFound'])
+            if more and executor is not None:
+                next_page = executor.submit(fetch, start=start)
+            yield from docs
+            if not more:
+                return
+            page = next_page.result() if executor is not None else fetch(start=start)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
 def find_resource_pid(pid, base_url):
     """
     Find the PID of the resource map for a given PID, which may be a resource map.
@@ -148,15 +192,16 @@ def find_nonobsolete_resmaps(pids, base_url):
     :return:
     """
 
-    result = query(
-        "identifier:(\"{}\")+AND+-obsoletedBy:*".format("\" OR \"".join(pids))
-    )
-    result_len = int(result['response']['numFound'])
+    nonobs = [
+        doc['identifier'] for doc in query_docs(
+            "identifier:(\"{}\")+AND+-obsoletedBy:*".format("\" OR \"".join(pids))
+        )
+    ]
 
-    if result_len == 0:
+    if not nonobs:
         raise RestException('No results were found for identifier(s): {}.'.format(", ".join(pids)))
 
-    return [doc['identifier'] for doc in result['response']['docs']]
+    return nonobs
 
 
 def find_initial_pid(path):
@@ -197,6 +242,17 @@ def find_initial_pid(path):
         return path
 
 
+def may_be_dataone_pid(path):
+    """
+    Cheap syntactic check, done before any Solr query, of whether `path` can
+    refer to a DataONE object: either a bare identifier, or a URL from which
+    find_initial_pid() can extract one.
+    """
+    if not re.match(r'^https?://', path):
+        return bool(path.strip())
+    return find_initial_pid(path) != path
+
+
 def get_package_pid(path, base_url):
     """
     Get the pid of a package from its path.
@@ -231,29 +287,52 @@ def extract_resource_docs(docs):
     return resource
 
 
-def D1_lookup(path, base_url):
+def partition_documents(docs):
+    """
+    Split documents of a package into metadata, data and resource map
+    documents in a single pass, see extract_*_docs.
+    """
+    parts = {'METADATA': [], 'DATA': [], 'RESOURCE': []}
+    for doc in docs:
+        part = parts.get(doc.get('formatType'))
+        if part is not None:
+            part.append(doc)
+    return parts['METADATA'], parts['DATA'], parts['RESOURCE']
+
+
+def D1_lookup(path, base_url, package_pid=None, docs=None):
     """
     Lookup and return information about a package on the
     DataONE network.
     :param path: The path to a DataONE object
     :param base_url: The patht to a node endpoint
+    :param package_pid: The package's pid, if already known
+    :param docs: Documents of the package, if already known
     :type path: str
     :type base_url: str
     :return:
     """
 
-    package_pid = get_package_pid(path, base_url)
-    docs = get_documents(package_pid, base_url)
-
-    if not docs:
+    if package_pid is None:
+        package_pid = get_package_pid(path, base_url)
+    if docs is None:
+        docs = iter_documents(package_pid, base_url)
+
+    # Compute package size (sum of 'size' values) and find the metadata in one pass
+    num_docs = 0
+    total_size = 0
+    metadata = None
+    for doc in docs:
+        num_docs += 1
+        total_size += int(doc.get('size', 0))
+        if metadata is None and doc.get('formatType') == 'METADATA':
+            metadata = doc
+
+    if not num_docs:
         raise RestException('Failed to find any documents in the provided package')
-    # Filter the Solr result by TYPE so we can construct the package
-    metadata = next((doc for doc in docs if doc.get('formatType') == 'METADATA'), None)
     if not metadata:
         raise RestException('No metadata found.')
 
-    # Compute package size (sum of 'size' values)
-    total_size = sum([int(doc.get('size', 0)) for doc in docs])
     is_tale = "Tale" in metadata.get("keywords", [])
 
     return DataMap(package_pid, total_size, name=metadata.get('title', 'no title'),
@@ -262,23 +341,26 @@ def D1_lookup(path, base_url):
                    base_url=base_url)
 
 
+def iter_documents(package_pid, base_url, fields=None, prefetch=True):
+    """
+    Iterate over all the files in a data package, including the metadata
+    record providing information about the package.
+
+    :param fields: Fields of the documents to return, DOCUMENT_FIELDS by default
+    :param prefetch: Request the next page of results while the current one is consumed
+    """
+    return query_docs(q='resourceMap:"{}"'.format(esc(package_pid)),
+                      fields=DOCUMENT_FIELDS if fields is None else fields,
+                      base_url=base_url,
+                      prefetch=prefetch)
+
+
 def get_documents(package_pid, base_url):
     """
     Retrieve a list of all the files in a data package. The metadata
     record providing information about the package is also in this list.
     """
-
-    result = query(q='resourceMap:"{}"'.format(esc(package_pid)),
-                   fields=["identifier", "formatType", "title", "size", "formatId",
-                           "fileName", "documents", "checksum", "checksumAlgorithm",
-                           "keywords", "dataUrl", "dateUploaded"],
-                   base_url=base_url)
-
-    if 'response' not in result or 'docs' not in result['response']:
-        raise RestException(
-            "Failed to get a result for the query\n {}".format(result))
-
-    return result['response']['docs']
+    return list(iter_documents(package_pid, base_url))
 
 
 def check_multiple_maps(documenting):
@@ -296,27 +378,45 @@ def check_multiple_metadata(metadata):
                             "This is unexpected and unhandled.")
 
 
-def get_package_list(path, base_url, package=None, isChild=False):
+def prefetch_documents(packages, base_url, executor):
+    """
+    Start fetching documents of several packages in `executor`.
+
+    :param packages: Resource map documents of the packages
+    :return: A list of futures of get_documents(), in the order of `packages`
+    """
+    return [
+        executor.submit(get_documents, package['identifier'], base_url)
+        for package in packages
+    ]
+
+
+def get_package_list(path, base_url, package=None, isChild=False, package_pid=None, docs=None,
+                     executor=None):
     """
 
     :param path: The path to a package
     :param base_url: The node endpoint
     :param package: Holds the information about the package
     :param isChild: A bool set when the package has a parent
+    :param package_pid: The package's pid, if already known
+    :param docs: Documents of the package, if already known
+    :param executor: Pool used to fetch documents of child packages concurrently
     :return:
     """
 
     if package is None:
         package = {}
 
-    package_pid = get_package_pid(path, base_url)
-
-    docs = get_documents(package_pid, base_url)
+    if package_pid is None:
+        package_pid = get_package_pid(path, base_url)
+    if docs is None:
+        docs = iter_documents(package_pid, base_url)
 
     # Filter the Solr result by TYPE so we can construct the package
-    metadata = extract_metadata_docs(docs)
-    data = extract_data_docs(docs)
-    children = extract_resource_docs(docs)
+    metadata, data, children = partition_documents(docs)
+    if not metadata:
+        raise RestException('No metadata file was found in the package.')
 
     # Determine the folder name. This is usually the title of the metadata file
     # in the package but when there are multiple metadata files in the package,
@@ -337,11 +437,28 @@ def get_package_list(path, base_url, package=None, isChild=False):
 
     package[primary_metadata[0]['title']]['fileList'].append(fileList)
     if children is not None and len(children) > 0:
-        for child in children:
-            get_package_list(child['identifier'],
-                             base_url=base_url,
-                             package=package[primary_metadata[0]['title']],
-                             isChild=True)
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(
+                max_workers=CHILD_PACKAGE_WORKERS, thread_name_prefix="wt-d1"
+            )
+        futures = prefetch_documents(children, base_url, executor)
+        try:
+            # Siblings are fetched concurrently, but added in order
+            for child, child_docs in zip(children, futures):
+                # Children are resource maps, i.e. pids of packages already
+                get_package_list(child['identifier'],
+                                 base_url=base_url,
+                                 package=package[primary_metadata[0]['title']],
+                                 isChild=True,
+                                 package_pid=child['identifier'],
+                                 docs=child_docs.result(),
+                                 executor=executor)
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
     return package
 
 
@@ -0,0 +1,160 @@
+import os
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from girder.constants import AccessType
+from girder.exceptions import ValidationException
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+
+
+class DataSetResolver:
+    """
+    Resolve entries of a Tale's dataSet into Girder documents in bulk.
+
+    Instead of loading every entry (and its parent folder, and its file) one by one,
+    all items, folders and files are fetched with a few `$in` queries. Dataset
+    identifiers computed by import providers are memoized per folder, so that
+    items sharing a parent resolve their top level dataset only once.
+    """
+
+    def __init__(self, user, providers, level=AccessType.READ, models=None):
+        """
+        :param user: The user performing the resolution, used for access checks
+        :param providers: ImportProviders used to map registered objects to providers
+        :param level: Minimal access level required for all the resolved objects
+        :param models: An optional ModelCache that fetched documents are added to
+        """
+        self.user = user
+        self.providers = providers
+        self.level = level
+        self.models = models
+        self._dataset_uids = {}
+
+    @staticmethod
+    def _object_id(obj_id):
+        try:
+            return ObjectId(obj_id)
+        except (InvalidId, TypeError):
+            raise ValidationException('Invalid ObjectId: %s' % obj_id, field='id')
+
+    def _find(self, model, ids):
+        if not ids:
+            return {}
+        docs = {doc["_id"]: doc for doc in model.find({"_id": {"$in": list(ids)}})}
+        if self.models is not None:
+            for doc in docs.values():
+                self.models.add(model, doc)
+        return docs
+
+    def load(self, dataSet):
+        """
+        Fetch all objects referenced in `dataSet`.
+
+        :param dataSet: A list of dataSet entries, i.e. dicts with `itemId` and `_modelType`
+        :return: A list of (entry, document) tuples in the order of `dataSet`
+        """
+        ids = {"item": set(), "folder": set()}
+        for obj in dataSet:
+            ids[obj["_modelType"]].add(self._object_id(obj["itemId"]))
+
+        items = self._find(Item(), ids["item"])
+        parent_ids = {item["folderId"] for item in items.values()}
+        folders = self._find(Folder(), ids["folder"] | parent_ids)
+
+        docs = {"item": items, "folder": folders}
+        result = []
+        for obj in dataSet:
+            doc = docs[obj["_modelType"]].get(self._object_id(obj["itemId"]))
+            if doc is None:
+                raise ValidationException(
+                    "No such %s: %s" % (obj["_modelType"], obj["itemId"]), field="id"
+                )
+            if obj["_modelType"] == "item":
+                folder = folders.get(doc["folderId"])
+                if folder is None:
+                    raise ValidationException(
+                        "No such folder: %s" % doc["folderId"], field="folderId"
+                    )
+                Folder().requireAccess(folder, self.user, self.level)
+            else:
+                Folder().requireAccess(doc, self.user, self.level)
+            result.append((obj, doc))
+        return result
+
+    @staticmethod
+    def files(items):
+        """
+        Return a map of item id to the first file of that item.
+
+        :param items: An iterable of item documents
+        """
+        item_ids = [item["_id"] for item in items]
+        files = {}
+        if not item_ids:
+            return files
+        for fobj in File().find({"itemId": {"$in": item_ids}}):
+            files.setdefault(fobj["itemId"], fobj)
+        return files
+
+    def subtree(self, root, relpath=''):
+        """
+        Fetch all the items below `root` folder.
+
+        The tree is walked breadth-first with one query per model and level,
+        files of all the items are fetched at once afterwards. Folders that the
+        user cannot access are skipped together with their content.
+
+        :param root: The top folder document
+        :param relpath: Path prepended to paths of all the items
+        :return: A generator of (path, item, file) tuples, in the same order as
+            a recursive walk of `childItems` and `childFolders` would produce.
+            Items without a file are skipped.
+        """
+        subfolders = {}
+        items = {}
+        level = [root]
+        while level:
+            ids = [folder["_id"] for folder in level]
+            for item in Item().find({"folderId": {"$in": ids}}):
+                items.setdefault(item["folderId"], []).append(item)
+            level = [
+                folder
+                for folder in Folder().find(
+                    {"parentId": {"$in": ids}, "parentCollection": "folder"}
+                )
+                if Folder().hasAccess(folder, user=self.user, level=self.level)
+            ]
+            for folder in level:
+                subfolders.setdefault(folder["parentId"], []).append(folder)
+
+        files = self.files(item for folder_items in items.values() for item in folder_items)
+
+        def walk(folder, path):
+            curpath = os.path.join(path, folder["name"])
+            for item in items.get(folder["_id"], []):
+                if item["_id"] in files:
+                    yield curpath, item, files[item["_id"]]
+            for subfolder in subfolders.get(folder["_id"], []):
+                yield from walk(subfolder, curpath)
+
+        return walk(root, relpath)
+
+    def provider(self, doc):
+        """Return a tuple of provider's name and a provider for a registered object."""
+        provider_name = doc["meta"]["provider"]
+        if provider_name.startswith("HTTP"):
+            provider_name = "HTTP"  # TODO: handle HTTPS to make it unnecessary
+        return provider_name, self.providers.providerMap[provider_name]
+
+    def dataset_uid(self, provider, doc):
+        """Return the identifier of a top level dataset containing `doc`."""
+        scope = provider.getDatasetUIDScope(doc)
+        if scope is None:
+            return provider.getDatasetUID(doc, self.user)
+        key = (provider.name, scope)
+        if key not in self._dataset_uids:
+            self._dataset_uids[key] = provider.getDatasetUID(doc, self.user)
+        return self._dataset_uids[key]
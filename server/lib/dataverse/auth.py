@@ -1,6 +1,7 @@
 import requests
 from girder.exceptions import RestException
 from ..verificator import Verificator
+from .. import http_client
 
 
 class DataverseVerificator(Verificator):
@@ -12,7 +13,7 @@ class DataverseVerificator(Verificator):
 
     def verify(self):
         try:
-            r = requests.get(
+            r = http_client.get(
                 f"https://{self.resource_server}/api/users/token", headers=self.headers
             )
             r.raise_for_status()
@@ -1,9 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
 import re
 import os
 import pathlib
-import requests
 from urllib.parse import urlparse, urlunparse, parse_qs, unquote
 
 from girder import events, logger
@@ -18,15 +18,18 @@ from ..file_map import FileMap
 from ..import_item import ImportItem
 from ..entity import Entity
 from ... import constants
+from ...models.remote_file_cache import RemoteFileCache
+from .. import http_client
 
 _DOI_REGEX = re.compile(r'(10.\d{4,9}/[-._;()/:A-Z0-9]+)', re.IGNORECASE)
 _QUOTES_REGEX = re.compile(r'"(.*)"')
 _CNTDISP_REGEX = re.compile(r'filename="(.*)"')
 _CNTDISPS_REGEX = re.compile(r"^attachment; filename\*=.*''(.*)$")
+PROBE_WORKERS = int(os.environ.get("GIRDER_WT_DATAVERSE_PROBE_WORKERS", 8))
 
 
 def _query_dataverse(search_url, headers=None):
-    req = requests.get(search_url, headers=headers)
+    req = http_client.get(search_url, headers=headers)
     data = req.json()["data"]
     if data['count_in_response'] != 1:
         raise ValueError
@@ -38,6 +41,7 @@ def _query_dataverse(search_url, headers=None):
         'id': item['file_id'],
         'doi': item.get('filePersistentId'),  # https://github.com/IQSS/dataverse/issues/5339
         "checksum": f"{item['checksum']['type'].lower()}:{item['checksum']['value']}",
+        "unf": item.get("unf"),
     }]
     title = item['name']
     title_search = _QUOTES_REGEX.search(item['dataset_citation'])
@@ -50,18 +54,30 @@ def _query_dataverse(search_url, headers=None):
     return title, files, doi
 
 
+def _set_filename(obj, headers):
+    content_disposition = headers.get("Content-Disposition")
+    if content_disposition:
+        for regex in (
+            _CNTDISP_REGEX.search(content_disposition),
+            _CNTDISPS_REGEX.match(content_disposition)
+        ):
+            if regex:
+                obj["filename"] = unquote(regex.groups()[0])
+                break
+
+
 def _get_attrs_via_head(obj, url, headers=None):
     # start by regular HEAD, trick is it's gonna fail with 403
     # if the file is sitting on S3
     # see https://github.com/IQSS/dataverse/issues/5322
-    req = requests.head(url, allow_redirects=True, headers=headers)
+    req = http_client.head(url, allow_redirects=True, headers=headers)
     if req.ok:
         size = int(req.headers.get("Content-Length", default=obj.get("size", "-1")))
     else:
         # Now the magic, since S3 accepts range request, we cheat the system
         # by requesting only 100 bytes to get the headers we want.
         # Isn't it beautiful?!
-        req = requests.get(url, headers={"Range": "bytes=0-100"})
+        req = http_client.get(url, headers={"Range": "bytes=0-100"})
 
         if not req.ok or "Content-Range" not in req.headers:
             # oh well, I tried...
@@ -70,19 +86,33 @@ def _get_attrs_via_head(obj, url, headers=None):
 
     obj["filesize"] = size
     # This is common to both HEAD and GET from above.
-    content_disposition = req.headers.get("Content-Disposition")
-    if content_disposition:
-        for regex in (
-            _CNTDISP_REGEX.search(content_disposition),
-            _CNTDISPS_REGEX.match(content_disposition)
-        ):
-            if regex:
-                obj["filename"] = unquote(regex.groups()[0])
-                break
+    _set_filename(obj, req.headers)
+
+
+def _get_attrs_via_range(obj, url, headers=None):
+    """
+    Get the size and name of a file from the headers of a request for its
+    first byte. Returns False if the server did not tell the size.
+    """
+    headers = dict(headers or {}, Range="bytes=0-0")
+    with http_client.get(url, allow_redirects=True, stream=True, headers=headers) as req:
+        if not req.ok:
+            return False
+        try:
+            if req.status_code == 206:
+                size = int(req.headers["Content-Range"].split("/")[-1])
+            else:
+                # Range ignored, the body is never read
+                size = int(req.headers["Content-Length"])
+        except (KeyError, ValueError):  # e.g. "bytes 0-0/*"
+            return False
+        obj["filesize"] = size
+        _set_filename(obj, req.headers)
+    return True
 
 
 def _get_attrs_via_get(obj, url, headers=None):
-    req = requests.get(url, allow_redirects=True, stream=True, headers=headers)
+    req = http_client.get(url, allow_redirects=True, stream=True, headers=headers)
     md5sum = hashlib.md5()
     size = 0
     for chunk in req.iter_content(chunk_size=4096):
@@ -91,15 +121,7 @@ def _get_attrs_via_get(obj, url, headers=None):
     obj["checksum"] = f"md5:{md5sum.hexdigest()}"
     obj["filesize"] = size
     # This is common to both HEAD and GET from above.
-    content_disposition = req.headers.get("Content-Disposition")
-    if content_disposition:
-        for regex in (
-            _CNTDISP_REGEX.search(content_disposition),
-            _CNTDISPS_REGEX.match(content_disposition)
-        ):
-            if regex:
-                obj["filename"] = unquote(regex.groups()[0])
-                break
+    _set_filename(obj, req.headers)
 
 
 class DataverseImportProvider(ImportProvider):
@@ -122,7 +144,7 @@ class DataverseImportProvider(ImportProvider):
                 urlparse(url)._replace(path='/api/info/version')
             )
         try:
-            req = requests.get(url)
+            req = http_client.get(url)
             data = req.json()
         except Exception:
             logger.warning(
@@ -142,6 +164,9 @@ class DataverseImportProvider(ImportProvider):
         domain_regex = re.compile("^https?://(" + "|".join(domains) + ").*$")
         return [re.compile(r"^http.*/dataset\.xhtml\?persistentId=.*$"), domain_regex]
 
+    def getDatasetUIDScope(self, doc: object):
+        return doc.get('folderId')
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         if 'folderId' in doc:
             # It's an item, grab the parent which should contain all the info
@@ -173,7 +198,7 @@ class DataverseImportProvider(ImportProvider):
             )
         else:
             dataset_url = urlunparse(url)
-        req = requests.get(dataset_url, headers=headers)
+        req = http_client.get(dataset_url, headers=headers)
         return req.json()
 
     def _parse_dataset(self, url, headers=None):
@@ -197,6 +222,10 @@ class DataverseImportProvider(ImportProvider):
                 'doi': obj['dataFile']['persistentId'],
                 'directoryLabel': obj.get('directoryLabel', ''),
                 "checksum": f"{checksum['type'].lower()}:{checksum['value']}",
+                # Only set for ingested tabular files
+                "originalFileName": obj["dataFile"].get("originalFileName"),
+                "originalFileSize": obj["dataFile"].get("originalFileSize"),
+                "unf": obj["dataFile"].get("UNF"),
             })
 
         return title, files, doi
@@ -257,33 +286,81 @@ class DataverseImportProvider(ImportProvider):
 
         File size is wrong: https://github.com/IQSS/dataverse/issues/5321
         URL doesn't point to original format, by default.
-        """
 
-        def _update_attrs(url, obj, query):
+        Ingested tabular files are registered twice, in their original format
+        and as the derived tab separated file. Attributes of the former come
+        from the dataset metadata when possible. Otherwise, and for the latter
+        whose size is not known to the API (a header line is added when it's
+        downloaded), they are read from the headers of ranged requests, sent
+        concurrently and cached in RemoteFileCache. Files probed with
+        credentials (`headers`) are cached separately for every set of them,
+        since what is accessible depends on them.
+        """
+        scope = ""
+        if headers:
+            # Only a digest of the credentials ends up in the cache key
+            scope = "/" + hashlib.sha256(
+                json.dumps(headers, sort_keys=True).encode()
+            ).hexdigest()
+
+        def _probe(obj, fmt):
+            fileId = str(obj['id'])
+            query = 'format=original' if fmt == 'original' else ''
             access_url = urlunparse(
-                url._replace(path='/api/access/datafile/' + fileId,
-                             query=query)
+                url._replace(path='/api/access/datafile/' + fileId, query=query)
             )
-            if query == 'format=original':
-                _get_attrs_via_head(obj, access_url)
-                _get_attrs_via_head(obj, access_url, headers=headers)
-            else:
-                _get_attrs_via_get(obj, access_url, headers=headers)
             obj["url"] = access_url
+            if fmt == 'original' and obj.get('originalFileName') and \
+                    obj.get('originalFileSize') is not None:
+                obj["filesize"] = obj["originalFileSize"]
+                obj["filename"] = obj["originalFileName"]
+                return obj
+
+            key = f"{url.netloc}/{fileId}/{fmt}{scope}"
+            attrs = RemoteFileCache().get(key)
+            if attrs is None:
+                attrs = {}
+                try:
+                    if fmt == 'original':
+                        _get_attrs_via_head(attrs, access_url, headers=headers)
+                        if "filesize" not in attrs and headers:
+                            _get_attrs_via_head(attrs, access_url)
+                    elif not _get_attrs_via_range(attrs, access_url, headers=headers):
+                        # Last resort, download it
+                        _get_attrs_via_get(attrs, access_url, headers=headers)
+                except Exception as exc:
+                    # Keep the attributes from the API
+                    logger.warning(f"[dataverse] failed to probe {access_url}: {exc}")
+                # A negative size means the server did not tell it
+                if attrs.get("filesize", -1) >= 0:
+                    RemoteFileCache().put(key, attrs)
+            obj.update(attrs)
             return obj
 
+        probes = []
         for obj in files:
             fileId = str(obj['id'])
             # Register original too
             if obj['mimeType'] == 'text/tab-separated-values':
-                yield _update_attrs(url, obj.copy(), 'format=original')
-                yield _update_attrs(url, obj.copy(), '')
+                original = obj.copy()
+                original.pop("unf", None)
+                probes.append((original, 'original'))
+                derived = obj.copy()
+                # The checksum is the one of the original, Dataverse publishes
+                # none for the derived file, only the UNF of the table.
+                derived.pop("checksum", None)
+                probes.append((derived, 'derived'))
             else:
                 obj['url'] = urlunparse(
                     url._replace(path='/api/access/datafile/' + fileId,
                                  query='')
                 )
-                yield obj
+                probes.append((obj, None))
+
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            yield from executor.map(
+                lambda probe: probe[0] if probe[1] is None else _probe(*probe), probes
+            )
 
     def parse_pid(self, pid: str, sanitize: bool = False, user: object = None):
         url = urlparse(pid)
@@ -330,9 +407,13 @@ class DataverseImportProvider(ImportProvider):
         def _recurse_hierarchy(hierarchy, prefix="/"):
             files = hierarchy.pop('+files+')
             for obj in files:
-                alg, checksum = obj["checksum"].split(":")
                 rel_path = os.path.join(prefix, obj["filename"])
-                meta = {"checksum": {alg: checksum}, "dsRelPath": rel_path}
+                meta = {"dsRelPath": rel_path}
+                if obj.get("checksum"):
+                    alg, checksum = obj["checksum"].split(":", 1)
+                    meta["checksum"] = {alg: checksum}
+                if obj.get("unf"):
+                    meta["unf"] = obj["unf"]
                 if obj.get("doi") and obj["doi"] != doi:
                     meta["directIdentifier"] = obj["doi"]
                 yield ImportItem(
@@ -360,6 +441,18 @@ class DataverseImportProvider(ImportProvider):
         yield from _recurse_hierarchy(hierarchy)
         yield ImportItem(ImportItem.END_FOLDER)
 
+    def getVersion(self, dataMap: DataMap, user: object):
+        url = urlparse(dataMap.dataId)
+        if url.path.endswith('file.xhtml') or url.path.startswith('/api/access/datafile'):
+            return None
+        headers = DataverseVerificator(url=dataMap.dataId, user=user).headers
+        try:
+            data = self._get_meta_from_dataset(url, headers=headers)
+            return data['data']['latestVersion']['lastUpdateTime']
+        except Exception:
+            logger.warning(f"[dataverse] failed to get the version of {dataMap.dataId}")
+            return None
+
     def proto_tale_from_datamap(self, dataMap: DataMap, user: object, asTale: bool) -> object:
         proto_tale = super().proto_tale_from_datamap(dataMap, user, asTale)  # get the defaults
         if not asTale:
@@ -34,6 +34,9 @@ class DerivaProvider(BDBagProvider):
             tale=False,
         )
 
+    def getDatasetUIDScope(self, doc: object):
+        return doc.get("folderId")
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         if "folderId" in doc:
             path_to_root = Item().parentsToRoot(doc, user=user)
@@ -13,6 +13,7 @@ class Entity:
         self.value = rawValue
         self.user = user
         self.dict = {}
+        self._memo = {}
 
     def raw(self):
         return self.rawValue
@@ -26,6 +27,17 @@ class Entity:
     def getUser(self):
         return self.user
 
+    def memoize(self, key, func):
+        """
+        Return the result of `func()`, computed only once per `key` during the
+        lifetime of the entity (e.g. between matches() and lookup() of a provider).
+        Include anything the result depends on, such as the value, in the key.
+        Exceptions are not memoized.
+        """
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
+
     def __setitem__(self, key, value):
         self.dict[key] = value
 
@@ -1,53 +1,70 @@
-from hashlib import sha256, md5
+import hashlib
 import json
 import magic
 import os
-import requests
-from girder.utility import hash_state, ziputil, JsonEncoder
+from girder import logger
+from girder.utility import JsonEncoder
 from girder.models.folder import Folder
 from girder.constants import AccessType
 from ..license import WholeTaleLicense
+from ..model_cache import ModelCache
+from ...models.checksum_cache import ChecksumCache
+from .remote_checksums import RemoteChecksumVerifier
+from .tarstream import TarGenerator
+from .zipstream import CompressionPolicy, ZipGenerator
+
+READ_CHUNK_SIZE = int(os.environ.get("GIRDER_WT_EXPORT_READ_CHUNK_SIZE", 4 * 1024 ** 2))
+
+# Archive format -> (Content-Type, file extension)
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar.zst": ("application/zstd", ".tar.zst"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
 
 
 class HashFileStream:
-    """Generator that computes md5 and sha256 of data returned by it"""
+    """Generator that computes checksums of data returned by it"""
 
-    def __init__(self, gen):
+    def __init__(self, gen, algs=("md5", "sha1", "sha256")):
         """
         This class is primarily meant to wrap Girder's download function,
         which returns iterators, hence self.x = x()
+
+        :param algs: Names of hashlib algorithms, all computed in a single pass
         """
         try:
             self.gen = gen()
         except TypeError:
             self.gen = gen
-        self.state = {
-            'md5': hash_state.serializeHex(md5()),
-            'sha256': hash_state.serializeHex(sha256()),
-        }
+        self.hashes = {alg: hashlib.new(alg) for alg in algs}
+        self.size = 0
 
     def __iter__(self):
         return self
 
     def __next__(self):
         nxt = next(self.gen)
-        for alg in self.state.keys():
-            checksum = hash_state.restoreHex(self.state[alg], alg)
+        # hashlib releases the GIL for large chunks, see TaleExporter.bytes_from_file
+        for checksum in self.hashes.values():
             checksum.update(nxt)
-            self.state[alg] = hash_state.serializeHex(checksum)
+        self.size += len(nxt)
         return nxt
 
     def __call__(self):
         """Needs to be callable, see comment in __init__"""
         return self
 
+    def hexdigest(self, alg):
+        return self.hashes[alg].hexdigest()
+
     @property
     def sha256(self):
-        return hash_state.restoreHex(self.state['sha256'], 'sha256').hexdigest()
+        return self.hexdigest('sha256')
 
     @property
     def md5(self):
-        return hash_state.restoreHex(self.state['md5'], 'md5').hexdigest()
+        return self.hexdigest('md5')
 
 
 class TaleExporter:
@@ -59,17 +76,31 @@ class TaleExporter:
        LICENSE: The license that the code and data falls under
        README.md: This file"""
     default_bagit = "BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n"
+    # Prefix of zip paths of the files that are described by the manifest
+    payload_prefix = ""
 
-    def __init__(self, user, manifest, environment, algs=None):
+    def __init__(
+        self, user, manifest, environment, algs=None, models=None, compression=None,
+        archive="zip",
+    ):
         self.user = user
         self.manifest = manifest
         self.environment = environment
+        self.models = ModelCache() if models is None else models
 
         if algs is None:
-            self.algs = ["md5", "sha1", "sha256"]
+            algs = ["md5", "sha1", "sha256"]
+        self.algs = list(algs)
 
         zipname = os.path.basename(manifest["dct:hasVersion"]["@id"])
-        self.zip_generator = ziputil.ZipGenerator(zipname)
+        if archive == "zip":
+            self.archive = ZipGenerator(
+                zipname, policy=CompressionPolicy() if compression is None else compression
+            )
+        elif archive in ARCHIVE_FORMATS:
+            self.archive = TarGenerator(zipname, codec=archive.split(".")[-1])
+        else:
+            raise ValueError(f"Unsupported archive format: {archive}")
         license_spdx = next(
             (
                 agg["schema:license"]
@@ -82,6 +113,11 @@ class TaleExporter:
         self.state = {}
         for alg in self.algs:
             self.state[alg] = []
+        # zip path -> checksum, size and mimetype of the files added so far
+        self.payload_info = {}
+        self._agg_index = None
+        self.magic = magic.Magic(mime=True, uncompress=True)
+        self.verifier = RemoteChecksumVerifier()
 
     def list_files(self):
         """
@@ -95,7 +131,7 @@ class TaleExporter:
             uri = obj["@id"]
             obj_type = obj["@type"]
             obj_id = uri.rsplit("/", 1)[-1]
-            folder = Folder().load(obj_id, user=self.user, level=AccessType.READ)
+            folder = self.models.load(Folder(), obj_id, user=self.user, level=AccessType.READ)
             workspace_path = folder["fsPath"] + "/workspace"
             for curdir, _, files in os.walk(workspace_path):
                 for fname in files:
@@ -107,92 +143,165 @@ class TaleExporter:
                     yield fullpath, relpath
 
     @staticmethod
-    def bytes_from_file(filename, chunksize=8192):
-        with open(filename, mode="rb") as f:
+    def bytes_from_file(filename, chunksize=READ_CHUNK_SIZE):
+        """
+        Read a file with `readinto` into a single reusable buffer.
+
+        Chunks are memoryviews of that buffer, so they are only valid until
+        the next one is requested. Consumers that keep data around (e.g.
+        thread pools) have to copy it.
+        """
+        buffer = bytearray(chunksize)
+        view = memoryview(buffer)
+        with open(filename, mode="rb", buffering=0) as f:
             while True:
-                chunk = f.read(chunksize)
-                if chunk:
-                    yield chunk
-                else:
+                size = f.readinto(buffer)
+                if not size:
                     break
+                yield view[:size]
 
     def stream(self):
+        """
+        Generate the archive. Pending downloads of remote files are cancelled
+        if the archive is not consumed to the end (e.g. the client went away).
+        """
+        try:
+            yield from self._stream()
+        finally:
+            self.verifier.close()
+
+    def _stream(self):
         raise NotImplementedError
 
     @staticmethod
     def stream_string(string):
         return (_.encode() for _ in (string,))
 
-    def dump_and_checksum(self, func, zip_path):
-        hash_file_stream = HashFileStream(func)
-        for data in self.zip_generator.addFile(hash_file_stream, zip_path):
+    def dump_and_checksum(self, func, zip_path, mime_type="text/plain"):
+        hash_file_stream = HashFileStream(func, algs=self.algs)
+        for data in self.archive.addFile(
+            hash_file_stream, zip_path, mime_type=mime_type
+        ):
             yield data
-        # MD5 is the only required alg in profile. See Manifests-Required in
-        # https://raw.githubusercontent.com/fair-research/bdbag/master/profiles/bdbag-ro-profile.json
-        self.state['md5'].append((zip_path, hash_file_stream.md5))
+        self._record_payload(
+            zip_path,
+            {alg: hash_file_stream.hexdigest(alg) for alg in self.algs},
+            hash_file_stream.size,
+            mime_type,
+        )
+
+    def dump_file(self, fullpath, zip_path):
+        """
+        Add a file from the disk, see dump_and_checksum.
+
+        Checksums and mimetype of unchanged files are taken from ChecksumCache.
+        Since the file is read anyway, its md5 is always computed and compared
+        with the cached one, which is only trusted if they match.
+        """
+        stat = os.stat(fullpath)
+        cached = ChecksumCache().get(stat, self.algs)
+        if cached is None:
+            mime_type = self.magic.from_file(fullpath) or "application/octet-stream"
+            algs = self.algs
+        else:
+            mime_type = cached["mimeType"]
+            algs = ["md5"]
+
+        hash_file_stream = HashFileStream(self.bytes_from_file(fullpath), algs=algs)
+        for data in self.archive.addFile(
+            hash_file_stream, zip_path, mime_type=mime_type, size=stat.st_size
+        ):
+            yield data
+
+        if cached is not None and cached["md5"] != hash_file_stream.md5:
+            logger.warning("Checksum cache entry for %s is stale, rehashing", fullpath)
+            cached = None
+            hash_file_stream = HashFileStream(self.bytes_from_file(fullpath), algs=self.algs)
+            for _ in hash_file_stream:
+                pass
+
+        if cached is None:
+            checksums = {alg: hash_file_stream.hexdigest(alg) for alg in self.algs}
+            new_stat = os.stat(fullpath)
+            if (new_stat.st_size, new_stat.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                ChecksumCache().put(stat, checksums, mime_type)
+        else:
+            checksums = {alg: cached[alg] for alg in self.algs}
+        self._record_payload(zip_path, checksums, hash_file_stream.size, mime_type)
+
+    def dump_tag_file(self, content, fname, chunksize=1024 * 1024):
+        """
+        Add a file that is not part of the payload (e.g. metadata) to the
+        archive, computing its checksums on the way.
+
+        :param content: Rendered content of the file
+        :return: A dict of alg -> hex digest
+        """
+        data = content.encode()
+        hash_file_stream = HashFileStream(
+            (data[i:i + chunksize] for i in range(0, max(len(data), 1), chunksize)),
+            algs=self.algs,
+        )
+        yield from self.archive.addFile(hash_file_stream, fname, size=len(data))
+        return {alg: hash_file_stream.hexdigest(alg) for alg in self.algs}
+
+    def _record_payload(self, zip_path, checksums, size, mime_type):
+        # MD5 is the only required alg in profile (see Manifests-Required in
+        # https://raw.githubusercontent.com/fair-research/bdbag/master/profiles/bdbag-ro-profile.json),
+        # but all of them are computed from the same read, so record every one.
+        for alg in self.algs:
+            self.state[alg].append((zip_path, checksums[alg]))
+        self.payload_info[zip_path] = {
+            "wt:md5": checksums["md5"],
+            "wt:size": size,
+            "wt:mimeType": mime_type,
+        }
 
     def _agg_index_by_uri(self, uri):
-        aggs = self.manifest["aggregates"]
-        return next((i for (i, d) in enumerate(aggs) if d['uri'] == uri), None)
+        if self._agg_index is None:
+            self._agg_index = {}
+            for index, agg in enumerate(self.manifest["aggregates"]):
+                self._agg_index.setdefault(agg["uri"], index)
+        return self._agg_index.get(uri)
 
-    def append_aggergate_checksums(self):
+    def append_aggregate_info(self):
         """
-        Takes the md5 checksums and adds them to the files in the 'aggregates' section
+        Adds the md5 checksums, sizes and mimetypes recorded while streaming
+        the payload to the files in the 'aggregates' section. Aggregates that
+        were not part of the payload are checksummed afterwards.
         :return: None
         """
         aggs = self.manifest["aggregates"]
-        for path, chksum in self.state['md5']:
-            uri = "./" + path.replace("data/", "", 1)
-            index = self._agg_index_by_uri(uri)
+        for path, info in self.payload_info.items():
+            if path.startswith(self.payload_prefix):
+                path = path[len(self.payload_prefix):]
+            index = self._agg_index_by_uri("./" + path)
             if index is not None:
-                aggs[index]['wt:md5'] = chksum
+                aggs[index].update(info)
         self.verify_aggregate_checksums()
 
-    def verify_aggregate_checksums(self):
-        """Check if every aggregate has a proper checksum."""
-        algs = {f"wt:{alg}" for alg in self.algs}
-        for index, agg in enumerate(self.manifest["aggregates"]):
-            if algs - set(agg.keys()) == algs:
-                try:
-                    req = requests.get(agg["uri"], allow_redirects=True, stream=True)
-                except requests.exceptions.InvalidSchema:
-                    # globus...
-                    continue
-                md5sum = md5()
-                for chunk in req.iter_content(chunk_size=4096):
-                    md5sum.update(chunk)
-                self.manifest["aggregates"][index]["wt:md5"] = md5sum.hexdigest()
-
-    def append_aggregate_filesize_mimetypes(self):
-        """
-        Adds the file size and mimetype to the workspace files
-        :return: None
-        """
-        magic_wrapper = magic.Magic(mime=True, uncompress=True)
-        aggs = self.manifest["aggregates"]
-        for fullpath, relpath in self.list_files():
-            uri = "./" + relpath
-            index = self._agg_index_by_uri(uri)
-            if index is not None:
-                aggs[index]["wt:mimeType"] = (
-                    magic_wrapper.from_file(fullpath) or "application/octet-stream"
-                )
-                aggs[index]["wt:size"] = os.path.getsize(fullpath)
+    def _missing_checksum(self, agg):
+        return not any(f"wt:{alg}" in agg for alg in self.algs)
 
-    def append_extras_filesize_mimetypes(self, extra_files):
+    def prefetch_remote_checksums(self):
         """
-        Appends the mimetype and size to the extra files in the 'aggregates 'section
-        :param extra_files: Dictionary of extra file names
-        :type extra_files: dict
-        :return: None
+        Start computing checksums of external files that lack them, so that
+        downloading them overlaps with streaming the payload.
         """
-        aggs = self.manifest["aggregates"]
-        for path, content in extra_files.items():
-            uri = "./" + path.replace("data/", "", 1)
-            index = self._agg_index_by_uri(uri)
-            if index is not None:
-                aggs[index]["wt:mimeType"] = "text/plain"
-                aggs[index]["wt:size"] = len(content)
+        for agg in self.manifest["aggregates"]:
+            if "bundledAs" in agg and self._missing_checksum(agg):
+                self.verifier.submit(agg["uri"])
+
+    def verify_aggregate_checksums(self):
+        """Check if every aggregate has a proper checksum."""
+        try:
+            for agg in self.manifest["aggregates"]:
+                if self._missing_checksum(agg):
+                    chksum = self.verifier.md5(agg["uri"])
+                    if chksum is not None:
+                        agg["wt:md5"] = chksum
+        finally:
+            self.verifier.close()
 
     @staticmethod
     def formated_dump(obj, **kwargs):
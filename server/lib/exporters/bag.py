@@ -1,9 +1,8 @@
 from datetime import datetime, timezone
-from hashlib import sha1, sha256, md5
 import os
 from urllib.parse import unquote
-import requests
 from . import TaleExporter
+from .registry import registry_tags
 from gwvolman.constants import REPO2DOCKER_VERSION
 
 
@@ -74,7 +73,9 @@ Access on http://localhost:{port}/{urlPath}
 
 
 class BagTaleExporter(TaleExporter):
-    def stream(self):
+    payload_prefix = "data/"
+
+    def _stream(self):
         token = 'wholetale'
         container_config = self.environment["config"]
         urlPath = container_config['urlPath'].format(token=token)
@@ -90,39 +91,28 @@ class BagTaleExporter(TaleExporter):
         extra_files = {
             'data/LICENSE': self.tale_license['text'],
         }
-        oxum = dict(size=0, num=0)
+
+        self.prefetch_remote_checksums()
 
         # Add files from the workspace computing their checksum
         for fullpath, relpath in self.list_files():
-            yield from self.dump_and_checksum(
-                self.bytes_from_file(fullpath), 'data/' + relpath
-            )
-            oxum["num"] += 1
-            oxum["size"] += os.path.getsize(fullpath)
+            yield from self.dump_file(fullpath, 'data/' + relpath)
 
         # Compute checksums for the extrafiles
         for path, content in extra_files.items():
-            oxum['num'] += 1
-            oxum['size'] += len(content)
             payload = self.stream_string(content)
             yield from self.dump_and_checksum(payload, path)
 
-        # Update manifest with hashes
-        self.append_aggergate_checksums()
+        # Update manifest with hashes, filesizes and mimeTypes
+        self.append_aggregate_info()
 
-        # Update oxum with external data files
-        external_data_oxum = self.calculate_data_oxum()
-        oxum["num"] += external_data_oxum["num"]
-        oxum["size"] += external_data_oxum["size"]
+        # Oxum of the streamed payload and external data files
+        oxum = self.calculate_data_oxum()
+        oxum["num"] += len(self.payload_info)
+        oxum["size"] += sum(info["wt:size"] for info in self.payload_info.values())
 
-        # Update manifest with filesizes and mimeTypes for workspace items
-        self.append_aggregate_filesize_mimetypes()
-
-        # Update manifest with filesizes and mimeTypes for extra items
-        self.append_extras_filesize_mimetypes(extra_files)
-
-        # Create the fetch file
-        fetch_file = ""
+        # Paths of the external files relative to the root of the bag
+        bundles = []
         for bundle in self.manifest['aggregates']:
             if 'bundledAs' not in bundle:
                 continue
@@ -130,9 +120,14 @@ class BagTaleExporter(TaleExporter):
             # to make it relative to the root of the bag. It always startswith
             # "./"
             folder = f"data{unquote(bundle['bundledAs']['folder'])[1:]}"
-            fetch_file += f"{bundle['uri']} {bundle['wt:size']} {folder}"
-            fetch_file += unquote(bundle['bundledAs'].get('filename', ''))
-            fetch_file += '\n'
+            filename = unquote(bundle['bundledAs'].get('filename', ''))
+            bundles.append((bundle, folder, filename))
+
+        # Create the fetch file
+        fetch_file = "".join(
+            f"{bundle['uri']} {bundle['wt:size']} {folder}{filename}\n"
+            for bundle, folder, filename in bundles
+        )
 
         now = datetime.now(timezone.utc)
         bag_info = bag_info_tpl.format(
@@ -143,53 +138,42 @@ class BagTaleExporter(TaleExporter):
         )
 
         def dump_checksums(alg):
-            dump = ""
-            for path, chksum in self.state[alg]:
-                dump += f"{chksum} {path}\n"
-            for bundle in self.manifest['aggregates']:
-                if 'bundledAs' not in bundle:
-                    continue
-                try:
-                    chksum = bundle[f"wt:{alg}"]
-                    folder = f"data{unquote(bundle['bundledAs']['folder'])[1:]}"
-                    filename = unquote(bundle['bundledAs'].get('filename', ''))
-                    dump += f"{chksum} {os.path.join(folder, filename)}\n"
-                except KeyError:
-                    pass
-            return dump
-
-        tagmanifest = dict(md5="", sha1="", sha256="")
-        for payload, fname in (
+            lines = [f"{chksum} {path}\n" for path, chksum in self.state.get(alg, [])]
+            lines += [
+                f"{bundle[f'wt:{alg}']} {os.path.join(folder, filename)}\n"
+                for bundle, folder, filename in bundles
+                if f"wt:{alg}" in bundle
+            ]
+            return "".join(lines)
+
+        # Tag files are rendered one at a time, when they are written
+        tag_files = [
             (lambda: top_readme, 'README.md'),
             (lambda: run_file, 'run-local.sh'),
             (lambda: self.default_bagit, 'bagit.txt'),
             (lambda: bag_info, 'bag-info.txt'),
             (lambda: fetch_file, 'fetch.txt'),
-            (lambda: dump_checksums('md5'), 'manifest-md5.txt'),
-            (lambda: dump_checksums('sha1'), 'manifest-sha1.txt'),
-            (lambda: dump_checksums('sha256'), 'manifest-sha256.txt'),
+        ]
+        tag_files += [
+            (lambda alg=alg: dump_checksums(alg), f'manifest-{alg}.txt') for alg in self.algs
+        ]
+        tag_files += [
             (lambda: self.formated_dump(self.environment, indent=4), 'metadata/environment.json'),
             (lambda: self.formated_dump(self.manifest, indent=4), 'metadata/manifest.json'),
-        ):
-            tagmanifest['md5'] += "{} {}\n".format(
-                md5(payload().encode()).hexdigest(), fname
+        ]
+        tagmanifest = {alg: [] for alg in self.algs}
+        for payload, fname in tag_files:
+            checksums = yield from self.dump_tag_file(payload(), fname)
+            for alg in self.algs:
+                tagmanifest[alg].append(f"{checksums[alg]} {fname}\n")
+
+        for alg in self.algs:
+            yield from self.dump_tag_file(
+                "".join(tagmanifest[alg]), f'tagmanifest-{alg}.txt'
             )
-            tagmanifest['sha1'] += "{} {}\n".format(
-                sha1(payload().encode()).hexdigest(), fname
-            )
-            tagmanifest['sha256'] += "{} {}\n".format(
-                sha256(payload().encode()).hexdigest(), fname
-            )
-            yield from self.zip_generator.addFile(payload, fname)
-
-        for payload, fname in (
-            (lambda: tagmanifest['md5'], 'tagmanifest-md5.txt'),
-            (lambda: tagmanifest['sha1'], 'tagmanifest-sha1.txt'),
-            (lambda: tagmanifest['sha256'], 'tagmanifest-sha256.txt'),
-        ):
-            yield from self.zip_generator.addFile(payload, fname)
 
-        yield self.zip_generator.footer()
+        yield self.archive.footer()
+        self.models.report(self.archive.rootPath)
 
     def calculate_data_oxum(self):
         oxum = {"num": 0, "size": 0}
@@ -214,15 +198,10 @@ class BagTaleExporter(TaleExporter):
             raise RuntimeError("Unable to find image in the manifest")
 
         image_name, reference = image_digest.split(":")
-        image_name = image_name.split(":")[0]  # Tag is ignored GET /manifest"
-        image_name = image_name.replace("/tale", "/v2/tale")
-        response = requests.get(f"https://{image_name}/tags/list")
+        registry, repository = image_name.split("/", 1)
 
         build_cmd = ''
-        try:
-            response.raise_for_status()
-            assert reference in response.json()["tags"]
-        except (requests.exceptions.HTTPError, AssertionError):
+        if not registry_tags.has_tag(registry, repository, reference):
             # No image
             build_cmd = build_tpl.format(
                 repo2docker=container_config.get('repo2docker_version', REPO2DOCKER_VERSION),
@@ -2,36 +2,30 @@ from . import TaleExporter
 
 
 class NativeTaleExporter(TaleExporter):
-    def stream(self):
+    def _stream(self):
         extra_files = {
             'README.md': self.default_top_readme,
             'LICENSE': self.tale_license['text'],
             'metadata/environment.json': self.formated_dump(self.environment, indent=4),
         }
 
+        self.prefetch_remote_checksums()
+
         # Add files from the workspace
         for fullpath, relpath in self.list_files():
-            yield from self.dump_and_checksum(
-                self.bytes_from_file(fullpath), relpath
-            )
+            yield from self.dump_file(fullpath, relpath)
 
         # Compute checksums for extra files
         for path, content in extra_files.items():
             payload = self.stream_string(content)
             yield from self.dump_and_checksum(payload, path)
 
-        # Update manifest with hashes
-        self.append_aggergate_checksums()
-
-        # Update manifest with filesizes and mimeTypes
-        self.append_aggregate_filesize_mimetypes()
-
-        # Update manifest with filesizes and mimeTypes for extra items
-        self.append_extras_filesize_mimetypes(extra_files)
+        # Update manifest with hashes, filesizes and mimeTypes
+        self.append_aggregate_info()
 
-        for data in self.zip_generator.addFile(
-            lambda: self.formated_dump(self.manifest, indent=4), 'metadata/manifest.json'
-        ):
-            yield data
+        yield from self.dump_tag_file(
+            self.formated_dump(self.manifest, indent=4), 'metadata/manifest.json'
+        )
 
-        yield self.zip_generator.footer()
+        yield self.archive.footer()
+        self.models.report(self.archive.rootPath)
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+import requests
+
+REGISTRY_TIMEOUT = float(os.environ.get("GIRDER_WT_REGISTRY_TIMEOUT", 5))
+REGISTRY_TAGS_TTL = int(os.environ.get("GIRDER_WT_REGISTRY_TAGS_TTL", 300))
+REGISTRY_TAGS_NEGATIVE_TTL = int(os.environ.get("GIRDER_WT_REGISTRY_TAGS_NEGATIVE_TTL", 30))
+
+
+class RegistryClient:
+    """
+    Minimal client of the Docker Registry HTTP API V2.
+
+    Any object providing `list_tags(registry, repository)` can be used in
+    its place, e.g. a local stand-in registry in tests.
+    """
+
+    def __init__(self, timeout=REGISTRY_TIMEOUT):
+        self.timeout = timeout
+
+    def list_tags(self, registry, repository):
+        """
+        Return the tags of `repository`, or None if the registry does not know
+        it or cannot be reached.
+        """
+        try:
+            response = requests.get(
+                f"https://{registry}/v2/{repository}/tags/list", timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.json().get("tags") or []
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+
+class RegistryTagCache:
+    """
+    Per repository cache of registry tag listings.
+
+    A listing is reused for `ttl` seconds if it contains the requested tag.
+    Listings without it, as well as failed lookups, are only reused for
+    `negative_ttl` seconds, so that newly pushed images are noticed quickly.
+    """
+
+    def __init__(self, client=None, ttl=REGISTRY_TAGS_TTL, negative_ttl=REGISTRY_TAGS_NEGATIVE_TTL):
+        self.client = RegistryClient() if client is None else client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def has_tag(self, registry, repository, tag):
+        key = (registry, repository)
+        with self._lock:
+            entry = self._tags.get(key)
+        if entry is not None:
+            tags, fetched = entry
+            age = time.monotonic() - fetched
+            found = tags is not None and tag in tags
+            if age < (self.ttl if found else self.negative_ttl):
+                return found
+
+        tags = self.client.list_tags(registry, repository)
+        with self._lock:
+            self._tags[key] = (tags, time.monotonic())
+        return tags is not None and tag in tags
+
+    def clear(self):
+        with self._lock:
+            self._tags.clear()
+
+
+registry_tags = RegistryTagCache()
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+import os
+
+import requests
+
+from .. import http_client
+from ...models.remote_checksum_cache import RemoteChecksumCache
+
+VERIFY_WORKERS = int(os.environ.get("GIRDER_WT_EXPORT_VERIFY_WORKERS", 4))
+VERIFY_CHUNK_SIZE = 1024 * 1024
+
+
+class RemoteChecksumVerifier:
+    """
+    Computes md5 checksums of remote files in a bounded pool of threads.
+
+    Files are downloaded with the shared http_client, so that requests are
+    subject to its timeouts and per host limits. Results are stored in
+    RemoteChecksumCache, so that a file is downloaded again only if its ETag
+    or Last-Modified, as returned by a HEAD request, changes.
+    """
+
+    def __init__(self, max_workers=VERIFY_WORKERS, chunk_size=VERIFY_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="wt-verify"
+        )
+        self._futures = {}
+
+    def submit(self, uri):
+        """Schedule computation of the checksum of `uri`, unless it already is."""
+        if uri not in self._futures:
+            self._futures[uri] = self._executor.submit(self._md5, uri)
+        return self._futures[uri]
+
+    def md5(self, uri):
+        """Return the md5 checksum of `uri`, or None if it cannot be downloaded."""
+        return self.submit(uri).result()
+
+    def close(self):
+        """Cancel pending downloads and release the threads."""
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _md5(self, uri):
+        try:
+            req = http_client.head(uri, allow_redirects=True)
+            if req.ok:
+                validators = RemoteChecksumCache.validators(req.headers)
+                checksums = RemoteChecksumCache().get(uri, validators)
+                if checksums is not None:
+                    return checksums["md5"]
+            with http_client.get(uri, stream=True) as req:
+                if not req.ok:
+                    return None
+                md5sum = md5()
+                for chunk in req.iter_content(chunk_size=self.chunk_size):
+                    md5sum.update(chunk)
+                checksums = {"md5": md5sum.hexdigest()}
+                validators = RemoteChecksumCache.validators(req.headers)
+                RemoteChecksumCache().put(uri, validators, checksums)
+                return checksums["md5"]
+        except requests.exceptions.RequestException:
+            # e.g. globus:// or an unreachable host, the checksum is unavailable
+            return None
@@ -0,0 +1,231 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import struct
+import tarfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = int(os.environ.get("GIRDER_WT_EXPORT_ZSTD_LEVEL", 3))
+GZIP_LEVEL = int(os.environ.get("GIRDER_WT_EXPORT_GZIP_LEVEL", 6))
+TAR_COMPRESSION_WORKERS = int(
+    os.environ.get("GIRDER_WT_EXPORT_TAR_COMPRESSION_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+# Input collected before a block is handed to a gzip worker
+_GZIP_BLOCK_SIZE = 1024 * 1024
+_WINDOW_SIZE = 32 * 1024
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class GzipCompressor:
+    """
+    Incremental gzip compressor.
+
+    With more than one worker, blocks of input are deflated in parallel and
+    joined with sync flushes, using the tail of the previous block as a preset
+    dictionary (as pigz does).
+    """
+
+    def __init__(self, level=GZIP_LEVEL, workers=1):
+        self.level = level
+        self.workers = workers
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="wt-gzip"
+            )
+            self._pending = deque()
+            self._buffer = bytearray()
+            self._zdict = None
+            self._crc = 0
+            self._size = 0
+            # gzip header: deflate, no flags, mtime, no extra flags, unknown OS
+            self._header = struct.pack("<4sLBB", b"\x1f\x8b\x08\x00", int(time.time()), 0, 255)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def _deflate_block(self, data, zdict):
+        if zdict:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._pending.append(self._executor.submit(self._deflate_block, data, self._zdict))
+        self._zdict = data[-_WINDOW_SIZE:]
+
+    def _collect(self, wait=False):
+        out = [self._header]
+        self._header = b""
+        while self._pending and (
+            wait or self._pending[0].done() or len(self._pending) > 2 * self.workers
+        ):
+            out.append(self._pending.popleft().result())
+        return b"".join(out)
+
+    def compress(self, data):
+        if self.workers <= 1:
+            return self._compressor.compress(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        if len(self._buffer) >= _GZIP_BLOCK_SIZE:
+            self._submit()
+        return self._collect()
+
+    def flush(self):
+        if self.workers <= 1:
+            return self._compressor.flush()
+        if self._buffer:
+            self._submit()
+        out = self._collect(wait=True)
+        self._executor.shutdown(wait=False)
+        final = zlib.compressobj(self.level, zlib.DEFLATED, -15).flush()
+        return out + final + struct.pack("<LL", self._crc, self._size & 0xFFFFFFFF)
+
+
+def get_compressor(codec, level=None, workers=TAR_COMPRESSION_WORKERS):
+    """Return an object with compress(data) and flush() for 'zst' or 'gz'."""
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL if level is None else level,
+            threads=workers if workers > 1 else 0,
+        ).compressobj()
+    if codec == "gz":
+        return GzipCompressor(level=GZIP_LEVEL if level is None else level, workers=workers)
+    raise ValueError(f"Unsupported compression: {codec}")
+
+
+class TarGenerator:
+    """
+    Streaming writer of compressed tar archives, with the same interface as
+    ZipGenerator so that exporters can use either.
+    """
+
+    def __init__(self, rootPath="", codec="zst", level=None, workers=TAR_COMPRESSION_WORKERS):
+        self.rootPath = rootPath
+        self.codec = codec
+        self._compressor = get_compressor(codec, level=level, workers=workers)
+        self.offset = 0
+
+    def _write(self, data):
+        self.offset += len(data)
+        return self._compressor.compress(data)
+
+    def addFile(self, generator, path, mime_type=None, size=None):
+        """
+        Generate a tar member.
+
+        Tar headers precede the data, so members of unknown size are read
+        into memory first. A file whose size differs from `size` is an error.
+        """
+        chunks = (
+            data.encode("utf8") if isinstance(data, str) else data
+            for data in generator()
+        )
+        if size is None:
+            chunks = [b"".join(bytes(chunk) for chunk in chunks)]
+            size = len(chunks[0])
+
+        info = tarfile.TarInfo(os.path.join(self.rootPath, path))
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        data = self._write(info.tobuf(format=tarfile.PAX_FORMAT))
+        if data:
+            yield data
+
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            if written > size:
+                break
+            data = self._write(chunk)
+            if data:
+                yield data
+        if written != size:
+            raise RuntimeError(f"Size of {path} changed while it was archived")
+
+        padding = -size % tarfile.BLOCKSIZE
+        if padding:
+            data = self._write(tarfile.NUL * padding)
+            if data:
+                yield data
+
+    def footer(self):
+        """End the archive and flush the compressor."""
+        end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+        end += tarfile.NUL * (-(self.offset + len(end)) % tarfile.RECORDSIZE)
+        return self._write(end) + self._compressor.flush()
+
+
+class IterStream(io.RawIOBase):
+    """Read-only file object over an iterator of bytes."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._leftover = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._leftover:
+            try:
+                self._leftover = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._leftover))
+        buffer[:n] = self._leftover[:n]
+        self._leftover = self._leftover[n:]
+        return n
+
+
+def _checked_members(tar, path):
+    """Yield regular files and directories that stay inside `path`."""
+    root = os.path.realpath(path)
+    for member in tar:
+        if not (member.isreg() or member.isdir()):
+            continue
+        target = os.path.realpath(os.path.join(root, member.name))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"Illegal path in the archive: {member.name}")
+        member.mode = 0o755 if member.isdir() else 0o644
+        yield member
+
+
+def extract_tar_stream(fileobj, path, codec):
+    """
+    Extract a compressed tar archive read sequentially from `fileobj`.
+
+    :return: Names of the extracted members, in archive order
+    """
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("zstd decompression requires the 'zstandard' package")
+        fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        mode = "r|"
+    else:
+        mode = "r|gz"
+
+    # Use the extraction filter of newer Pythons on top of our own checks
+    kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    names = []
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for member in _checked_members(tar, path):
+            names.append(member.name)
+            tar.extract(member, path=path, set_attrs=False, **kwargs)
+    return names
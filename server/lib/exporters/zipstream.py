@@ -0,0 +1,248 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+DEFLATE_LEVEL = int(os.environ.get("GIRDER_WT_EXPORT_DEFLATE_LEVEL", 6))
+COMPRESSION_WORKERS = int(os.environ.get("GIRDER_WT_EXPORT_COMPRESSION_WORKERS", 0))
+PARALLEL_THRESHOLD = int(
+    os.environ.get("GIRDER_WT_EXPORT_PARALLEL_THRESHOLD", 64 * 1024 ** 2)
+)
+
+# Deflate window, used as a preset dictionary between independently compressed chunks
+_WINDOW_SIZE = 32 * 1024
+
+
+class CompressionPolicy:
+    """
+    Decides how members of an exported zip are compressed.
+
+    Files that are already compressed (by extension or mimetype) are stored,
+    everything else is deflated with `level`. Members larger than
+    `parallel_threshold` are compressed by `workers` threads, if any.
+
+    ZipGenerator writes stored members as deflate streams made of
+    uncompressed blocks, see ZipGenerator.addFile.
+    """
+
+    stored_extensions = {
+        "7z", "avi", "bz2", "docx", "flac", "gif", "gz", "h5", "hdf5", "jpeg", "jpg",
+        "lz4", "mkv", "mov", "mp3", "mp4", "nc", "npz", "ogg", "parquet", "pdf",
+        "png", "pptx", "rar", "rds", "tgz", "webm", "webp", "xlsx", "xz", "zip", "zst",
+    }
+    stored_mimetypes = {
+        "application/gzip", "application/x-7z-compressed", "application/x-bzip2",
+        "application/x-hdf", "application/x-hdf5", "application/x-rar",
+        "application/x-xz", "application/zip", "application/zstd",
+        "application/vnd.apache.parquet",
+    }
+    # Most images, audio and video are compressed, these are the exceptions
+    compressible_media = {"image/bmp", "image/svg+xml", "image/tiff", "audio/x-wav"}
+
+    def __init__(
+        self,
+        level=DEFLATE_LEVEL,
+        workers=COMPRESSION_WORKERS,
+        parallel_threshold=PARALLEL_THRESHOLD,
+    ):
+        self.level = level
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+
+    def compress_type(self, path, mime_type=None):
+        """Return zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED for a member."""
+        if self.level == 0:
+            return zipfile.ZIP_STORED
+        ext = os.path.splitext(path)[1].lstrip(".").lower()
+        if ext in self.stored_extensions:
+            return zipfile.ZIP_STORED
+        if mime_type:
+            mime_type = mime_type.split(";")[0].strip().lower()
+            if mime_type in self.stored_mimetypes:
+                return zipfile.ZIP_STORED
+            if mime_type.startswith(("image/", "audio/", "video/")) and (
+                mime_type not in self.compressible_media
+            ):
+                return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def parallel(self, size):
+        return self.workers > 0 and size is not None and size >= self.parallel_threshold
+
+
+class ZipGenerator:
+    """
+    Streaming zip writer with the same interface as Girder's
+    girder.utility.ziputil.ZipGenerator, but the compression is chosen per
+    member by a CompressionPolicy.
+    """
+
+    def __init__(self, rootPath="", policy=None):
+        self.rootPath = rootPath
+        self.policy = CompressionPolicy() if policy is None else policy
+        self.files = []
+        self.offset = 0
+        self._executor = None
+
+    def _advanceOffset(self, data):
+        self.offset += len(data)
+        return data
+
+    def addFile(self, generator, path, mime_type=None, size=None):
+        """
+        Generate a zip member.
+
+        :param generator: A callable returning an iterable of the file's chunks.
+        :param path: Path of the member relative to rootPath.
+        :param mime_type: Optional mimetype of the file, used by the policy.
+        :param size: Optional expected size of the file.
+
+        Sizes and crc follow the data in a descriptor, which some readers (e.g.
+        Java's ZipInputStream) only accept for deflated members. Members the
+        policy stores are therefore deflated with level 0 instead.
+        """
+        info = zipfile.ZipInfo(os.path.join(self.rootPath, path), time.localtime()[0:6])
+        info.external_attr = (0o100644 & 0xFFFF) << 16
+        stored = self.policy.compress_type(path, mime_type) == zipfile.ZIP_STORED
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.header_offset = self.offset
+        info.flag_bits |= 0x08  # sizes and crc follow the data
+        info.CRC = info.compress_size = info.file_size = 0
+        zip64 = size is not None and size * 1.05 > zipfile.ZIP64_LIMIT
+        yield self._advanceOffset(info.FileHeader(zip64=zip64))
+
+        chunks = self._encoded(generator(), info)
+        if stored:
+            compressed = self._deflate(chunks, level=0)
+        elif self.policy.parallel(size):
+            compressed = self._deflate_parallel(chunks)
+        else:
+            compressed = self._deflate(chunks, level=self.policy.level)
+        for data in compressed:
+            if data:
+                info.compress_size += len(data)
+                yield self._advanceOffset(data)
+
+        if zip64 or max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT:
+            fmt = "<LLQQ"
+        else:
+            fmt = "<LLLL"
+        yield self._advanceOffset(
+            struct.pack(fmt, 0x08074B50, info.CRC, info.compress_size, info.file_size)
+        )
+        self.files.append(info)
+
+    @staticmethod
+    def _encoded(chunks, info):
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode("utf8")
+            info.file_size += len(data)
+            info.CRC = zlib.crc32(data, info.CRC)
+            yield data
+
+    def _compressor(self, level, zdict=None):
+        if zdict:
+            return zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+        return zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def _deflate(self, chunks, level):
+        compressor = self._compressor(level)
+        for data in chunks:
+            yield compressor.compress(data)
+        yield compressor.flush()
+
+    def _deflate_chunk(self, data, zdict):
+        compressor = self._compressor(self.policy.level, zdict)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _deflate_parallel(self, chunks):
+        """
+        Deflate chunks independently in a thread pool (zlib releases the GIL).
+
+        Each chunk ends with a sync flush, so the outputs concatenated in order
+        followed by an empty final block form a valid deflate stream. The tail
+        of the previous chunk is used as a preset dictionary, as in pigz.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.policy.workers, thread_name_prefix="wt-zip"
+            )
+        pending = deque()
+        zdict = None
+        for data in chunks:
+            data = bytes(data)  # the source buffer may be reused
+            pending.append(self._executor.submit(self._deflate_chunk, data, zdict))
+            zdict = data[-_WINDOW_SIZE:]
+            while len(pending) > 2 * self.policy.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+        yield self._compressor(self.policy.level).flush()
+
+    def footer(self):
+        """Generate the central directory, ending the archive."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+        data = []
+        start = self.offset
+        for info in self.files:
+            dt = info.date_time
+            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+            extra = []
+            if max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT:
+                extra += [info.file_size, info.compress_size]
+                file_size = compress_size = 0xFFFFFFFF
+            else:
+                file_size, compress_size = info.file_size, info.compress_size
+            if info.header_offset > zipfile.ZIP64_LIMIT:
+                extra.append(info.header_offset)
+                header_offset = 0xFFFFFFFF
+            else:
+                header_offset = info.header_offset
+            extra_data = b""
+            if extra:
+                extra_data = struct.pack("<HH" + "Q" * len(extra), 1, 8 * len(extra), *extra)
+                info.extract_version = max(zipfile.ZIP64_VERSION, info.extract_version)
+                info.create_version = max(zipfile.ZIP64_VERSION, info.create_version)
+            try:
+                filename = info.filename.encode("ascii")
+                flag_bits = info.flag_bits
+            except UnicodeEncodeError:
+                filename = info.filename.encode("utf-8")
+                flag_bits = info.flag_bits | 0x800
+            centdir = struct.pack(
+                zipfile.structCentralDir, zipfile.stringCentralDir,
+                info.create_version, info.create_system, info.extract_version,
+                info.reserved, flag_bits, info.compress_type, dostime, dosdate,
+                info.CRC, compress_size, file_size, len(filename), len(extra_data),
+                len(info.comment), 0, info.internal_attr, info.external_attr, header_offset,
+            )
+            data.append(self._advanceOffset(centdir + filename + extra_data + info.comment))
+
+        count = len(self.files)
+        size = self.offset - start
+        if count > zipfile.ZIP_FILECOUNT_LIMIT or max(size, start) > zipfile.ZIP64_LIMIT:
+            zip64_end = self.offset
+            data.append(self._advanceOffset(struct.pack(
+                zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                44, 45, 45, 0, 0, count, count, size, start,
+            )))
+            data.append(self._advanceOffset(struct.pack(
+                zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator,
+                0, zip64_end, 1,
+            )))
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            start = min(start, 0xFFFFFFFF)
+        data.append(self._advanceOffset(struct.pack(
+            zipfile.structEndArchive, zipfile.stringEndArchive,
+            0, 0, count, count, size, start, 0,
+        )))
+        return b"".join(data)
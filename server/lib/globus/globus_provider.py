@@ -3,7 +3,6 @@ import re
 from typing import Tuple
 from urllib.parse import urlparse
 import pathlib
-import requests
 
 from girder.models.item import Item
 from girder.models.folder import Folder
@@ -14,6 +13,7 @@ from ..entity import Entity
 from ..data_map import DataMap
 from ..import_item import ImportItem
 from ...utils import deep_get
+from .. import http_client
 
 from girder.plugins.globus_handler.clients import Clients
 
@@ -52,7 +52,7 @@ class GlobusImportProvider(ImportProvider):
             "q": '"{}"'.format(globus_id),
             "advanced": False,
         }
-        req = requests.post(
+        req = http_client.post(
             f"https://search.api.globus.org/v1/index/{self.index_id}/search",
             json=data,
             headers=headers
@@ -137,6 +137,10 @@ class GlobusImportProvider(ImportProvider):
                     meta={"dsRelPath": ds_relative_path + "/" + entry["name"]},
                 )
 
+    def getDatasetUIDScope(self, doc):
+        if 'identifier' not in (doc.get('meta') or {}):
+            return doc.get('folderId')
+
     def getDatasetUID(self, doc, user):
         try:
             identifier = doc['meta']['identifier']  # if root of ds, it should have it
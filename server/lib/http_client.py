@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP client of import providers and resolvers.
+
+Requests go through one pooled requests.Session per host, so that
+connections (and TLS sessions) are reused between calls. Every request gets
+a default timeout, idempotent requests are retried with jittered exponential
+backoff on connection errors, 429 and 5xx, and the number of concurrent
+requests to a single host is bounded.
+
+Sessions never store cookies, since they are shared between users. Pass
+them explicitly with `cookies=` instead.
+"""
+
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+import os
+import random
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = float(os.environ.get("GIRDER_WT_HTTP_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("GIRDER_WT_HTTP_READ_TIMEOUT", 60))
+RETRIES = int(os.environ.get("GIRDER_WT_HTTP_RETRIES", 3))
+BACKOFF_FACTOR = float(os.environ.get("GIRDER_WT_HTTP_BACKOFF_FACTOR", 0.5))
+MAX_PER_HOST = int(os.environ.get("GIRDER_WT_HTTP_MAX_PER_HOST", 8))
+MAX_RETRY_AFTER = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """Retry with 'full jitter' backoff, so that clients don't retry in lockstep."""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+    def parse_retry_after(self, retry_after):
+        # Don't let a server hold a request for long
+        return min(super().parse_retry_after(retry_after), MAX_RETRY_AFTER)
+
+
+class _NoCookies(DefaultCookiePolicy):
+    def set_ok(self, cookie, request):
+        return False
+
+
+def _new_session():
+    session = requests.Session()
+    session.cookies.set_policy(_NoCookies())
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=MAX_PER_HOST,
+        max_retries=JitteredRetry(
+            total=RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,  # callers check the status of the last response
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions = {}
+_limits = {}
+_lock = threading.Lock()
+
+
+def get_session(url):
+    """Return the shared session of the host of `url`."""
+    host = urlparse(url).netloc.lower()
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = _new_session()
+        return _sessions[host]
+
+
+@contextmanager
+def host_limit(url):
+    """Bound the number of concurrent requests to the host of `url`."""
+    host = urlparse(url).netloc.lower()
+    with _lock:
+        if host not in _limits:
+            _limits[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        semaphore = _limits[host]
+    with semaphore:
+        yield
+
+
+def request(method, url, **kwargs):
+    """
+    Send a request like requests.request, using the shared session of the host.
+
+    The per host limit covers the request until its headers are received, the
+    body of a streamed response is read outside of it.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    with host_limit(url):
+        return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("allow_redirects", True)
+    return request("GET", url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault("allow_redirects", False)
+    return request("HEAD", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
@@ -1,7 +1,6 @@
 import os
 import pathlib
 import re
-import requests
 
 from urllib.parse import urlparse, unquote
 from girder.utility.model_importer import ModelImporter
@@ -11,6 +10,7 @@ from .import_providers import ImportProvider
 from .entity import Entity
 from .data_map import DataMap
 from .file_map import FileMap
+from . import http_client
 
 
 class HTTPImportProvider(ImportProvider):
@@ -21,14 +21,14 @@ class HTTPImportProvider(ImportProvider):
         return re.compile(r'^http(s)?://.*')
 
     def lookup(self, entity: Entity) -> DataMap:
-        pid = requests.head(entity.getValue(), allow_redirects=True).url
+        pid = http_client.head(entity.getValue(), allow_redirects=True).url
         url = urlparse(pid)
         if url.scheme not in ('http', 'https'):
             # This should be redundant. This should only be called if matches()
             # returns True, which, various errors aside, signifies a commitment
             # to the entity being legitimate from the perspective of this provider
             raise Exception('Unknown scheme %s' % url.scheme)
-        headers = requests.head(
+        headers = http_client.head(
             pid, headers={'Accept-Encoding': 'identity'}).headers
 
         valid_target = 'Content-Length' in headers or 'Content-Range' in headers
@@ -58,13 +58,13 @@ class HTTPImportProvider(ImportProvider):
             return fm
 
     def register(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
-                 base_url: str = None):
+                 base_url: str = None, checkpoint=None):
         uri = dataMap.dataId
         url = urlparse(uri)
         progress.update(increment=1, message='Processing file {}.'.format(uri))
         # Request basic info via HEAD, use 'identity' to avoid grabbing info about
         # zipped content
-        headers = requests.head(
+        headers = http_client.head(
             uri, headers={'Accept-Encoding': 'identity'}).headers
         size = headers.get('Content-Length') or \
             headers.get('Content-Range').split('/')[-1]
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from hashlib import sha256
+import json
+import os
+import threading
+import time
+
+from girder.models.folder import Folder
+from girder.plugins.virtual_resources.rest import VirtualObject
+from girder.utility import JsonEncoder
+from gwvolman.constants import R2D_FILENAMES, REPO2DOCKER_VERSION
+from gwvolman.utils import DOMAIN
+
+from ..constants import ImageStatus
+from ..models.image import Image
+
+
+def _files_state(root, paths):
+    """Path relative to `root`, size and modification time of files in `paths`."""
+    state = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for curdir, dirs, fnames in os.walk(path):
+                dirs.sort()
+                files += [os.path.join(curdir, fname) for fname in sorted(fnames)]
+        else:
+            files = [path]
+        for fpath in files:
+            try:
+                stat = os.stat(fpath)
+            except FileNotFoundError:
+                continue
+            state.append((os.path.relpath(fpath, root), stat.st_size, stat.st_mtime_ns))
+    return state
+
+
+def _workspace_path(tale):
+    """Path to the Tale's workspace, or None if its folder does not exist."""
+    if str(tale["workspaceId"]).startswith("wtlocal:"):
+        path, _ = VirtualObject.path_from_id(tale["workspaceId"])
+        return path.as_posix()
+    workspace = Folder().load(tale["workspaceId"], force=True)
+    if workspace is not None:
+        return workspace["fsPath"]
+
+
+def environment_fingerprint(tale, workspace_path=None):
+    """
+    Computes a digest of the inputs of gwvolman's ImageBuilder.get_tag: the
+    Image and Tale configuration, the repo2docker files in the workspace
+    (see R2D_FILENAMES and the `extra_build_files` of the Tale's config) and
+    the deployment (domain of the registry, default repo2docker version).
+    Files' contents are not read, size and modification time are used instead.
+
+    :param tale: The Tale
+    :param workspace_path: Path to the Tale's workspace, defaults to the one
+        of its workspace folder.
+    :return: A hex digest, random if the workspace does not exist, so that it
+        never matches a recorded one.
+    """
+    if workspace_path is None:
+        workspace_path = _workspace_path(tale)
+        if workspace_path is None:
+            return os.urandom(32).hex()
+    config = tale.get("config") or {}
+    extra_build_files = config.get("extra_build_files", [])
+    if "**" in extra_build_files:
+        paths = [workspace_path]
+    else:
+        paths = [
+            os.path.join(workspace_path, name)
+            for name in list(R2D_FILENAMES) + extra_build_files
+        ]
+    image = Image().load(tale["imageId"], force=True) or {}
+    state = {
+        "imageId": str(tale["imageId"]),
+        "imageConfig": image.get("config"),
+        "config": config,
+        "files": _files_state(workspace_path, paths),
+        "domain": DOMAIN,
+        "repo2docker_version": REPO2DOCKER_VERSION,
+    }
+    return sha256(json.dumps(state, cls=JsonEncoder, sort_keys=True).encode()).hexdigest()
+
+
+class ImageTagResolver:
+    """
+    Resolve the image tag (digest) and repo2docker version describing a Tale's
+    environment without calling back into Girder.
+
+    If the Tale was successfully built from the current environment, i.e. the
+    `environment_fingerprint` recorded in its `imageInfo` when the build was
+    started is still the same, `imageInfo` already holds both. Otherwise
+    results obtained the slow way (see Manifest.create_image_info) are memoized
+    per (environment fingerprint, repo2docker version) for `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._tags = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(tale, fingerprint):
+        return (fingerprint, (tale.get("imageInfo") or {}).get("repo2docker_version"))
+
+    def get(self, tale, fingerprint):
+        """
+        Return a tuple of image digest and repo2docker version, or (None, None)
+        if they cannot be determined without building the image tag.
+
+        :param fingerprint: The current `environment_fingerprint` of the Tale
+        """
+        image_info = tale.get("imageInfo") or {}
+        if all((
+            image_info.get("status") == ImageStatus.AVAILABLE,
+            image_info.get("digest"),
+            image_info.get("repo2docker_version"),
+            image_info.get("fingerprint") == fingerprint,
+        )):
+            return image_info["digest"], image_info["repo2docker_version"]
+
+        key = self._key(tale, fingerprint)
+        with self._lock:
+            try:
+                timestamp, digest, repo2docker_version = self._tags[key]
+            except KeyError:
+                return None, None
+            if time.monotonic() - timestamp > self.ttl:
+                del self._tags[key]
+                return None, None
+            self._tags.move_to_end(key)
+        return digest, repo2docker_version
+
+    def set(self, tale, fingerprint, digest, repo2docker_version):
+        key = self._key(tale, fingerprint)
+        with self._lock:
+            self._tags[key] = (time.monotonic(), digest, repo2docker_version)
+            self._tags.move_to_end(key)
+            while len(self._tags) > self.maxsize:
+                self._tags.popitem(last=False)
+
+
+IMAGE_TAGS = ImageTagResolver()
@@ -1,13 +1,18 @@
+import datetime
+import os
 import textwrap
 
 from girder import logger
 from girder.utility.model_importer import ModelImporter
 
+from .batch_register import REGISTER_CHUNK_SIZE, BatchRegistration
 from .entity import Entity
 from .data_map import DataMap
 from .file_map import FileMap
 from .import_item import ImportItem
 
+REGISTER_CHECK_FRESHNESS = int(os.environ.get("GIRDER_WT_REGISTER_CHECK_FRESHNESS", 1))
+
 
 class ImportProvider:
     _regex = None
@@ -47,6 +52,13 @@ class ImportProvider:
         """Given a registered object, return dataset DOI"""
         raise NotImplementedError()
 
+    def getDatasetUIDScope(self, doc: object):
+        """
+        Given a registered object, return a key shared by all the objects that have
+        the same dataset DOI, or None if the DOI needs to be computed for each object.
+        """
+        return None
+
     def getURI(self, doc: object, user: object) -> str:
         """Given a registered object, return a URI for it"""
         raise NotImplementedError()
@@ -77,15 +89,68 @@ class ImportProvider:
             "category": "science",
         }
 
+    def getVersion(self, dataMap: DataMap, user: object):
+        """
+        Return a cheap to obtain token (e.g. a modification time) that changes
+        whenever the contents of the dataset change, or None if the contents
+        of a dataset with a given identifier never change.
+        """
+        return None
+
+    def getRegistered(self, parent: object, parentType: str, dataMap: DataMap, version):
+        """
+        Return the root folder of a completed registration of the dataset in
+        `parent`, or None if there is none or the dataset changed since.
+
+        :param version: Current version of the dataset (see getVersion), or None
+            if the registration is trusted regardless of it.
+        """
+        if not dataMap.doi:
+            return None
+        root = self.folderModel.findOne({
+            'registration.identifier': dataMap.doi,
+            'parentId': parent['_id'],
+            'parentCollection': parentType,
+            'meta.provider': self.name,
+        })
+        if root is None:
+            return None
+        if version is not None and version != root['registration'].get('version'):
+            logger.info(f"Dataset {dataMap.doi} changed since it was registered.")
+            return None
+        return root
+
+    def setRegistered(self, root: object, dataMap: DataMap, version):
+        """
+        Record that the registration of the dataset in `root` is complete.
+
+        :param version: Version of the dataset taken before it was listed, so
+            that changes made during the listing are noticed by getRegistered.
+        """
+        registration = {
+            'identifier': dataMap.doi,
+            'completed': datetime.datetime.utcnow(),
+            'version': version,
+        }
+        self.folderModel.update(
+            {'_id': root['_id']}, {'$set': {'registration': registration}}, multi=False
+        )
+
     def register(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
-                 base_url: str = None):
-        stack = [(parent, parentType)]
+                 base_url: str = None, checkpoint=None):
         pid = dataMap.dataId
         name = dataMap.name
+        importItems = self._listRecursive(user, pid, name, base_url, progress=progress)
+        if REGISTER_CHUNK_SIZE > 0:
+            return BatchRegistration(self, user, checkpoint=checkpoint).register(
+                parent, parentType, importItems
+            )
+
+        stack = [(parent, parentType)]
         rootObj = None
         rootType = None
 
-        for item in self._listRecursive(user, pid, name, base_url, progress=progress):
+        for item in importItems:
             if item.type == ImportItem.FOLDER:
                 (obj, objType) = self._registerFolder(stack, item, user)
             elif item.type == ImportItem.END_FOLDER:
@@ -1,3 +1,4 @@
+from hashlib import sha256
 import json
 import os
 from urllib.parse import quote
@@ -16,8 +17,12 @@ import cherrypy
 from girder_client import GirderClient
 from gwvolman.r2d import ImageBuilder
 
+from .dataset_resolver import DataSetResolver
+from .image_tag import IMAGE_TAGS, environment_fingerprint
 from .license import WholeTaleLicense
+from .model_cache import ModelCache
 from . import IMPORT_PROVIDERS
+from ..models.manifest_cache import ManifestCache
 
 
 class Manifest:
@@ -29,19 +34,26 @@ class Manifest:
     create<someProperty>
     """
 
-    def __init__(self, tale, user, expand_folders=True, versionId=None):
+    def __init__(
+        self, tale, user, expand_folders=True, versionId=None, cache=False, models=None
+    ):
         """
         Initialize the manifest document with base variables
         :param tale: The Tale whose data is being serialized
         :param user: The user requesting the manifest document
         :param expand_folders: If True, when encountering a folder
             in the external data, return all child items recursively.
+        :param cache: If True, reuse a previously generated manifest with
+            the same fingerprint, and store a newly generated one.
+        :param models: A ModelCache shared with other consumers of the same request,
+            e.g. an exporter. A private one is used if not provided.
         """
         self.tale = tale
         self.user = user
+        self.models = ModelCache() if models is None else models
         if versionId is not None:
-            version = Folder().load(
-                versionId, user=self.user, level=AccessType.READ, exc=True
+            version = self.models.load(
+                Folder(), versionId, user=self.user, level=AccessType.READ, exc=True
             )
             version = Folder().filter(version, user)  # to get _modelType
             try:
@@ -66,6 +78,16 @@ class Manifest:
         self.imageModel = ModelImporter.model("image", "wholetale")
         self.itemModel = ModelImporter.model('item')
         self.userModel = ModelImporter.model('user')
+        self.resolver = DataSetResolver(self.user, IMPORT_PROVIDERS, models=self.models)
+        self._runs = None
+
+        self.etag = None
+        if cache:
+            self.etag = self.fingerprint()
+            cached = ManifestCache().get(self.etag)
+            if cached is not None:
+                self.manifest = cached
+                return
 
         self.manifest.update(self.create_context())
         self.manifest.update(self.create_basic_attributes())
@@ -80,6 +102,11 @@ class Manifest:
         self.add_version_info()
         self.add_run_info()
 
+        if cache:
+            ManifestCache().put(
+                self.etag, self.manifest, self.tale, self.version, self.recorded_runs()
+            )
+
     publishers = {
         "DataONE":
             {
@@ -97,6 +124,78 @@ class Manifest:
             }
     }
 
+    # Tale's properties that determine the content of the manifest
+    _fingerprint_fields = (
+        "_id", "authors", "category", "config", "created", "creatorId", "dataSet",
+        "description", "format", "illustration", "imageId", "imageInfo", "licenseSPDX",
+        "relatedIdentifiers", "runsRootId", "title", "workspaceId",
+    )
+
+    def fingerprint(self):
+        """
+        Computes a digest of everything that goes into the manifest: Tale's
+        properties, the version, recorded runs and the state of files in the
+        workspace and in the runs. Files' contents are not read, size and
+        modification time are used instead.
+
+        The manifest depends on the access of the requesting user, so the user
+        is part of the fingerprint and the access to the dataSet is checked.
+        Registered datasets are identified by the modification time and size
+        of the objects in the dataSet, changes deeper in their hierarchy are
+        only picked up once the cached manifest expires.
+        :return: A hex digest
+        """
+        creator = self.models.load(self.userModel, self.tale["creatorId"], force=True)
+        state = {
+            "user": self.user["_id"],
+            "expand_folders": self.expand_folders,
+            "creator": {
+                key: creator.get(key) for key in ("email", "firstName", "lastName")
+            },
+            "dataSet": [
+                {key: doc.get(key) for key in ("_id", "updated", "size")}
+                for _, doc in self.resolver.load(self.tale["dataSet"])
+            ],
+            "tale": {key: self.tale.get(key) for key in self._fingerprint_fields},
+            "version": {
+                key: self.version.get(key)
+                for key in ("_id", "name", "created", "updated", "creatorId")
+            },
+            "workspace": self._tree_fingerprint(self._workspace_rootpath()),
+            "runs": [
+                {
+                    "_id": run["_id"],
+                    "name": run["name"],
+                    "updated": run["updated"],
+                    "runStatus": run.get("runStatus"),
+                    "workspace": self._tree_fingerprint(
+                        os.path.join(run["fsPath"], "workspace")
+                    ),
+                }
+                for run in self.recorded_runs()
+            ],
+        }
+        return sha256(
+            json.dumps(state, cls=JsonEncoder, sort_keys=True).encode()
+        ).hexdigest()
+
+    @staticmethod
+    def _tree_fingerprint(path):
+        digest = sha256()
+        for curdir, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fullpath = os.path.join(curdir, fname)
+                try:
+                    stat = os.stat(fullpath)
+                except FileNotFoundError:
+                    continue
+                digest.update(
+                    f"{os.path.relpath(fullpath, path)}:{stat.st_size}:{stat.st_mtime_ns}\n"
+                    .encode()
+                )
+        return digest.hexdigest()
+
     def validate(self):
         """
         Checks for the presence of required tale information so
@@ -140,9 +239,7 @@ class Manifest:
         Adds basic information about the Tale author
         """
 
-        tale_user = self.userModel.load(self.tale['creatorId'],
-                                        user=self.user,
-                                        force=True)
+        tale_user = self.models.load(self.userModel, self.tale['creatorId'], force=True)
         self.manifest['createdBy'] = {
             "@id": f"mailto:{tale_user['email']}",
             "@type": "schema:Person",
@@ -170,23 +267,18 @@ class Manifest:
 
     def create_image_info(self):
         # TODO: We shouldn't be publishing a Tale that was never built...
-        token = Token().createToken(user=self.user, days=0.25)
-        girder_client = GirderClient(
-            apiUrl=f"http://localhost:{cherrypy.config['server.socket_port']}/api/v1"
-        )  # getApiUrl doesn't work for local deployment, this should work in any scenario
-        girder_client.token = str(token["_id"])
-        image_builder = ImageBuilder(girder_client, tale=self.tale, auth=False)
-        try:
-            image_digest = image_builder.get_tag()
-        except ValueError:
-            raise  # What should I do in this situation...??
+        fingerprint = environment_fingerprint(self.tale, self._workspace_rootpath())
+        image_digest, repo2docker_version = IMAGE_TAGS.get(self.tale, fingerprint)
+        if image_digest is None:
+            image_digest, repo2docker_version = self._build_image_tag()
+            IMAGE_TAGS.set(self.tale, fingerprint, image_digest, repo2docker_version)
 
         return {
             "schema:hasPart": [
                 {
                     "@id": "https://github.com/whole-tale/repo2docker_wholetale",
                     "@type": "schema:SoftwareApplication",
-                    "schema:softwareVersion": image_builder.container_config.repo2docker_version
+                    "schema:softwareVersion": repo2docker_version
                 },
                 {
                     "@id": image_digest.replace("registry", "images", 1),
@@ -196,6 +288,20 @@ class Manifest:
             ]
         }
 
+    def _build_image_tag(self):
+        """Computes the image tag using gwvolman, which requires a call back to Girder."""
+        token = Token().createToken(user=self.user, days=0.25)
+        girder_client = GirderClient(
+            apiUrl=f"http://localhost:{cherrypy.config['server.socket_port']}/api/v1"
+        )  # getApiUrl doesn't work for local deployment, this should work in any scenario
+        girder_client.token = str(token["_id"])
+        image_builder = ImageBuilder(girder_client, tale=self.tale, auth=False)
+        try:
+            image_digest = image_builder.get_tag()
+        except ValueError:
+            raise  # What should I do in this situation...??
+        return image_digest, image_builder.container_config.repo2docker_version
+
     def create_related_identifiers(self):
         def derive_id_type(identifier):
             if identifier.lower().startswith("doi"):
@@ -241,8 +347,8 @@ class Manifest:
         :return: Dictionary that describes a dataset
         """
         try:
-            folder = Folder().load(
-                folder_id, user=self.user, exc=True, level=AccessType.READ
+            folder = self.models.load(
+                Folder(), folder_id, user=self.user, exc=True, level=AccessType.READ
             )
             provider = folder['meta']['provider']
             if provider in {'HTTP', 'HTTPS'}:
@@ -285,28 +391,47 @@ class Manifest:
         try:
             return f"sha512:{file_obj['sha512']}"
         except KeyError:
-            if checksum := item_obj.get("meta", {}).get("checksum"):
+            checksum = item_obj.get("meta", {}).get("checksum")
+            if isinstance(checksum, dict):
                 for alg in ("md5", "sha512"):
                     if alg in checksum:
                         return f"{alg}:{checksum[alg]}"
 
-    def add_tale_records(self):
-        """
-        Creates and adds file records to the internal manifest object for an entire Tale.
-        """
-
-        # Handle the files in the workspace
+    def _workspace_rootpath(self):
+        """Returns the path to the Tale's workspace with a trailing slash."""
         if str(self.tale["workspaceId"]).startswith("wtlocal:"):
             workspace_rootpath, _ = VirtualObject.path_from_id(self.tale["workspaceId"])
             workspace_rootpath = workspace_rootpath.as_posix()
         else:
-            workspace = Folder().load(
-                self.tale["workspaceId"], user=self.user, level=AccessType.READ, exc=True
+            workspace = self.models.load(
+                Folder(), self.tale["workspaceId"], user=self.user,
+                level=AccessType.READ, exc=True
             )
             workspace_rootpath = workspace["fsPath"]
 
         if not workspace_rootpath.endswith("/"):
             workspace_rootpath += "/"
+        return workspace_rootpath
+
+    def recorded_runs(self):
+        """Returns the recorded runs of the described version."""
+        if self._runs is None:
+            self._runs = [
+                self.models.add(Folder(), run)
+                for run in Folder().find({
+                    'parentId': self.tale['runsRootId'], 'parentCollection': 'folder',
+                    'runVersionId': self.version['_id']
+                })
+            ]
+        return self._runs
+
+    def add_tale_records(self):
+        """
+        Creates and adds file records to the internal manifest object for an entire Tale.
+        """
+
+        # Handle the files in the workspace
+        workspace_rootpath = self._workspace_rootpath()
 
         for curdir, _, files in os.walk(workspace_rootpath):
             for fname in files:
@@ -328,6 +453,7 @@ class Manifest:
             for folder in Folder().findWithPermissions(
                     {'meta.identifier': identifier}, limit=1, user=self.user
             ):
+                self.models.add(Folder(), folder)
                 self.datasets.add(folder['_id'])
 
         # Add records for the remote files that exist under a folder: "aggregates"
@@ -343,8 +469,7 @@ class Manifest:
             self.manifest['aggregates'].append(record)
 
         # Add records for files in each recorded_run
-        for run in Folder().find({'parentId': self.tale['runsRootId'], 'parentCollection': 'folder',
-                                  'runVersionId': self.version['_id']}):
+        for run in self.recorded_runs():
             run_rootpath = run["fsPath"]
             if not run_rootpath.endswith("/"):
                 run_rootpath += "/"
@@ -364,27 +489,16 @@ class Manifest:
 
     def _expand_folder_into_items(self, folder, user, relpath=''):
         """
-        Recursively handle data folder and return all child items as ext objs
+        Handle data folder and return all child items as ext objs
 
+        The whole subtree is fetched in bulk, see DataSetResolver.subtree.
         In a perfect world there should be a better place for this...
         """
-        curpath = os.path.join(relpath, folder['name'])
-        dataSet = []
         ext = []
-        for item in Folder().childItems(folder, user=user):
-            dataSet.append({
-                'itemId': item['_id'],
-                '_modelType': 'item',
-                'mountPath': os.path.join(curpath, item['name'])
-            })
-
-        if dataSet:
-            ext, _ = self._parse_dataSet(dataSet=dataSet, relpath=curpath)
-
-        for subfolder in Folder().childFolders(
-            folder, parentType='folder', user=user
-        ):
-            ext += self._expand_folder_into_items(subfolder, user, relpath=curpath)
+        for curpath, item, fileObj in self.resolver.subtree(folder, relpath=relpath):
+            ext_obj = self._describe_object('item', item, curpath)
+            self._describe_item(ext_obj, item, fileObj)
+            ext.append(ext_obj)
         return ext
 
     def _get_folder_uri(self, doc, provider, top_identifier):
@@ -397,9 +511,32 @@ class Manifest:
         except NotImplementedError:
             pass
 
+    def _describe_object(self, model_type, doc, relpath):
+        """Create the common part of an external object for a registered folder or item."""
+        provider_name, provider = self.resolver.provider(doc)
+        return {
+            'dataset_identifier': self.resolver.dataset_uid(provider, doc),
+            'provider': provider_name,
+            '_modelType': model_type,
+            'relpath': relpath,
+            "wt:identifier": str(doc["_id"]),
+        }
+
+    def _describe_item(self, ext_obj, item, fileObj):
+        """Add the information about a file to an external object of a registered item."""
+        ext_obj.update({
+            'name': fileObj['name'],
+            'uri': fileObj['linkUrl'],
+            'size': fileObj['size']
+        })
+        if checksum := self._get_checksum(item, fileObj):
+            alg, value = checksum.split(":")
+            ext_obj[f"wt:{alg}"] = value
+
     def _parse_dataSet(self, dataSet=None, relpath=''):
         """
-        Get the basic info about the contents of `dataSet`
+        Get the basic info about the contents of `dataSet`. Items without
+        a file are skipped.
 
         Returns:
             external_objects: A list of objects that represent externally defined data
@@ -412,33 +549,34 @@ class Manifest:
 
         dataset_top_identifiers = set()
         external_objects = []
-        for obj in dataSet:
+        try:
+            docs = self.resolver.load(dataSet)
+            files = self.resolver.files(
+                doc for obj, doc in docs if obj['_modelType'] == 'item'
+            )
+        except ValidationException:
+            msg = 'While creating a manifest for Tale "{}" '.format(str(self.tale['_id']))
+            msg += 'encountered a following error:\n'
+            logger.warning(msg)
+            raise  # We don't want broken manifests, do we?
+
+        for obj, doc in docs:
+            if obj['_modelType'] == 'item' and doc['_id'] not in files:
+                continue  # same as DataSetResolver.subtree, there is nothing to describe
             try:
-                doc = ModelImporter.model(obj['_modelType']).load(
-                    obj['itemId'], user=self.user, level=AccessType.READ, exc=True)
-                provider_name = doc['meta']['provider']
-                if provider_name.startswith('HTTP'):
-                    provider_name = 'HTTP'  # TODO: handle HTTPS to make it unnecessary
-                provider = IMPORT_PROVIDERS.providerMap[provider_name]
-                top_identifier = provider.getDatasetUID(doc, self.user)
+                ext_obj = self._describe_object(obj['_modelType'], doc, relpath)
+                top_identifier = ext_obj['dataset_identifier']
                 if top_identifier:
                     dataset_top_identifiers.add(top_identifier)
 
-                ext_obj = {
-                    'dataset_identifier': top_identifier,
-                    'provider': provider_name,
-                    '_modelType': obj['_modelType'],
-                    'relpath': relpath,
-                    "wt:identifier": str(doc["_id"]),
-                }
-
                 if obj['_modelType'] == 'folder':
-                    uri = self._get_folder_uri(doc, provider, top_identifier)
                     # if uri is None and self.expand_folders and not is_root_folder:
                     if self.expand_folders:
                         external_objects += self._expand_folder_into_items(doc, self.user)
                         continue
 
+                    provider = IMPORT_PROVIDERS.providerMap[ext_obj['provider']]
+                    uri = self._get_folder_uri(doc, provider, top_identifier)
                     ext_obj['uri'] = uri or "undefined"
                     ext_obj['name'] = doc['name']
                     ext_obj['size'] = 0
@@ -448,15 +586,7 @@ class Manifest:
                         ext_obj['size'] += f['size']
 
                 elif obj['_modelType'] == 'item':
-                    fileObj = self.itemModel.childFiles(doc)[0]
-                    ext_obj.update({
-                        'name': fileObj['name'],
-                        'uri': fileObj['linkUrl'],
-                        'size': fileObj['size']
-                    })
-                    if checksum := self._get_checksum(doc, fileObj):
-                        alg, value = checksum.split(":")
-                        ext_obj[f"wt:{alg}"] = value
+                    self._describe_item(ext_obj, doc, files[doc['_id']])
                 external_objects.append(ext_obj)
             except (ValidationException, KeyError):
                 msg = 'While creating a manifest for Tale "{}" '.format(str(self.tale['_id']))
@@ -504,7 +634,7 @@ class Manifest:
 
     def add_version_info(self):
         """Adds version metadata."""
-        user = self.userModel.load(self.version["creatorId"], force=True)
+        user = self.models.load(self.userModel, self.version["creatorId"], force=True)
         self.manifest["dct:hasVersion"] = {
             "@id": (
                 "https://data.wholetale.org/api/v1/"
@@ -526,9 +656,8 @@ class Manifest:
     def add_run_info(self):
         """Adds recorded run metadata."""
 
-        for run in Folder().find({'parentId': self.tale['runsRootId'], 'parentCollection': 'folder',
-                                  'runVersionId': self.version['_id']}):
-            creator = User().load(run["creatorId"], force=True)
+        for run in self.recorded_runs():
+            creator = self.models.load(User(), run["creatorId"], force=True)
             run = {
                 "@id": (
                     "https://data.wholetale.org/api/v1/"
@@ -549,6 +678,14 @@ class Manifest:
             }
             self.manifest['wt:hasRecordedRuns'].append(run)
 
+    @property
+    def content_hash(self):
+        """
+        Digest of the manifest itself. Unlike the etag, it does not depend on
+        who requested the manifest, only on what it describes.
+        """
+        return sha256(self.dump_manifest().encode()).hexdigest()
+
     def dump_manifest(self, **kwargs):
         return json.dumps(
             self.manifest,
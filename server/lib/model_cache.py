@@ -0,0 +1,74 @@
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from girder import logger
+from girder.constants import AccessType
+from girder.exceptions import ValidationException
+from girder.models.folder import Folder
+from girder.models.item import Item
+
+
+class ModelCache:
+    """
+    Identity map of User, Folder, Item and File documents for a single request or job.
+
+    Each document is fetched from the database at most once. Access is still
+    checked on every lookup, so the cache can be shared by all the code (e.g.
+    the manifest builder and an exporter) that handles the same request.
+    The number of cache hits and misses is recorded.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model, id):
+        try:
+            return model.name, ObjectId(id)
+        except (InvalidId, TypeError):
+            raise ValidationException('Invalid ObjectId: %s' % id, field='id')
+
+    def add(self, model, doc):
+        """Store a document that was already fetched by other means."""
+        self._docs.setdefault(self._key(model, doc["_id"]), doc)
+        return doc
+
+    def load(self, model, id, user=None, level=AccessType.READ, force=False, exc=False):
+        """
+        Same as `model.load`, but returns a cached document if it is available.
+        As in Girder, None is returned only for a missing document (or a
+        ValidationException is raised if `exc` is set), while insufficient
+        access always raises an AccessException.
+
+        :param model: An instance of User, Folder, Item or File model.
+        """
+        key = self._key(model, id)
+        try:
+            doc = self._docs[key]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            doc = model.load(id, force=True, exc=exc)
+            if doc is None:
+                return None
+            self._docs[key] = doc
+
+        if not force:
+            self._requireAccess(model, doc, user, level)
+        return doc
+
+    def _requireAccess(self, model, doc, user, level):
+        # Items and files inherit the access of their parent, which is likely cached
+        if model.name == 'item':
+            self.load(Folder(), doc['folderId'], user=user, level=level, exc=True)
+        elif model.name == 'file' and not doc.get('attachedToType') and doc.get('itemId'):
+            self.load(Item(), doc['itemId'], user=user, level=level, exc=True)
+        else:
+            model.requireAccess(doc, user=user, level=level)
+
+    def report(self, context):
+        logger.info(
+            "Model cache for %s: %d hits, %d misses", context, self.hits, self.misses
+        )
@@ -2,6 +2,7 @@ import requests
 
 from girder.exceptions import RestException
 from ..verificator import Verificator
+from .. import http_client
 
 
 class OpenICPSRVerificator(Verificator):
@@ -18,7 +19,7 @@ class OpenICPSRVerificator(Verificator):
 
     def verify(self):
         try:
-            r = requests.get(self.login_url, cookies=self.headers)
+            r = http_client.get(self.login_url, cookies=self.headers)
             r.raise_for_status()
             assert r.url == "https://www.openicpsr.org/openicpsr/"
         except (AssertionError, requests.exceptions.HTTPError):
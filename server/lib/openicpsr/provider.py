@@ -3,7 +3,6 @@ import functools
 import os
 import pathlib
 import re
-import requests
 import tempfile
 from typing import Generator
 from urllib.parse import urlparse, urlunparse, parse_qs
@@ -18,6 +17,7 @@ from ..data_map import DataMap
 from ..file_map import FileMap
 from ..import_item import ImportItem
 from ..entity import Entity
+from .. import http_client
 
 
 class OpenICPSRImportProvider(ImportProvider):
@@ -36,7 +36,7 @@ class OpenICPSRImportProvider(ImportProvider):
         return False
 
     def _get_landing_page(self, url):
-        r = requests.get(url)
+        r = http_client.get(url)
         soup = BeautifulSoup(r.text, "html.parser")
         # metadata = json.loads(soup.find("script", {"type": "application/ld+json"}).text.strip())
         doi = (
@@ -132,7 +132,7 @@ class OpenICPSRImportProvider(ImportProvider):
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
         tempDir = adapter.tempDir
 
-        resp = requests.get(
+        resp = http_client.get(
             data_url, cookies={"JSESSIONID": self._get_user_pass(user)}, stream=True
         )
         if resp.headers.get("Content-Encoding") in ("gzip",):
@@ -1,6 +1,8 @@
 import re
 from .entity import Entity
-from typing import Optional
+from . import http_client
+from typing import List, Optional
+
 import requests
 
 """Regex that matches:
@@ -26,26 +28,84 @@ _DOI_RESOLVERS_RE = re.compile(
 
 
 class Resolver:
+    name = None
+
     def __init__(self):
         pass
 
     def resolve(self, entity: Entity) -> Entity:
         raise NotImplementedError()
 
+    def cacheKey(self, entity: Entity) -> Optional[str]:
+        """
+        Return the key under which the resolution of the entity may be cached,
+        or None if this resolver does not handle it or should not be cached.
+        """
+        return None
+
 
 class Resolvers:
-    def __init__(self):
+    """
+    Chain of resolvers.
+
+    :param cache: Optional callable returning an object with get/put/putFailure
+        (e.g. the ResolutionCache model), consulted before resolvers go to the
+        network.
+    """
+
+    def __init__(self, cache=None):
         self.resolvers = []
+        self.cache = cache
 
     def add(self, resolver: Resolver):
         self.resolvers.append(resolver)
 
+    def cacheKeys(self, entity: Entity) -> List[str]:
+        """Return the cache keys of the entity for all the resolvers that handle it."""
+        keys = (resolver.cacheKey(entity) for resolver in self.resolvers)
+        return [key for key in keys if key is not None]
+
+    def _resolve(self, resolver: Resolver, entity: Entity) -> Optional[Entity]:
+        key = resolver.cacheKey(entity) if self.cache is not None else None
+        if key is None:
+            return resolver.resolve(entity)
+
+        cache = self.cache()
+        cached = cache.get(key)
+        if cached is not None:
+            if 'error' in cached:
+                raise ResolutionException(cached['error'])
+            entity.setValue(cached['value'])
+            for field, value in cached['fields'].items():
+                entity[field] = value
+            return entity
+
+        before = dict(entity.dict)
+        try:
+            result = resolver.resolve(entity)
+        except ResolutionException as exc:
+            cache.putFailure(key, resolver.name, str(exc))
+            raise
+        except requests.HTTPError as exc:
+            # Only a missing resource is permanent, rate limiting and server
+            # errors are transient
+            if exc.response is not None and exc.response.status_code == 404:
+                cache.putFailure(key, resolver.name, str(exc))
+            raise
+        if result is not None:
+            fields = {
+                field: value for field, value in result.dict.items()
+                if field not in before or before[field] != value
+            }
+            cache.put(key, resolver.name, result.getValue(), fields)
+        return result
+
     def resolve(self, entity: Entity) -> Optional[Entity]:
         while True:
             # try all resolvers; if any matches, repeat; if none matches, return last
             no_match = True
             for resolver in self.resolvers:
-                result = resolver.resolve(entity)
+                result = self._resolve(resolver, entity)
                 if result is not None:
                     entity = result
                     no_match = False
@@ -64,6 +124,7 @@ class ResolutionException(Exception):
 
 
 class DOIResolver(Resolver):
+    name = 'doi'
 
     @staticmethod
     def extractDOI(url: str):
@@ -71,6 +132,11 @@ class DOIResolver(Resolver):
         if doi_match:
             return doi_match.groups()[-1]
 
+    def cacheKey(self, entity: Entity) -> Optional[str]:
+        doi = DOIResolver.extractDOI(entity.getValue())
+        if doi is not None:
+            return 'doi:%s' % doi
+
     def resolve(self, entity: Entity) -> Optional[Entity]:
         value = entity.getValue()
         doi = DOIResolver.extractDOI(value)
@@ -84,19 +150,30 @@ class DOIResolver(Resolver):
         # Expect a redirect. Basically, don't do anything fancy because I don't know
         # if I can correctly resolve a DOI using the structured record
         url = 'https://doi.org/%s' % doi
-        resolved_url = requests.head(url, allow_redirects=True).url
-        if url == resolved_url:
+        response = http_client.head(url, allow_redirects=True)
+        if url == response.url:
+            if response.status_code >= 400 and response.status_code != 404:
+                # doi.org failed (e.g. 429 or 5xx), which says nothing about the DOI
+                response.raise_for_status()
             raise ResolutionException('Could not resolve DOI %s' % (doi,))
 
-        entity.setValue(resolved_url)
+        entity.setValue(response.url)
         entity['DOI'] = doi
 
 
 class MinidResolver(Resolver):
+    name = 'minid'
+    prefix = "https://identifiers.fair-research.org/"
+
+    def cacheKey(self, entity: Entity) -> Optional[str]:
+        value = entity.getValue()
+        if value.startswith(self.prefix):
+            return 'minid:%s' % value
+
     def resolve(self, entity: Entity) -> Optional[Entity]:
         value = entity.getValue()
-        if value.startswith("https://identifiers.fair-research.org/"):
-            response = requests.get(value, headers={"Accept": "application/json"})
+        if value.startswith(self.prefix):
+            response = http_client.get(value, headers={"Accept": "application/json"})
             response.raise_for_status()
             data = response.json()
             entity.setValue(data["location"][0])
@@ -1,6 +1,7 @@
 import requests
 from girder.exceptions import RestException
 from ..verificator import Verificator
+from .. import http_client
 
 
 class ZenodoVerificator(Verificator):
@@ -15,9 +16,9 @@ class ZenodoVerificator(Verificator):
         headers["Content-Type"] = "application/json"
         deposition_url = f"https://{self.resource_server}/api/deposit/depositions"
         try:
-            r = requests.post(deposition_url, data="{}", headers=headers)
+            r = http_client.post(deposition_url, data="{}", headers=headers)
             r.raise_for_status()
-            r = requests.delete(
+            r = http_client.delete(
                 deposition_url + f"/{r.json()['id']}", headers=headers
             )
             r.raise_for_status()
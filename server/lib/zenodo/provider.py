@@ -1,7 +1,6 @@
 import os
 import pathlib
 import re
-import requests
 from urllib.parse import urlparse, urlunparse
 from urllib.request import urlopen
 
@@ -17,6 +16,7 @@ from ..entity import Entity
 from ... import constants
 from ...models.tale import Tale
 from . import ZenodoNotATaleError
+from .. import http_client
 
 
 class ZenodoImportProvider(ImportProvider):
@@ -40,6 +40,10 @@ class ZenodoImportProvider(ImportProvider):
     def get_extra_hosts_setting():
         return Setting().get(constants.PluginSettings.ZENODO_EXTRA_HOSTS)
 
+    def getDatasetUIDScope(self, doc: object):
+        if "identifier" not in (doc.get("meta") or {}):
+            return doc.get("folderId")
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         try:
             identifier = doc["meta"]["identifier"]  # if root of ds, it should have it
@@ -55,7 +59,7 @@ class ZenodoImportProvider(ImportProvider):
     def _get_record(self, raw_url):
         url = urlparse(raw_url)
         record_id = url.path.rsplit("/", maxsplit=1)[1]
-        req = requests.get(
+        req = http_client.get(
             urlunparse(url._replace(path="/api/records/" + record_id)),
             headers={
                 "accept": "application/vnd.zenodo.v1+json",
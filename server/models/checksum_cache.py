@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from .ttl_cache import TTLCache
+
+CHECKSUM_CACHE_TTL_SECONDS = int(
+    os.environ.get("GIRDER_WT_CHECKSUM_CACHE_TTL", 30 * 86400)
+)
+# Files modified more recently than that may still change without affecting
+# their mtime (see "racy git"), so they are not cached.
+_RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+class ChecksumCache(TTLCache):
+    """
+    Checksums and mimetypes of files on a local filesystem, keyed by
+    (device, inode, size, mtime_ns) of the file.
+
+    Entries are replaced whenever the file changes and expire after
+    CHECKSUM_CACHE_TTL_SECONDS.
+    """
+
+    ttl = CHECKSUM_CACHE_TTL_SECONDS
+
+    def initialize(self):
+        self.name = 'checksum_cache'
+        super().initialize()
+
+    @staticmethod
+    def _id(stat):
+        return f"{stat.st_dev}:{stat.st_ino}"
+
+    def get(self, stat, algs):
+        """
+        Return cached information about a file.
+
+        :param stat: Result of os.stat() of the file.
+        :param algs: Names of the checksums that are required.
+        :returns: A dict with the checksums and 'mimeType', or None if the file
+            is not in the cache or its entry is stale or incomplete.
+        """
+        doc = self.findUnexpired({
+            '_id': self._id(stat), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns
+        })
+        if doc is not None and all(alg in doc['checksums'] for alg in algs):
+            return dict(doc['checksums'], mimeType=doc['mimeType'])
+
+    def put(self, stat, checksums, mimeType):
+        """
+        Store checksums and the mimetype of a file.
+
+        :param stat: Result of os.stat() of the file taken before it was read.
+        :param checksums: A dict of alg -> hex digest.
+        :param mimeType: The mimetype of the file.
+        """
+        if time.time_ns() - stat.st_mtime_ns < _RACY_WINDOW_NS:
+            return
+        self.saveExpiring({
+            '_id': self._id(stat),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'checksums': checksums,
+            'mimeType': mimeType,
+        })
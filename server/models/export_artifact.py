@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from girder.constants import AccessType
+from girder.models.file import File
+from girder.models.model_base import Model
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+
+from ..constants import ExportArtifactStatus
+
+
+class ExportArtifact(Model):
+    """
+    Exported zip of a Tale version stored in the assetstore.
+
+    Artifacts are keyed by the version, the export format and the digest of
+    the manifest (see Manifest.content_hash). An artifact is served to anyone
+    who can read the version and whose manifest is the same, i.e. who would
+    get the same export, e.g. given the same access to the external data.
+    """
+
+    def initialize(self):
+        self.name = 'export_artifact'
+        self.ensureIndices([
+            ([('versionId', 1), ('format', 1), ('manifestHash', 1)], {}),
+            'taleId',
+        ])
+        self.exposeFields(level=AccessType.READ, fields={
+            '_id', 'taleId', 'versionId', 'format', 'manifestHash', 'status',
+            'jobId', 'size', 'created', 'updated',
+        })
+
+    def validate(self, doc):
+        return doc
+
+    def findArtifact(self, version, taleFormat, manifestHash):
+        """
+        Return the artifact of a given version, format and manifest digest that
+        is either ready or still being built, or None.
+        """
+        for artifact in self.find({
+            'versionId': version['_id'],
+            'format': taleFormat,
+            'manifestHash': manifestHash,
+            'status': {'$ne': ExportArtifactStatus.ERROR},
+        }):
+            if artifact['status'] == ExportArtifactStatus.READY:
+                return artifact
+            job = Job().load(artifact['jobId'], force=True) if artifact.get('jobId') else None
+            if job is not None and job['status'] not in (
+                JobStatus.ERROR, JobStatus.CANCELED, JobStatus.SUCCESS
+            ):
+                return artifact
+
+    def createArtifact(self, tale, version, taleFormat, manifestHash, user):
+        now = datetime.datetime.utcnow()
+        return self.save({
+            'taleId': tale['_id'],
+            'versionId': version['_id'],
+            'format': taleFormat,
+            'creatorId': user['_id'],
+            'manifestHash': manifestHash,
+            'status': ExportArtifactStatus.BUILDING,
+            'jobId': None,
+            'fileId': None,
+            'size': 0,
+            'created': now,
+            'updated': now,
+        })
+
+    def setJob(self, artifact, job):
+        artifact['jobId'] = job['_id']
+        return self.save(artifact)
+
+    def setReady(self, artifact, file, manifestHash):
+        """
+        Mark the artifact as ready and remove older artifacts of the same
+        version and format.
+        """
+        artifact.update({
+            'status': ExportArtifactStatus.READY,
+            'fileId': file['_id'],
+            'size': file['size'],
+            'manifestHash': manifestHash,
+            'updated': datetime.datetime.utcnow(),
+        })
+        artifact = self.save(artifact)
+        for old in self.find({
+            '_id': {'$ne': artifact['_id']},
+            'versionId': artifact['versionId'],
+            'format': artifact['format'],
+            'status': {'$ne': ExportArtifactStatus.BUILDING},
+        }):
+            self.remove(old)
+        return artifact
+
+    def setError(self, artifact):
+        artifact['status'] = ExportArtifactStatus.ERROR
+        artifact['updated'] = datetime.datetime.utcnow()
+        return self.save(artifact)
+
+    def remove(self, artifact, **kwargs):
+        if artifact.get('fileId'):
+            file = File().load(artifact['fileId'], force=True)
+            if file is not None:
+                File().remove(file)
+        return super(ExportArtifact, self).remove(artifact, **kwargs)
+
+    def removeTaleArtifacts(self, event):
+        """Remove artifacts of a removed Tale."""
+        for artifact in self.find({'taleId': event.info['_id']}):
+            self.remove(artifact)
+
+    def removeVersionArtifacts(self, event):
+        """Remove artifacts of a removed version."""
+        for artifact in self.find({'versionId': event.info['_id']}):
+            self.remove(artifact)
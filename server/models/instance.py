@@ -35,6 +35,7 @@ from gwvolman.tasks import (
 )
 
 from ..constants import InstanceStatus, PluginSettings
+from ..lib.image_tag import environment_fingerprint
 from ..lib.metrics import metricsLogger
 from ..schema.misc import containerInfoSchema
 from ..utils import init_progress, notify_event
@@ -233,6 +234,7 @@ class Instance(AccessControlledModel):
                 girder_job_other_fields={
                     'wt_notification_id': str(notification['_id']),
                     'instance_id': str(instance['_id']),
+                    'wt_env_fingerprint': environment_fingerprint(tale),
                 },
                 girder_client_token=str(token['_id']),
                 girder_user=user,
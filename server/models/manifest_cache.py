@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from girder.utility import JsonEncoder
+
+from .ttl_cache import TTLCache
+
+MANIFEST_CACHE_TTL_SECONDS = int(os.environ.get("GIRDER_WT_MANIFEST_CACHE_TTL", 86400))
+# Mongo documents are limited to 16MB, leave some room for other fields
+_MAX_MANIFEST_SIZE = 15 * 1024 ** 2
+
+
+class ManifestCache(TTLCache):
+    """
+    Generated manifests keyed by their fingerprint (see Manifest.fingerprint).
+
+    Since the fingerprint changes whenever anything described by the manifest
+    changes, cached entries are never stale. Entries are nevertheless removed
+    when the Tale, its version or runs are modified, and expire after
+    MANIFEST_CACHE_TTL_SECONDS.
+    """
+
+    ttl = MANIFEST_CACHE_TTL_SECONDS
+
+    def initialize(self):
+        self.name = 'manifest_cache'
+        super().initialize()
+        self.ensureIndices(['taleId', 'versionId', 'runIds'])
+
+    def get(self, etag):
+        """
+        Return a cached manifest for a given fingerprint.
+
+        :param etag: The fingerprint of a manifest.
+        :returns: The manifest or None if it is not present in the cache.
+        """
+        doc = self.findUnexpired({'_id': etag}, fields=['manifest'])
+        if doc is not None:
+            return json.loads(doc['manifest'])
+
+    def put(self, etag, manifest, tale, version, runs):
+        """
+        Store a manifest in the cache.
+
+        :param etag: The fingerprint of a manifest.
+        :param manifest: The manifest.
+        :param tale: The Tale described by the manifest.
+        :param version: The version described by the manifest, or the Tale itself.
+        :param runs: List of recorded runs included in the manifest.
+        """
+        payload = json.dumps(manifest, cls=JsonEncoder, sort_keys=True, allow_nan=False)
+        if len(payload) > _MAX_MANIFEST_SIZE:
+            return
+        self.saveExpiring({
+            '_id': etag,
+            'taleId': tale['_id'],
+            'versionId': version['_id'] if version['_id'] != tale['_id'] else None,
+            'runIds': [run['_id'] for run in runs],
+            'manifest': payload,
+        })
+
+    def invalidateTale(self, event):
+        """
+        Remove manifests of a Tale that was modified or removed.
+
+        Manifests of versions are kept when the Tale is modified, since they
+        describe immutable snapshots.
+        """
+        tale = event.info
+        if '_id' not in tale:
+            return
+        query = {'taleId': tale['_id']}
+        if not event.name.endswith('.remove'):
+            query['versionId'] = None
+        self.removeWithQuery(query)
+
+    def invalidateFolder(self, event):
+        """Remove manifests that describe a removed version or a recorded run."""
+        folder = event.info
+        self.removeWithQuery({'$or': [{'versionId': folder['_id']}, {'runIds': folder['_id']}]})
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha256
+import os
+
+from .ttl_cache import TTLCache
+
+REMOTE_CHECKSUM_CACHE_TTL_SECONDS = int(
+    os.environ.get("GIRDER_WT_REMOTE_CHECKSUM_CACHE_TTL", 30 * 86400)
+)
+
+
+class RemoteChecksumCache(TTLCache):
+    """
+    Checksums of remote files keyed by a hash of their URL (URLs can exceed
+    the size limit of index keys) and validated with the ETag and/or
+    Last-Modified headers returned by the server.
+
+    Entries expire after REMOTE_CHECKSUM_CACHE_TTL_SECONDS.
+    """
+
+    ttl = REMOTE_CHECKSUM_CACHE_TTL_SECONDS
+
+    def initialize(self):
+        self.name = 'remote_checksum_cache'
+        super().initialize()
+
+    @staticmethod
+    def _key(url):
+        return sha256(url.encode()).hexdigest()
+
+    @staticmethod
+    def validators(headers):
+        """Return (ETag, Last-Modified) from response headers, or None if neither is set."""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag or last_modified:
+            return etag, last_modified
+
+    def get(self, url, validators):
+        """
+        Return cached checksums of a remote file.
+
+        :param url: The URL of the file.
+        :param validators: A tuple returned by `validators`.
+        :returns: A dict of alg -> hex digest or None.
+        """
+        if validators is None:
+            return None
+        doc = self.findUnexpired({
+            '_id': self._key(url), 'etag': validators[0], 'lastModified': validators[1]
+        })
+        if doc is not None:
+            return doc['checksums']
+
+    def put(self, url, validators, checksums):
+        """
+        Store checksums of a remote file, unless it cannot be validated later.
+
+        :param url: The URL of the file.
+        :param validators: A tuple returned by `validators`.
+        :param checksums: A dict of alg -> hex digest.
+        """
+        if validators is None:
+            return
+        self.saveExpiring({
+            '_id': self._key(url),
+            'url': url,
+            'etag': validators[0],
+            'lastModified': validators[1],
+            'checksums': checksums,
+        })
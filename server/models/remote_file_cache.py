@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .ttl_cache import TTLCache
+
+REMOTE_FILE_CACHE_TTL_SECONDS = int(
+    os.environ.get("GIRDER_WT_REMOTE_FILE_CACHE_TTL", 30 * 86400)
+)
+
+
+class RemoteFileCache(TTLCache):
+    """
+    Attributes (size, name, checksum) of files in external repositories that
+    had to be probed over HTTP, keyed by the repository host, the id of the
+    file and the requested format.
+
+    Entries expire after REMOTE_FILE_CACHE_TTL_SECONDS.
+    """
+
+    ttl = REMOTE_FILE_CACHE_TTL_SECONDS
+
+    def initialize(self):
+        self.name = 'remote_file_cache'
+        super().initialize()
+
+    def get(self, key):
+        """Return the cached attributes of a file as a dict or None."""
+        doc = self.findUnexpired({'_id': key})
+        if doc is not None:
+            return doc['attrs']
+
+    def put(self, key, attrs):
+        self.saveExpiring({'_id': key, 'attrs': attrs})
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from .ttl_cache import TTLCache
+
+RESOLUTION_CACHE_TTL_SECONDS = int(
+    os.environ.get("GIRDER_WT_RESOLUTION_CACHE_TTL", 7 * 86400)
+)
+RESOLUTION_CACHE_NEGATIVE_TTL_SECONDS = int(
+    os.environ.get("GIRDER_WT_RESOLUTION_CACHE_NEGATIVE_TTL", 900)
+)
+
+
+class ResolutionCache(TTLCache):
+    """
+    Results of resolving external identifiers (e.g. DOI -> URL), keyed by
+    the identifier as returned by Resolver.cacheKey.
+
+    Successful resolutions expire after RESOLUTION_CACHE_TTL_SECONDS,
+    failures after RESOLUTION_CACHE_NEGATIVE_TTL_SECONDS.
+    """
+
+    ttl = RESOLUTION_CACHE_TTL_SECONDS
+
+    def initialize(self):
+        self.name = 'resolution_cache'
+        super().initialize()
+        self.ensureIndex('resolver')
+
+    def get(self, key):
+        """
+        Return the cached resolution of `key` or None. Failures have an 'error'
+        field, successes 'value' (the resolved value) and 'fields' (entity fields
+        set by the resolver).
+        """
+        return self.findUnexpired({'_id': key})
+
+    def put(self, key, resolver, value, fields):
+        return self.saveExpiring({
+            '_id': key,
+            'resolver': resolver,
+            'value': value,
+            'fields': fields,
+        })
+
+    def putFailure(self, key, resolver, error):
+        return self.saveExpiring(
+            {'_id': key, 'resolver': resolver, 'error': error},
+            ttl=RESOLUTION_CACHE_NEGATIVE_TTL_SECONDS,
+        )
+
+    def purge(self, key=None, resolver=None, failuresOnly=False):
+        """Remove cached resolutions, all of them by default. Returns their number."""
+        query = {}
+        if key is not None:
+            query['_id'] = key
+        if resolver is not None:
+            query['resolver'] = resolver
+        if failuresOnly:
+            query['error'] = {'$exists': True}
+        return self.collection.delete_many(query).deleted_count
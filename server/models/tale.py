@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import itertools
 import json
+import os
+import shutil
+import tarfile
 import tempfile
 import zipfile
 
@@ -24,6 +28,13 @@ from gwvolman.constants import BUILD_TALE_IMAGE_STEP_TOTAL
 from gwvolman.tasks import build_tale_image
 
 from ..constants import TaleStatus
+from ..lib.exporters.tarstream import (
+    GZIP_MAGIC,
+    ZSTD_MAGIC,
+    IterStream,
+    extract_tar_stream,
+)
+from ..lib.image_tag import environment_fingerprint
 from ..lib.license import WholeTaleLicense
 from ..lib.manifest_parser import ManifestParser
 from ..lib.metrics import metricsLogger
@@ -35,6 +46,8 @@ from .image import Image as imageModel
 # removed) increase `_currentTaleFormat` to retroactively apply those
 # changes to existing Tales.
 _currentTaleFormat = 9
+# Size of chunks requested from streams of imported Tales
+STREAM_CHUNK_SIZE = 64 * 1024 ** 2
 
 
 class Tale(AccessControlledModel):
@@ -390,6 +403,7 @@ class Tale(AccessControlledModel):
             args=[str(tale['_id']), force],
             girder_job_other_fields={
                 'wt_notification_id': str(notification['_id']),
+                'wt_env_fingerprint': environment_fingerprint(tale),
             },
             girder_client_token=str(token['_id']),
         ).apply_async()
@@ -398,12 +412,25 @@ class Tale(AccessControlledModel):
 
     @staticmethod
     def _extractZipPayload(stream):
+        """
+        Extract an exported Tale, either a zipfile or a compressed tarball.
+
+        Zipfiles are spooled to a temporary file first, since their directory
+        is at the end. Tarballs are extracted as they are read.
+        """
         assetstore = Assetstore().getCurrent()
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
         tempDir = adapter.tempDir
 
+        chunks = stream(STREAM_CHUNK_SIZE)
+        head = next(chunks, b"")
+        for magic, codec in ((ZSTD_MAGIC, "zst"), (GZIP_MAGIC, "gz")):
+            if head.startswith(magic):
+                return Tale._extractTarPayload(itertools.chain([head], chunks), codec, tempDir)
+
         with tempfile.NamedTemporaryFile(dir=tempDir) as fp:
-            for chunk in stream(2 * 1024 ** 3):
+            fp.write(head)
+            for chunk in chunks:
                 fp.write(chunk)
             fp.seek(0)
             if not zipfile.is_zipfile(fp):
@@ -444,6 +471,41 @@ class Tale(AccessControlledModel):
                 z.extractall(path=temp_dir)
         return temp_dir, manifest_file, mp.manifest, environment
 
+    @staticmethod
+    def _extractTarPayload(chunks, codec, tempDir):
+        temp_dir = tempfile.mkdtemp(dir=tempDir)
+        try:
+            try:
+                names = extract_tar_stream(IterStream(chunks), temp_dir, codec)
+            except (tarfile.TarError, ValueError, OSError) as e:
+                raise GirderException("Provided file is not a valid tarball: {}".format(str(e)))
+
+            manifest_file = next((_ for _ in names if _.endswith("manifest.json")), None)
+            if not manifest_file:
+                raise GirderException("Provided file doesn't contain a Tale manifest")
+
+            try:
+                with open(os.path.join(temp_dir, manifest_file), "r") as fp:
+                    mp = ManifestParser(json.load(fp))
+                assert mp.is_valid()
+            except Exception as e:
+                raise GirderException(
+                    "Couldn't read manifest.json or not a Tale: {}".format(str(e))
+                )
+
+            env_file = next((_ for _ in names if _.endswith("environment.json")), None)
+            try:
+                with open(os.path.join(temp_dir, env_file), "r") as fp:
+                    environment = json.load(fp)
+            except Exception as e:
+                raise GirderException(
+                    "Couldn't read environment.json or not a Tale: {}".format(str(e))
+                )
+        except GirderException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        return temp_dir, manifest_file, mp.manifest, environment
+
     def createTaleFromStream(
         self, stream, user=None, publishInfo=None, relatedIdentifiers=None
     ):
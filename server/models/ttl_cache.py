@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from girder.models.model_base import Model
+
+
+class TTLCache(Model):
+    """
+    Base of the cache models. Every document has an 'expires' date, after
+    which it is removed by the TTL index on that field.
+
+    Subclasses set the name of their collection and call this initialize, and
+    set `ttl` to the default lifetime of their documents in seconds.
+    """
+
+    ttl = None
+
+    def initialize(self):
+        self.ensureIndices([('expires', {'expireAfterSeconds': 0})])
+
+    def validate(self, doc):
+        return doc
+
+    def findUnexpired(self, query, **kwargs):
+        """findOne restricted to documents that have not expired yet."""
+        # The TTL monitor only runs once a minute
+        query = dict(query, expires={'$gt': datetime.datetime.utcnow()})
+        return self.findOne(query, **kwargs)
+
+    def saveExpiring(self, doc, ttl=None):
+        """Save `doc`, expiring `ttl` (by default `self.ttl`) seconds from now."""
+        now = datetime.datetime.utcnow()
+        doc['created'] = now
+        doc['expires'] = now + datetime.timedelta(seconds=self.ttl if ttl is None else ttl)
+        return self.save(doc)
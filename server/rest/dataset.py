@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import datetime
 import os
 import tempfile
 
@@ -12,7 +13,9 @@ from girder.api.rest import Resource, filtermodel, iterBody
 from girder.constants import AccessType, SortDir, TokenScope
 from girder.exceptions import ValidationException, RestException
 from girder.models.item import Item
+from girder.models.notification import Notification, ProgressState
 from girder.models.user import User
+from girder.plugins.jobs.constants import JobStatus
 from girder.plugins.jobs.models.job import Job
 
 from ..constants import CATALOG_NAME
@@ -20,7 +23,9 @@ from ..lib import IMPORT_PROVIDERS
 from ..lib.data_map import DataMap
 from ..lib.dataone import DataONELocations
 from ..schema.misc import dataMapListSchema
-from ..utils import getOrCreateRootFolder, init_progress
+from ..utils import getOrCreateRootFolder, init_progress, NOTIFICATION_EXP_HOURS
+
+REGISTER_RESUME_AFTER = int(os.environ.get("GIRDER_WT_REGISTER_RESUME_AFTER", 600))
 
 
 datasetModel = {
@@ -103,6 +108,7 @@ class Dataset(Resource):
         self.route('GET', (':id',), self.getDataset)
         self.route('DELETE', (':id',), self.deleteUserDataset)
         self.route('POST', ('register',), self.importData)
+        self.route('POST', ('register', ':id', 'resume'), self.resumeImportData)
         self.route('POST', ('importBag',), self.importBDBag)
 
     @access.public
@@ -257,6 +263,56 @@ class Dataset(Resource):
         Job().scheduleJob(job)
         return job
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @filtermodel(model=Job)
+    @autoDescribeRoute(
+        Description('Resume an interrupted data registration.')
+        .notes('The registration continues after the last checkpoint saved in the job. '
+               'Jobs that failed, or whose worker has not reported for '
+               'GIRDER_WT_REGISTER_RESUME_AFTER seconds (e.g. after a restart), '
+               'can be resumed.')
+        .modelParam('id', 'The ID of the registration job.', model=Job,
+                    level=AccessType.WRITE, includeLog=False)
+        .errorResponse('The job is not an interrupted registration.', 400)
+        .errorResponse('The job was resumed or reported progress meanwhile.', 409)
+        .errorResponse('Write access was denied for the job.', 403)
+    )
+    def resumeImportData(self, job):
+        if job['type'] != 'wholetale.register_data':
+            raise RestException('Not a data registration job.')
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=REGISTER_RESUME_AFTER)
+        interrupted = job['status'] == JobStatus.ERROR or (
+            job['status'] == JobStatus.RUNNING and job['updated'] < stale
+        )
+        if not interrupted:
+            raise RestException('Only failed or stalled registrations can be resumed.')
+
+        # Job status transitions don't allow to go back to running. Running jobs
+        # touch 'updated' periodically (see JobCheckpoint.heartbeat), so the
+        # update only applies if the job is still in the state checked above.
+        result = Job().update(
+            {'_id': job['_id'], 'status': job['status'], 'updated': job['updated']},
+            {'$set': {'status': JobStatus.INACTIVE}},
+            multi=False,
+        )
+        if not result.modified_count:
+            raise RestException('The registration was resumed or made progress meanwhile.', 409)
+        job['status'] = JobStatus.INACTIVE
+        # The status is not changed by updateJob, so the notification of the
+        # job has to be taken out of its error state here
+        notification = None
+        if 'wt_notification_id' in job:
+            notification = Notification().load(job['wt_notification_id'])
+        if notification is not None:
+            Notification().updateProgress(
+                notification, state=ProgressState.QUEUED, message='Resuming registration',
+                expires=datetime.datetime.utcnow() + datetime.timedelta(
+                    hours=NOTIFICATION_EXP_HOURS
+                ),
+            )
+        Job().scheduleJob(job)
+        return Job().load(job['_id'], force=True, includeLog=False)
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
         Description('Imports a BDBag.')
@@ -12,7 +12,7 @@ from ..constants import PluginSettings
 from ..lib.dataone import DataONELocations
 from ..lib.data_map import dataMapDoc
 from ..lib.file_map import fileMapDoc
-from ..lib import pids_to_entities
+from ..lib import PidError, pids_to_entities
 
 
 addModel('dataMap', dataMapDoc)
@@ -51,16 +51,27 @@ class Repository(Resource):
             dataType='string',
             default=DataONELocations.prod_cn,
         )
+        .param(
+            'partial',
+            'If true, identifiers that could not be processed are returned as '
+            '{"dataId": ..., "error": ...} objects after the results, instead of failing '
+            'the whole request.',
+            required=False,
+            dataType='boolean',
+            default=False,
+        )
         .responseClass('dataMap', array=True)
     )
-    def lookupData(self, dataId, base_url):
+    def lookupData(self, dataId, base_url, partial):
         try:
             results = pids_to_entities(
-                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=True
+                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=True,
+                partial=partial
             )
         except RuntimeError as exc:
             raise RestException(exc.args[0])
-        return sorted([x.toDict() for x in results], key=lambda k: k['name'])
+        results, errors = self._split_errors(results)
+        return sorted(results, key=lambda k: k['name']) + errors
 
     @access.public
     @autoDescribeRoute(
@@ -85,16 +96,33 @@ class Repository(Resource):
             dataType='string',
             default=DataONELocations.prod_cn,
         )
+        .param(
+            'partial',
+            'If true, identifiers that could not be processed are returned as '
+            '{"dataId": ..., "error": ...} objects after the results, instead of failing '
+            'the whole request.',
+            required=False,
+            dataType='boolean',
+            default=False,
+        )
         .responseClass('fileMap', array=True)
     )
-    def listFiles(self, dataId, base_url):
+    def listFiles(self, dataId, base_url, partial):
         try:
             results = pids_to_entities(
-                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=False
+                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=False,
+                partial=partial
             )
         except RuntimeError as exc:
             raise RestException(exc.args[0])
-        return sorted([x.toDict() for x in results], key=lambda k: list(k))
+        results, errors = self._split_errors(results)
+        return sorted(results, key=lambda k: list(k)) + errors
+
+    @staticmethod
+    def _split_errors(results):
+        errors = [x.toDict() for x in results if isinstance(x, PidError)]
+        results = [x.toDict() for x in results if not isinstance(x, PidError)]
+        return results, errors
 
     @access.public
     @autoDescribeRoute(
@@ -15,6 +15,7 @@ from girder.api.rest import Resource, filtermodel, RestException,\
 
 from girder.constants import AccessType, SortDir, TokenScope
 from girder.models.assetstore import Assetstore
+from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.models.user import User
@@ -30,9 +31,12 @@ from ..schema.tale import taleModel as taleSchema
 from ..models.tale import Tale as taleModel
 from ..models.image import Image as imageModel
 from ..models.instance import Instance
+from ..models.export_artifact import ExportArtifact
 from ..lib import pids_to_entities, IMPORT_PROVIDERS
 from ..lib.dataone import DataONELocations  # TODO: get rid of it
 from ..lib.manifest import Manifest
+from ..lib.model_cache import ModelCache
+from ..lib.exporters import ARCHIVE_FORMATS
 from ..lib.exporters.bag import BagTaleExporter
 from ..lib.exporters.native import NativeTaleExporter
 from ..utils import notify_event, init_progress
@@ -40,7 +44,7 @@ from ..utils import notify_event, init_progress
 from girder.plugins.worker import getCeleryApp
 
 from ..constants import ImageStatus, TaleStatus, PluginSettings, \
-    DEFAULT_IMAGE_ICON, DEFAULT_ILLUSTRATION
+    DEFAULT_IMAGE_ICON, DEFAULT_ILLUSTRATION, ExportArtifactStatus
 
 
 addModel('tale', taleSchema, resources='tale')
@@ -64,6 +68,7 @@ class Tale(Resource):
         self.route('PUT', (':id', 'access'), self.updateTaleAccess)
         self.route('PUT', (':id', 'git'), self.updateTaleWithGitRepo)
         self.route('GET', (':id', 'export'), self.exportTale)
+        self.route('POST', (':id', 'export'), self.buildExport)
         self.route('GET', (':id', 'listing'), self.listTaleFiles)
         self.route('GET', (':id', 'manifest'), self.generateManifest)
         self.route('PUT', (':id', 'build'), self.buildImage)
@@ -243,7 +248,9 @@ class Tale(Resource):
         if taleKwargs is None:
             taleKwargs = {}
 
-        if cherrypy.request.headers.get('Content-Type') == 'application/zip':
+        if cherrypy.request.headers.get('Content-Type') in (
+            'application/zip', 'application/zstd', 'application/gzip'
+        ):
             tale = taleModel().createTaleFromStream(iterBody, user=user)
         else:
             if not url:
@@ -500,7 +507,7 @@ class Tale(Resource):
         """Return a version object for a valid versionId, or the last version otherwise."""
         if not versionId:
             version_root = Folder().load(tale["versionsRootId"], user=user, level=AccessType.READ)
-            return next(
+            version = next(
                 Folder().childFolders(
                     version_root,
                     "folder",
@@ -508,32 +515,55 @@ class Tale(Resource):
                     limit=1,
                     offset=0,
                     sort=[("updated", SortDir.DESCENDING)],
-                )
+                ),
+                None
             )
+            if version is None:
+                raise RestException("Tale has no versions.")
+            return version
         else:
             return Folder().load(versionId, user=user, level=AccessType.READ)
 
     @access.user
     @autoDescribeRoute(
-        Description('Export a tale as a zipfile')
+        Description('Export a tale as a zipfile or a compressed tarball')
         .modelParam('id', model='tale', plugin='wholetale', level=AccessType.READ)
         .param('taleFormat', 'Format of the exported Tale', required=False,
                enum=['bagit', 'native'], strip=True, default='native')
         .param('versionId', 'Specific version to export', required=False)
+        .param('archiveFormat', 'Container of the exported Tale. Compressed tarballs '
+               'are meant for archival transfer of large Tales.', required=False,
+               enum=list(ARCHIVE_FORMATS), strip=True, default='zip')
         .responseClass('tale')
-        .produces('application/zip')
+        .produces([mime_type for mime_type, _ in ARCHIVE_FORMATS.values()])
+        .notes('If the zip export was built beforehand (see POST /tale/{id}/export) and '
+               'still matches the version, it is served with support for ETag and '
+               'Range requests.')
         .errorResponse('ID was invalid.', 404)
         .errorResponse('You are not authorized to export this tale.', 403)
+        .errorResponse('Not modified (If-None-Match matches the ETag of the export).', 304)
+        .errorResponse('Requested range not satisfiable.', 416)
     )
-    def exportTale(self, tale, taleFormat, versionId):
+    def exportTale(self, tale, taleFormat, versionId, archiveFormat):
         user = self.getCurrentUser()
         version = self._get_version(user, tale, versionId)
+        # Documents loaded while building the manifest are reused by the exporter
+        models = ModelCache()
+        models.add(Folder(), version)
 
         # Get the manifest for the version, which may contain recorded run information
         manifest_doc = Manifest(
-            tale, self.getCurrentUser(), expand_folders=True, versionId=version["_id"]
+            tale, self.getCurrentUser(), expand_folders=True, versionId=version["_id"],
+            cache=True, models=models
         )
 
+        if archiveFormat == 'zip':
+            artifact = ExportArtifact().findArtifact(
+                version, taleFormat, manifest_doc.content_hash
+            )
+            if artifact and artifact["status"] == ExportArtifactStatus.READY:
+                return self._serveExportArtifact(artifact)
+
         with open(os.path.join(version["fsPath"], "environment.json"), "r") as fp:
             environment = json.load(fp)
 
@@ -542,11 +572,98 @@ class Tale(Resource):
         elif taleFormat == 'native':
             export_func = NativeTaleExporter
 
-        exporter = export_func(user, manifest_doc.manifest, environment)
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition(f"{version['_id']}.zip")
+        exporter = export_func(
+            user, manifest_doc.manifest, environment, models=models, archive=archiveFormat
+        )
+        mime_type, extension = ARCHIVE_FORMATS[archiveFormat]
+        setResponseHeader('Content-Type', mime_type)
+        setContentDisposition(f"{version['_id']}{extension}")
         return exporter.stream
 
+    @staticmethod
+    def _checkNotModified(etag):
+        """Set the ETag of the response, ending it with 304 if If-None-Match matches."""
+        setResponseHeader("ETag", etag)
+        if_none_match = cherrypy.request.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in (
+            _.strip() for _ in if_none_match.split(",")
+        ):
+            raise cherrypy.HTTPRedirect([], 304)
+
+    def _serveExportArtifact(self, artifact):
+        file = File().load(artifact["fileId"], force=True, exc=True)
+        etag = f'"{artifact["manifestHash"]}-{artifact["format"]}"'
+        setResponseHeader("Accept-Ranges", "bytes")
+        self._checkNotModified(etag)
+
+        offset, endByte = 0, None
+        # If-Range with a stale validator means the whole file has to be sent
+        if cherrypy.request.headers.get("If-Range", etag) == etag:
+            ranges = cherrypy.lib.httputil.get_ranges(
+                cherrypy.request.headers.get("Range"), file["size"]
+            )
+            if ranges == []:
+                setResponseHeader("Content-Range", f"bytes */{file['size']}")
+                raise cherrypy.HTTPError(416)
+            if ranges:
+                # Only a single range is supported
+                offset, endByte = ranges[0]
+                cherrypy.response.status = 206
+        return File().download(
+            file, offset, endByte=endByte, contentDisposition="attachment"
+        )
+
+    @access.user
+    @autoDescribeRoute(
+        Description('Build an exported zip of a Tale in the background')
+        .notes('Once the job finishes, GET /tale/{id}/export serves the stored zip '
+               'to anyone who can read the version, for as long as their manifest of '
+               'the version is the same as the one it was built from.')
+        .modelParam('id', model='tale', plugin='wholetale', level=AccessType.WRITE)
+        .param('taleFormat', 'Format of the exported Tale', required=False,
+               enum=['bagit', 'native'], strip=True, default='native')
+        .param('versionId', 'Specific version to export', required=False)
+        .errorResponse('ID was invalid.', 404)
+        .errorResponse('You are not authorized to export this tale.', 403)
+    )
+    def buildExport(self, tale, taleFormat, versionId):
+        user = self.getCurrentUser()
+        version = self._get_version(user, tale, versionId)
+        manifest_doc = Manifest(
+            tale, user, expand_folders=True, versionId=version["_id"], cache=True
+        )
+        manifestHash = manifest_doc.content_hash
+        artifact = ExportArtifact().findArtifact(version, taleFormat, manifestHash)
+        if artifact is None:
+            artifact = ExportArtifact().createArtifact(
+                tale, version, taleFormat, manifestHash, user
+            )
+            resource = {
+                "type": "wt_export",
+                "tale_id": tale["_id"],
+                "tale_title": tale["title"],
+                "version_id": version["_id"],
+            }
+            notification = init_progress(
+                resource, user, "Exporting Tale", "Initializing", 100
+            )
+            job = Job().createLocalJob(
+                title=f'Export "{tale["title"]}" ({taleFormat})',
+                user=user,
+                type="wholetale.build_export",
+                public=False,
+                _async=True,
+                module="girder.plugins.wholetale.tasks.build_export",
+                kwargs={"artifactId": artifact["_id"]},
+                otherFields={
+                    "taleId": tale["_id"],
+                    "wt_notification_id": str(notification["_id"]),
+                },
+            )
+            artifact = ExportArtifact().setJob(artifact, job)
+            Job().scheduleJob(job)
+        return ExportArtifact().filter(artifact, user)
+
     @access.public
     @autoDescribeRoute(
         Description('Generate the Tale manifest')
@@ -558,6 +675,7 @@ class Tale(Resource):
             "versionId", "The specific Tale version that the manifest describes", required=False
         )
         .errorResponse('ID was invalid.')
+        .errorResponse('Not modified (If-None-Match matches the ETag of the manifest).', 304)
     )
     def generateManifest(self, tale, expandFolders, versionId):
         """
@@ -567,8 +685,10 @@ class Tale(Resource):
         :return: A JSON structure representing the Tale
         """
         manifest_doc = Manifest(
-            tale, self.getCurrentUser(), expand_folders=expandFolders, versionId=versionId
+            tale, self.getCurrentUser(), expand_folders=expandFolders, versionId=versionId,
+            cache=True
         )
+        self._checkNotModified(f'"{manifest_doc.etag}"')
         return manifest_doc.manifest
 
     @access.user
@@ -611,6 +731,11 @@ class Tale(Resource):
                 tale["imageInfo"]["imageId"] = tale["imageId"]
                 tale['imageInfo']['repo2docker_version'] = result['repo2docker_version']
                 tale['imageInfo']['last_build'] = result['last_build']
+                # The state of the environment when the build was started
+                if job.get('wt_env_fingerprint'):
+                    tale['imageInfo']['fingerprint'] = job['wt_env_fingerprint']
+                else:
+                    tale['imageInfo'].pop('fingerprint', None)
                 tale['imageInfo']['status'] = ImageStatus.AVAILABLE
             elif status == JobStatus.ERROR:
                 tale["imageInfo"]["status"] = ImageStatus.INVALID
@@ -9,6 +9,9 @@ from girder.models.collection import Collection
 from girder.models.folder import Folder
 
 from ..constants import API_VERSION, PluginSettings
+from ..lib import RESOLVERS
+from ..lib.entity import Entity
+from ..models.resolution_cache import ResolutionCache
 from ..models.tale import Tale
 import os
 
@@ -22,6 +25,7 @@ class wholeTale(Resource):
         self.route('PUT', ('citations',), self.regenerate_citations)
         self.route('GET', ('settings',), self.get_settings)
         self.route('GET', ('assets',), self.get_assets)
+        self.route('DELETE', ('resolution_cache',), self.purge_resolution_cache)
 
     @access.public
     @autoDescribeRoute(Description('Return basic info about Whole Tale plugin'))
@@ -40,6 +44,26 @@ class wholeTale(Resource):
             eventParams = {'tale': tale, 'user': user}
             events.trigger(eventName='tale.update_citation', info=eventParams)
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Remove cached resolutions of DOIs and Minids.')
+        .notes('Without an identifier, all cached resolutions are removed.')
+        .param('identifier', 'A DOI or Minid, e.g. doi:10.5065/D6862DM8',
+               required=False)
+        .param('failuresOnly', 'Only remove failed resolutions.',
+               required=False, dataType='boolean', default=False)
+    )
+    def purge_resolution_cache(self, identifier, failuresOnly):
+        cache = ResolutionCache()
+        if identifier is None:
+            return {'removed': cache.purge(failuresOnly=failuresOnly)}
+        entity = Entity(identifier.strip(), self.getCurrentUser())
+        removed = sum(
+            cache.purge(key=key, failuresOnly=failuresOnly)
+            for key in RESOLVERS.cacheKeys(entity)
+        )
+        return {'removed': removed}
+
     @access.public
     @autoDescribeRoute(
         Description('Return Whole Tale plugin settings.')
@@ -239,6 +239,7 @@ imageInfoSchema = {
     "type": "object",
     "properties": {
         "digest": {"type": "string"},
+        "fingerprint": {"type": "string"},
         "imageId": {"type": "string"},
         "jobId": {"type": "string"},
         "last_build": {"type": "integer"},
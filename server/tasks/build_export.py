@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from girder.models.assetstore import Assetstore
+from girder.models.folder import Folder
+from girder.models.upload import Upload
+from girder.models.user import User
+from girder.plugins.jobs.constants import JobStatus
+from girder.plugins.jobs.models.job import Job
+from girder.utility import assetstore_utilities
+
+from ..lib.exporters.bag import BagTaleExporter
+from ..lib.exporters.native import NativeTaleExporter
+from ..lib.manifest import Manifest
+from ..lib.metrics import metricsLogger
+from ..lib.model_cache import ModelCache
+from ..models.export_artifact import ExportArtifact
+from ..models.tale import Tale
+
+EXPORTERS = {"bagit": BagTaleExporter, "native": NativeTaleExporter}
+PROGRESS_INTERVAL = 2  # seconds between job progress updates
+
+
+def run(job):
+    jobModel = Job()
+    jobModel.updateJob(job, status=JobStatus.RUNNING)
+
+    artifact = ExportArtifact().load(job["kwargs"]["artifactId"], force=True)
+    user = User().load(job["userId"], force=True)
+    tale = Tale().load(artifact["taleId"], force=True)
+    version = Folder().load(artifact["versionId"], force=True)
+    progressTotal = 100
+
+    try:
+        models = ModelCache()
+        models.add(Folder(), version)
+        manifest_doc = Manifest(
+            tale, user, expand_folders=True, versionId=version["_id"], cache=True,
+            models=models
+        )
+        # The exporter adds checksums to the manifest
+        manifestHash = manifest_doc.content_hash
+        with open(os.path.join(version["fsPath"], "environment.json"), "r") as fp:
+            environment = json.load(fp)
+        exporter = EXPORTERS[artifact["format"]](
+            user, manifest_doc.manifest, environment, models=models
+        )
+        # Zip overhead and tag files are not accounted for, hence min() below
+        expected_size = sum(
+            os.path.getsize(fullpath) for fullpath, _ in exporter.list_files()
+        ) or 1
+
+        assetstore = Assetstore().getCurrent()
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        with tempfile.NamedTemporaryFile(dir=adapter.tempDir) as fp:
+            last_update = time.monotonic()
+            for chunk in exporter.stream():
+                fp.write(chunk)
+                if time.monotonic() - last_update > PROGRESS_INTERVAL:
+                    last_update = time.monotonic()
+                    jobModel.updateJob(
+                        job,
+                        progressTotal=progressTotal,
+                        progressCurrent=min(99, 100 * fp.tell() // expected_size),
+                        progressMessage="Creating zip file",
+                    )
+            size = fp.tell()
+            fp.seek(0)
+            file = Upload().uploadFromFile(
+                fp, size, f"{version['_id']}.zip", parentType=None, parent=None,
+                user=user, mimeType="application/zip", assetstore=assetstore,
+            )
+        ExportArtifact().setReady(artifact, file, manifestHash)
+        jobModel.updateJob(
+            job,
+            status=JobStatus.SUCCESS,
+            log="Export finished",
+            progressTotal=progressTotal,
+            progressCurrent=progressTotal,
+            progressMessage="Export finished",
+        )
+    except Exception:
+        ExportArtifact().setError(artifact)
+        t, val, tb = sys.exc_info()
+        log = "%s: %s\n%s" % (t.__name__, repr(val), traceback.extract_tb(tb))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
+
+    metricsLogger.info(
+        "tale.export_built",
+        extra={
+            "details": {
+                "id": tale["_id"],
+                "versionId": version["_id"],
+                "format": artifact["format"],
+                "size": size,
+            }
+        },
+    )
@@ -1,17 +1,102 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
+import datetime
+import os
+import threading
+import time
+
 from girder.models.user import User
 from girder.plugins.jobs.constants import JobStatus
 from girder.plugins.jobs.models.job import Job
 
 from ..lib import register_dataMap
+from ..lib.batch_register import RegistrationCheckpoint
 from ..lib.data_map import DataMap
 from ..lib.metrics import metricsLogger
 
+PROGRESS_INTERVAL = float(os.environ.get("GIRDER_WT_REGISTER_PROGRESS_INTERVAL", 2))
+# Has to be well below GIRDER_WT_REGISTER_RESUME_AFTER, see DatasetResource.resumeImportData
+HEARTBEAT_INTERVAL = float(os.environ.get("GIRDER_WT_REGISTER_HEARTBEAT_INTERVAL", 60))
+
+
+def _format_size(size):
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            break
+        size /= 1000
+    return f"{size:.0f} B" if unit == "B" else f"{size:.1f} {unit}"
+
+
+class JobCheckpoint(RegistrationCheckpoint):
+    """
+    Checkpoint of the registration kept in the job document, so that the job can
+    be resumed. Every save reports the registration rate as the progress message,
+    which updateNotification forwards to the wt_notification of the job.
+    """
+
+    def __init__(self, job):
+        super().__init__(**job.get("checkpoint", {}))
+        self.job = job
+        self._start = time.monotonic()
+        self._startFiles = self.files
+        self._startBytes = self.bytes
+        self._saved = self._start
+
+    @property
+    def resumed(self):
+        return bool(self.dataMap or self.path)
+
+    def message(self):
+        elapsed = max(time.monotonic() - self._start, 1e-3)
+        return "Registered {} files ({}), {:.1f} files/s, {}/s".format(
+            self.files,
+            _format_size(self.bytes),
+            (self.files - self._startFiles) / elapsed,
+            _format_size((self.bytes - self._startBytes) / elapsed),
+        )
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._saved < PROGRESS_INTERVAL:
+            return
+        self._saved = now
+        Job().updateJob(
+            self.job,
+            progressMessage=self.message(),
+            otherFields={"checkpoint": self.toDict()},
+        )
+
+    @contextmanager
+    def heartbeat(self, interval=HEARTBEAT_INTERVAL):
+        """
+        Touch the job every `interval` seconds while the block runs, so that a
+        registration waiting on a slow listing is not taken for a stalled one.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                Job().update(
+                    {"_id": self.job["_id"]},
+                    {"$set": {"updated": datetime.datetime.utcnow()}},
+                    multi=False,
+                )
+
+        thread = threading.Thread(target=beat, name="wt-register-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
 
 def run(job):
     data_maps, parent, parentType, user = job["args"]
+    # The copy in the job is as old as the job, which may have been resumed
+    user = User().load(user["_id"], force=True)
     base_url = job["kwargs"].get("base_url")
     # In case this job is a part of a more complex task, progressTotal and progressCurrent can be
     # passed as kwargs to take that into account
@@ -20,38 +105,49 @@ def run(job):
 
     progressCurrent += 1
     jobModel = Job()
+    checkpoint = JobCheckpoint(job)
     jobModel.updateJob(
         job,
         status=JobStatus.RUNNING,
-        progressMessage="Registering Datasets",
+        progressMessage="Resuming registration" if checkpoint.resumed else "Registering Datasets",
         progressTotal=progressTotal,
         progressCurrent=progressCurrent,
     )
 
     # Notice progress=False below: we want to prevent default Girder progress notifications from
-    # being emitted, since all we care about is the wt_notification encompassing this job. We lose a
-    # lot of granularity here.
-    # TODO: pass progress context associated with wt_notification perhaps?
+    # being emitted, since all we care about is the wt_notification encompassing this job.
+    # The checkpoint reports the registration rate there instead.
     dataMaps = DataMap.fromList(data_maps)
-    importedData = register_dataMap(
-        dataMaps,
-        parent,
-        parentType,
-        user=user,
-        base_url=base_url,
-        progress=False
-    )
+    try:
+        with checkpoint.heartbeat():
+            importedData = register_dataMap(
+                dataMaps,
+                parent,
+                parentType,
+                user=user,
+                base_url=base_url,
+                progress=False,
+                checkpoint=checkpoint,
+            )
+    except Exception as exc:
+        # Leave the checkpoint, so that the registration can be resumed
+        checkpoint.save(force=True)
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=f"Registration failed: {exc}\n")
+        raise
+
     if importedData:
-        user_data = set(user.get("myData", []))
-        user["myData"] = list(user_data.union(set(importedData)))
-        user = User().save(user)
+        User().update(
+            {"_id": user["_id"]},
+            {"$addToSet": {"myData": {"$each": importedData}}},
+            multi=False,
+        )
 
     # For some reason updating both status and progress keywords swallows a notification. Let's do
     # it in two steps then.
     progressCurrent += 1
     jobModel.updateJob(
         job,
-        progressMessage="Datasets registered",
+        progressMessage=f"Datasets registered. {checkpoint.message()}",
         progressTotal=progressTotal,
         progressCurrent=progressCurrent,
     )